@@ -0,0 +1,64 @@
+import sys, threading
+from Queue import Queue, Empty, Full
+
+class ActorPool(object):
+    '''Actor threads that roll out episodes with rollout_episode(actor_id)
+    and put them on a bounded queue, each tagged with policy_version() as
+    read when its rollout started.
+
+    The actors block while the queue is full, so they run at most
+    queue_size episodes ahead of the learner. They share the learner's
+    session; env steps and session runs release the GIL. An exception in
+    an actor stops the others and is re-raised by get().'''
+
+    def __init__(self, n_actors, rollout_episode, policy_version,
+                 queue_size=16, poll_secs=1.):
+        self.rollout_episode = rollout_episode
+        self.policy_version = policy_version
+        self.poll_secs = poll_secs
+        self.queue = Queue(queue_size)
+        self.stopped = threading.Event()
+        self.error = None
+        self.threads = []
+        for actor_id in xrange(n_actors):
+            thread = threading.Thread(target=self.run, args=(actor_id,),
+                                      name='actor-%i' % actor_id)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self, actor_id):
+        try:
+            while not self.stopped.is_set():
+                version = self.policy_version()
+                episode = self.rollout_episode(actor_id)
+                while not self.stopped.is_set():
+                    try:
+                        self.queue.put((version, episode),
+                                       timeout=self.poll_secs)
+                        break
+                    except Full:
+                        pass
+        except Exception:
+            if self.error is None:
+                self.error = sys.exc_info()
+            self.stopped.set()
+
+    def get(self, n):
+        '''the policy versions and the episodes of the next n finished
+        rollouts'''
+        items = []
+        while len(items) < n:
+            if self.error is not None:
+                raise self.error[0], self.error[1], self.error[2]
+            try:
+                items.append(self.queue.get(timeout=self.poll_secs))
+            except Empty:
+                pass
+        versions, episodes = zip(*items)
+        return list(versions), list(episodes)
+
+    def close(self, timeout=10.):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+'''search for the batching and session threading flags of a trainer that
+give the most learner samples per second on this machine
+
+Every trial runs the trainer for 2 * n_trial_steps iterations in a fresh
+process and reads the learner samples/s and the peak RSS of the second
+half from its metrics records. The flags are tuned one at a time, each
+from its candidates with the others held at the best values so far, and
+trials whose peak RSS exceeds --memory_cap_mb are discarded. The best
+flags are written as JSON for the --tuned_config flag of the trainers.
+
+usage: python autotune.py --trainer train_q --output tuned.json \\
+           -- --model simple_q --env CartPole-v0
+'''
+
+import os, sys, json, shutil, tempfile, subprocess, multiprocessing
+import argparse
+
+def candidate_threads():
+    n_cpus = multiprocessing.cpu_count()
+    return sorted(set([1, 2, 4, n_cpus // 2, n_cpus]) - set([0]))
+
+# flag -> candidate values, in the order they are tuned
+SEARCH_SPACE = [
+    ('n_batch_ticks', [32, 64, 128, 256, 512]),
+    ('n_update_episodes', [1, 2, 4, 8, 16]),
+    ('intra_op_threads', candidate_threads()),
+    ('inter_op_threads', [1, 2, 4]),
+]
+
+# trainer defaults of the tuned flags
+INITIAL = {
+    'n_batch_ticks': 128,
+    'n_update_episodes': 4,
+    'intra_op_threads': 0,
+    'inter_op_threads': 0,
+}
+
+def run_trial(trainer, trainer_args, flags, n_trial_steps):
+    '''learner samples/s and peak RSS in MB of a short run with flags'''
+    work_dir = tempfile.mkdtemp(prefix='autotune-')
+    metrics_path = os.path.join(work_dir, 'metrics.jsonl')
+    cmd = [sys.executable, trainer + '.py'] + trainer_args + [
+        '--checkpoint_dir', os.path.join(work_dir, 'checkpoints'),
+        '--no_summary',
+        '--n_train_steps', str(2 * n_trial_steps),
+        '--n_save_interval', str(10**9),
+        # the first report covers the warmup
+        '--n_timing_interval', str(n_trial_steps),
+        '--n_memory_interval', str(n_trial_steps),
+        '--metrics_path', metrics_path,
+    ]
+    for k, v in sorted(flags.iteritems()):
+        cmd += ['--%s' % k, str(v)]
+    try:
+        with open(os.devnull, 'wb') as devnull:
+            subprocess.check_call(cmd, stdout=devnull, stderr=devnull,
+                                  cwd=os.path.dirname(
+                                      os.path.abspath(__file__)))
+        with open(metrics_path) as f:
+            records = [json.loads(line) for line in f]
+    except (subprocess.CalledProcessError, IOError) as e:
+        print '* trial failed: %s' % e
+        return None, None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    last = records[-1]
+    return (last.get('throughput/learner_samples_per_sec', 0.),
+            last.get('memory/peak_rss_mb', 0.))
+
+def tune(trainer, trainer_args, n_trial_steps, memory_cap_mb, n_passes=1):
+    '''coordinate search over SEARCH_SPACE, returns the best flags and all
+    trials'''
+    best = dict(INITIAL)
+    best_rate = None
+    trials = []
+    tried = {}
+    for _ in xrange(n_passes):
+        for flag, candidates in SEARCH_SPACE:
+            for value in candidates:
+                flags = dict(best)
+                flags[flag] = value
+                key = tuple(sorted(flags.iteritems()))
+                if key not in tried:
+                    tried[key] = run_trial(trainer, trainer_args, flags,
+                                           n_trial_steps)
+                    rate, rss = tried[key]
+                    trials.append({'flags': flags, 'samples_per_sec': rate,
+                                   'peak_rss_mb': rss})
+                    print '%-64s %10s samples/s %10s MB' % (
+                        ' '.join('%s=%s' % kv for kv in key),
+                        '%.1f' % rate if rate is not None else '-',
+                        '%.1f' % rss if rss is not None else '-')
+                rate, rss = tried[key]
+                if rate is None or (memory_cap_mb > 0 and rss > memory_cap_mb):
+                    continue
+                if best_rate is None or rate > best_rate:
+                    best, best_rate = flags, rate
+    return best, best_rate, trials
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser()
+    parse.add_argument('--trainer', choices=['train_policy_gradient',
+                                             'train_q', 'train_sars',
+                                             'train_sarsa'], required=True)
+    parse.add_argument('--n_trial_steps', type=int, default=10)
+    parse.add_argument('--memory_cap_mb', type=float, default=0.)
+    parse.add_argument('--n_passes', type=int, default=1)
+    parse.add_argument('--output', default='tuned.json')
+    parse.add_argument('trainer_args', nargs=argparse.REMAINDER,
+                       help='flags passed on to the trainer, after --')
+
+    args = parse.parse_args()
+    trainer_args = [a for a in args.trainer_args if a != '--']
+
+    best, best_rate, trials = tune(args.trainer, trainer_args,
+                                   args.n_trial_steps, args.memory_cap_mb,
+                                   args.n_passes)
+    if best_rate is None:
+        print '* no trial finished within the memory cap'
+        sys.exit(1)
+
+    print '* best configuration, %.1f learner samples/s' % best_rate
+    for k in sorted(best.keys()):
+        print k, best[k]
+    with open(args.output, 'wb') as f:
+        json.dump(best, f, indent=2, sort_keys=True)
+    with open(args.output + '.trials', 'wb') as f:
+        json.dump(trials, f, indent=2, sort_keys=True)
+    print '* wrote %s, use it with --tuned_config %s' % (args.output,
+                                                      args.output)
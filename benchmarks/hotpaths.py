@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+'''timings of the rollout and training hot paths
+
+Measures in isolation
+  - util.rollout against an env and a policy that cost next to nothing,
+    on vector observations and on scaled rendered images,
+  - util.duplicate_obs over util.pad_zeros of an episode,
+  - util.vector_slice in a session,
+  - the batched gradient accumulation of one policy gradient update,
+and end to end the seconds per iteration of every trainer with each of its
+models, run in-process against a synthetic.SyntheticEnv.
+
+Every benchmark reports the median and the minimum over n_repeats after a
+warmup. The results are written out as each benchmark finishes; one that
+fails is recorded with its error under failures, the others still run and
+the exit status is 1. With --baseline the results are compared with a file
+written by an earlier run and benchmarks slower by more than --tolerance
+are flagged.
+
+usage: python -m benchmarks.hotpaths [--output hotpaths.json]
+           [--baseline baseline.json] [--only REGEX]
+'''
+
+import os, sys, time, json, re, shutil, tempfile, importlib, traceback
+import argparse
+from functools import partial
+from timeit import default_timer
+import numpy as np
+
+from util import rollout, pad_zeros, duplicate_obs, use_render_state, \
+    generalized_advantages
+from synthetic import SyntheticEnv, synthetic_env
+from reset_pool import ResetPool
+
+VECTOR_SHAPE = [4]
+IMAGE_SHAPE = [42, 42, 3]
+
+# trainer module, train function, model modules
+TRAINERS = [
+    ('train_policy_gradient', 'train', ['simple', 'simple2', 'cnn']),
+    ('train_q', 'train_q', ['simple_q', 'simple2_q', 'simple3_q', 'cnn_q']),
+    ('train_sars', 'train_q', ['simple_q', 'simple2_q', 'simple3_q',
+                               'cnn_q']),
+    ('train_sarsa', 'train_q', ['simple_q', 'simple2_q', 'simple3_q',
+                                'cnn_q']),
+]
+
+def observation_shape_of(model):
+    return IMAGE_SHAPE if model.startswith('cnn') else VECTOR_SHAPE
+
+def time_repeats(fn, n_repeats, n_warmup=1):
+    '''median and minimum seconds of fn() over n_repeats'''
+    for _ in xrange(n_warmup):
+        fn()
+    secs = []
+    for _ in xrange(n_repeats):
+        t0 = default_timer()
+        fn()
+        secs.append(default_timer() - t0)
+    return {'secs': float(np.median(secs)), 'min_secs': float(np.min(secs)),
+            'n_repeats': n_repeats}
+
+def bench_rollout(n_repeats, episode_length, n_obs_ticks, scale=None,
+                  n_spare_envs=0):
+    '''rollouts of vector observations, or of rendered images scaled by
+    scale through util.use_render_state, with resets in the background
+    for n_spare_envs > 0'''
+    np.random.seed(0)
+    def make():
+        if scale is None:
+            return synthetic_env(VECTOR_SHAPE, 2,
+                                 episode_length=episode_length)
+        return use_render_state(
+            SyntheticEnv(IMAGE_SHAPE, 2, episode_length=episode_length),
+            scale)
+    if n_spare_envs > 0:
+        spec, step, reset, _ = ResetPool(
+            [make() for _ in xrange(n_spare_envs + 1)]).env()
+    else:
+        spec, step, reset, _ = make()
+    spec['timestep_limit'] = episode_length
+    probs = np.ones(2) / 2.
+    r = time_repeats(lambda: rollout(lambda obs: probs, spec, step, reset,
+                                     n_obs_ticks=n_obs_ticks), n_repeats)
+    r['ticks_per_sec'] = episode_length / r['secs']
+    return r
+
+def bench_duplicate_obs(n_repeats, episode_length, observation_shape,
+                        n_obs_ticks):
+    rng = np.random.RandomState(0)
+    observations = [rng.uniform(size=observation_shape)
+                    for _ in xrange(episode_length)]
+    r = time_repeats(lambda: duplicate_obs(pad_zeros(observations,
+                                                     n_obs_ticks),
+                                           n_obs_ticks), n_repeats)
+    r['ticks_per_sec'] = episode_length / r['secs']
+    return r
+
+def bench_gae(n_repeats, episode_length, n_episodes):
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(1, 2 * episode_length, size=n_episodes)
+    rewards = [rng.uniform(size=n) for n in lengths]
+    values = [rng.uniform(size=n) for n in lengths]
+    r = time_repeats(lambda: generalized_advantages(rewards, values, 0.99,
+                                                    0.95), n_repeats)
+    r['ticks_per_sec'] = np.sum(lengths) / r['secs']
+    return r
+
+def bench_vector_slice(n_repeats, n_rows, n_columns):
+    import tensorflow as tf
+    from util import vector_slice
+    rng = np.random.RandomState(0)
+    with tf.Graph().as_default():
+        a_ph = tf.placeholder('float', [None, n_columns])
+        b_ph = tf.placeholder('int32', [None])
+        sliced = vector_slice(a_ph, b_ph)
+        feed = {
+            a_ph: rng.uniform(size=(n_rows, n_columns)),
+            b_ph: rng.randint(n_columns, size=n_rows),
+        }
+        with tf.Session() as sess:
+            return time_repeats(lambda: sess.run(sliced, feed_dict=feed),
+                                n_repeats)
+
+def bench_gradient_accumulation(n_repeats, model, n_ticks, n_batch_ticks):
+    '''one policy gradient update worth of batched gradient evaluations'''
+    import tensorflow as tf
+    import train_policy_gradient
+    args = vars(train_policy_gradient.build_argparser().parse_args([
+        '--model', model, '--checkpoint_dir', '', '--no_summary',
+        '--n_batch_ticks', str(n_batch_ticks)]))
+    observation_shape = observation_shape_of(model)
+    build_model = importlib.import_module('models.%s' % model).build_model
+    rng = np.random.RandomState(0)
+    with tf.Graph().as_default():
+        tf.set_random_seed(args['tf_seed'])
+        h = train_policy_gradient.build_graph(observation_shape, 2, args,
+                                              build_model)
+        obs = rng.uniform(size=[n_ticks] + observation_shape)
+        actions = rng.randint(2, size=n_ticks)
+        advantages = rng.uniform(size=n_ticks)
+        with tf.Session() as sess:
+            sess.run(tf.initialize_all_variables())
+
+            accumulate = partial(train_policy_gradient.accumulate_gradients,
+                                 sess, h, obs, actions, advantages, args)
+            r = time_repeats(accumulate, n_repeats)
+    r['samples_per_sec'] = n_ticks / r['secs']
+    return r
+
+def bench_train(n_repeats, trainer, train_fn, model, episode_length):
+    '''seconds per training iteration, read off the metrics records'''
+    module = importlib.import_module(trainer)
+    model_module = importlib.import_module('models.%s' % model)
+    build = getattr(model_module, 'build_model', None) \
+        or model_module.build_q_model
+    work_dir = tempfile.mkdtemp(prefix='bench-%s-%s-' % (trainer, model))
+    metrics_path = os.path.join(work_dir, 'metrics.jsonl')
+    try:
+        args = vars(module.build_argparser().parse_args([
+            '--model', model,
+            '--checkpoint_dir', os.path.join(work_dir, 'checkpoints'),
+            '--no_summary',
+            # the first iteration is a warmup
+            '--n_train_steps', str(n_repeats + 1),
+            '--n_save_interval', str(10**9),
+            '--metrics_path', metrics_path,
+            '--metrics_flush_secs', str(10**9),
+        ]))
+        np.random.seed(0)
+        env_spec, env_step, env_reset, env_render = synthetic_env(
+            observation_shape_of(model), 2, episode_length=episode_length)
+        env_spec['timestep_limit'] = episode_length
+        getattr(module, train_fn)(env_spec, env_step, env_reset, None, args,
+                                  build)
+        with open(metrics_path) as f:
+            records = [json.loads(line) for line in f]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    times = [record['time'] for record in records]
+    secs = np.diff(times)
+    n_ticks = np.sum([record['env_ticks'] for record in records[1:]])
+    return {
+        'secs': float(np.median(secs)),
+        'min_secs': float(np.min(secs)),
+        'n_repeats': len(secs),
+        'ticks_per_sec': float(n_ticks / (times[-1] - times[0])),
+    }
+
+def benchmarks(args):
+    '''name -> thunk of every benchmark'''
+    n = args.n_repeats
+    bs = [
+        ('rollout/obs_ticks_1',
+         lambda: bench_rollout(n, args.episode_length, 1)),
+        ('rollout/obs_ticks_4',
+         lambda: bench_rollout(n, args.episode_length, 4)),
+        ('rollout/render_state',
+         lambda: bench_rollout(n, args.episode_length, 1, 0.5)),
+        ('rollout/render_state_reset_pool',
+         lambda: bench_rollout(n, args.episode_length, 1, 0.5, 1)),
+        ('duplicate_obs/vector',
+         lambda: bench_duplicate_obs(n, args.episode_length, VECTOR_SHAPE,
+                                     4)),
+        ('duplicate_obs/image',
+         lambda: bench_duplicate_obs(n, args.episode_length, IMAGE_SHAPE,
+                                     4)),
+        ('gae',
+         lambda: bench_gae(n, args.episode_length, 16)),
+        ('vector_slice',
+         lambda: bench_vector_slice(n, args.n_batch_ticks, 18)),
+    ]
+    for model in ['simple', 'cnn']:
+        bs.append(('gradient_accumulation/%s' % model,
+                   partial(bench_gradient_accumulation, n, model,
+                           args.n_ticks, args.n_batch_ticks)))
+    for trainer, train_fn, models in TRAINERS:
+        for model in models:
+            bs.append(('train/%s/%s' % (trainer, model),
+                       partial(bench_train, n, trainer, train_fn, model,
+                               args.episode_length)))
+    return bs
+
+def compare(results, baseline, tolerance):
+    '''ratio of every benchmark to the baseline and whether it regressed'''
+    comparison = {}
+    for name, r in sorted(results.iteritems()):
+        if name not in baseline:
+            continue
+        ratio = r['secs'] / baseline[name]['secs']
+        comparison[name] = {
+            'ratio': ratio,
+            'regressed': ratio > 1. + tolerance,
+        }
+        print '%-48s %8.4fs %8.4fs %6.2fx%s' % (
+            name, baseline[name]['secs'], r['secs'], ratio,
+            ' REGRESSED' if ratio > 1. + tolerance else '')
+    return comparison
+
+def write_output(path, output):
+    '''write output to path through a temporary file, so an interrupted
+    run leaves the results of the benchmarks done so far'''
+    with open(path + '.tmp', 'wb') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser()
+    parse.add_argument('--n_repeats', type=int, default=5)
+    parse.add_argument('--episode_length', type=int, default=200)
+    parse.add_argument('--n_ticks', type=int, default=512)
+    parse.add_argument('--n_batch_ticks', type=int, default=128)
+    parse.add_argument('--only', help='run benchmarks matching this regex')
+    parse.add_argument('--output', default='hotpaths.json')
+    parse.add_argument('--baseline')
+    parse.add_argument('--tolerance', type=float, default=0.1)
+    parse.add_argument('--strict', action='store_true',
+                       help='exit with status 1 on a regression')
+
+    args = parse.parse_args()
+
+    results = {}
+    failures = {}
+    output = {
+        'benchmarks': results,
+        'failures': failures,
+        'python': sys.version,
+        'time': time.time(),
+        'settings': vars(args),
+    }
+    for name, bench in benchmarks(args):
+        if args.only is not None and not re.search(args.only, name):
+            continue
+        print '* %s' % name
+        try:
+            results[name] = bench()
+        except Exception as e:
+            # one broken configuration must not take the others down
+            traceback.print_exc()
+            failures[name] = '%s: %s' % (type(e).__name__, e)
+            print '%-48s FAILED' % name
+        else:
+            print '%-48s median %.4fs min %.4fs' % (
+                name, results[name]['secs'], results[name]['min_secs'])
+        write_output(args.output, output)
+
+    regressed = False
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['benchmarks']
+        print '* compared with', args.baseline
+        output['comparison'] = compare(results, baseline, args.tolerance)
+        regressed = any(c['regressed']
+                        for c in output['comparison'].itervalues())
+
+    write_output(args.output, output)
+    print '* results written to', args.output
+    if failures:
+        print '* %i benchmarks failed: %s' % (len(failures),
+                                              ', '.join(sorted(failures)))
+        sys.exit(1)
+    if regressed and args.strict:
+        sys.exit(1)
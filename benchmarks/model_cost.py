@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+'''cost of the models in models/
+
+For every model this builds it for the given observation shape (the image
+shape for cnn* models) and action size, and reports
+  - the number of trainable parameters,
+  - the FLOPs of every layer for a single observation, from the flops
+    statistics tensorflow registers for MatMul, Conv2D and friends,
+  - the median forward and forward+backward latency at each batch size.
+
+With --latency_budget_ms the largest batch size whose forward+backward
+pass fits in the budget is picked for every model, a starting point for
+--n_batch_ticks. The table is written as CSV, one row per model and batch
+size, or as JSON when --output ends with .json.
+
+usage: python -m benchmarks.model_cost [--models simple cnn]
+           [--batch_sizes 1 32 128 512] [--output model_cost.csv]
+'''
+
+import os, sys, time, json, csv, glob, importlib
+import argparse
+from collections import OrderedDict
+from timeit import default_timer
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def list_models():
+    return sorted(os.path.splitext(os.path.basename(path))[0]
+                  for path in glob.glob(os.path.join(REPO_DIR, 'models',
+                                                     '*.py'))
+                  if not path.endswith('__init__.py'))
+
+def load_builder(name):
+    module = importlib.import_module('models.%s' % name)
+    return getattr(module, 'build_model', None) or module.build_q_model
+
+def layer_flops(builder, observation_shape, action_size):
+    '''FLOPs per layer (the name scope of the ops) for one observation'''
+    import tensorflow as tf
+    from tensorflow.python.framework import ops
+    flops = OrderedDict()
+    with tf.Graph().as_default() as g:
+        builder(observation_shape, action_size, batch=1)
+        for op in g.get_operations():
+            try:
+                stats = ops.get_stats_for_node_def(g, op.node_def, 'flops')
+            except ValueError:
+                # unregistered op or incomplete shapes
+                continue
+            if stats.value is None:
+                continue
+            layer = op.name.rsplit('/', 1)[0]
+            flops[layer] = flops.get(layer, 0) + stats.value
+    return flops
+
+def latencies(builder, observation_shape, action_size, batch_sizes,
+              n_repeats):
+    '''median seconds of a forward and a forward+backward pass at each
+    batch size'''
+    import tensorflow as tf
+    rng = np.random.RandomState(0)
+    results = OrderedDict()
+    with tf.Graph().as_default():
+        tf.set_random_seed(0)
+        outputs = builder(observation_shape, action_size)
+        obs_ph, keep_prob_ph, out = outputs[:3]
+        n_params = int(np.sum([np.prod(v.get_shape().as_list())
+                               for v in tf.trainable_variables()]))
+        grads = tf.gradients(tf.reduce_sum(out), tf.trainable_variables())
+        with tf.Session() as sess:
+            sess.run(tf.initialize_all_variables())
+            for batch_size in batch_sizes:
+                feed = {
+                    obs_ph: rng.uniform(0, 255, [batch_size]
+                                        + list(observation_shape)),
+                    keep_prob_ph: 1.,
+                }
+                r = {}
+                for key, fetch in [('forward', out), ('backward', grads)]:
+                    # warmup
+                    sess.run(fetch, feed_dict=feed)
+                    secs = []
+                    for _ in xrange(n_repeats):
+                        t0 = default_timer()
+                        sess.run(fetch, feed_dict=feed)
+                        secs.append(default_timer() - t0)
+                    r[key] = float(np.median(secs))
+                results[batch_size] = r
+    return n_params, results
+
+def profile(name, observation_shape, action_size, batch_sizes, n_repeats):
+    builder = load_builder(name)
+    flops = layer_flops(builder, observation_shape, action_size)
+    n_params, lats = latencies(builder, observation_shape, action_size,
+                               batch_sizes, n_repeats)
+    return {
+        'model': name,
+        'observation_shape': list(observation_shape),
+        'n_params': n_params,
+        'layer_flops': flops,
+        'flops': sum(flops.itervalues()),
+        'latency_secs': lats,
+    }
+
+def fitting_batch_size(p, budget_secs):
+    '''largest batch size whose forward+backward pass fits in budget_secs'''
+    fits = [b for b, r in p['latency_secs'].iteritems()
+            if r['backward'] <= budget_secs]
+    return max(fits) if fits else None
+
+def table_rows(profiles):
+    for p in profiles:
+        for batch_size, r in p['latency_secs'].iteritems():
+            yield OrderedDict([
+                ('model', p['model']),
+                ('observation_shape', 'x'.join(map(str,
+                                                   p['observation_shape']))),
+                ('n_params', p['n_params']),
+                ('mflops_per_obs', p['flops'] / 1e6),
+                ('batch_size', batch_size),
+                ('forward_ms', r['forward'] * 1e3),
+                ('forward_backward_ms', r['backward'] * 1e3),
+                ('obs_per_sec', batch_size / r['backward']),
+            ])
+
+def print_table(profiles, budget_secs):
+    print '%-12s %10s %10s %6s %10s %10s %12s' % (
+        'model', 'params', 'MFLOPs', 'batch', 'fwd ms', 'fwd+bwd ms',
+        'obs/s')
+    for row in table_rows(profiles):
+        print '%-12s %10i %10.3f %6i %10.3f %10.3f %12.1f' % tuple(
+            row[k] for k in ['model', 'n_params', 'mflops_per_obs',
+                             'batch_size', 'forward_ms',
+                             'forward_backward_ms', 'obs_per_sec'])
+    for p in profiles:
+        print '* %s layers' % p['model']
+        for layer, flops in p['layer_flops'].iteritems():
+            print '  %-32s %12i' % (layer, flops)
+        if budget_secs is not None:
+            print '  largest batch size within %.1fms: %s' % (
+                budget_secs * 1e3, p.get('fitting_batch_size'))
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser()
+    parse.add_argument('--models', nargs='+')
+    parse.add_argument('--observation_shape', type=int, nargs='+',
+                       default=[4])
+    parse.add_argument('--image_shape', type=int, nargs='+',
+                       default=[84, 84, 3])
+    parse.add_argument('--action_size', type=int, default=6)
+    parse.add_argument('--batch_sizes', type=int, nargs='+',
+                       default=[1, 32, 128, 512])
+    parse.add_argument('--n_repeats', type=int, default=10)
+    parse.add_argument('--latency_budget_ms', type=float)
+    parse.add_argument('--output', default='model_cost.csv')
+
+    args = parse.parse_args()
+
+    budget_secs = None
+    if args.latency_budget_ms is not None:
+        budget_secs = args.latency_budget_ms / 1e3
+
+    profiles = []
+    for name in args.models or list_models():
+        shape = args.image_shape if name.startswith('cnn') \
+            else args.observation_shape
+        print '* profiling %s on %s' % (name, shape)
+        p = profile(name, shape, args.action_size, args.batch_sizes,
+                    args.n_repeats)
+        if budget_secs is not None:
+            p['fitting_batch_size'] = fitting_batch_size(p, budget_secs)
+        profiles.append(p)
+
+    print_table(profiles, budget_secs)
+
+    with open(args.output, 'wb') as f:
+        if args.output.endswith('.json'):
+            json.dump({
+                'profiles': profiles,
+                'python': sys.version,
+                'time': time.time(),
+                'settings': vars(args),
+            }, f, indent=2)
+        else:
+            rows = list(table_rows(profiles))
+            writer = csv.DictWriter(f, rows[0].keys())
+            writer.writeheader()
+            writer.writerows(rows)
+    print '* results written to', args.output
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+'''startup latency of the entry points
+
+For every script this measures, each in a fresh interpreter,
+  - the time to import the script as a module,
+  - the wall time of `script --help`,
+  - for the trainers, the time to build the training graph with the
+    trainer's own build_graph on its default model, to create the session
+    and initialize the variables, and of the first and the second
+    `sess.run` of the policy, or of the action values, in that graph,
+  - for eval.py, the time of its load_policy, which restores a checkpoint
+    of the policy gradient trainer's graph, and of the first and the
+    second policy evaluation.
+
+usage: python -m benchmarks.startup [--output startup.json]
+'''
+
+import os, sys, time, json, shutil, subprocess, tempfile
+import argparse
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# script -> (model module, model builder, output handle)
+SCRIPTS = [
+    ('train_policy_gradient', 'simple', 'build_model', 'probs'),
+    ('train_q', 'simple2_q', 'build_q_model', 'action_values'),
+    ('train_sars', 'simple2_q', 'build_q_model', 'action_values'),
+    ('train_sarsa', 'simple2_q', 'build_q_model', 'action_values'),
+    ('eval', None, None, None),
+]
+
+HEAVY_MODULES = ['numpy', 'tensorflow', 'gym', 'scipy.misc', 'tqdm']
+
+IMPORT_SNIPPET = '''
+import time
+t0 = time.time()
+import %(module)s
+print time.time() - t0
+'''
+
+# the trainer's graph, saved to checkpoint_path if it is given
+FIRST_RUN_SNIPPET = '''
+import time, json, importlib
+t0 = time.time()
+import numpy as np
+import tensorflow as tf
+trainer = importlib.import_module(%(script)r)
+model = importlib.import_module('models.%(model)s')
+args = vars(trainer.build_argparser().parse_args([
+    '--model', %(model)r, '--checkpoint_dir', %(checkpoint_dir)r,
+    '--no_summary']))
+t1 = time.time()
+with tf.Graph().as_default():
+    tf.set_random_seed(args['tf_seed'])
+    handles = trainer.build_graph(%(observation_shape)r, %(n_actions)i, args,
+                                  model.%(builder)s)
+    init_op = tf.initialize_all_variables()
+    t2 = time.time()
+    out = handles[%(output)r]
+    feed = {
+        handles['obs_ph']: [np.zeros(%(observation_shape)r)],
+        handles['keep_prob_ph']: 1.,
+    }
+    with tf.Session() as sess:
+        t3 = time.time()
+        sess.run(init_op)
+        t4 = time.time()
+        sess.run(out, feed_dict=feed)
+        t5 = time.time()
+        sess.run(out, feed_dict=feed)
+        t6 = time.time()
+        if %(checkpoint_path)r is not None:
+            handles['saver'].save(sess, %(checkpoint_path)r)
+print json.dumps({
+    'import_secs': t1 - t0,
+    'build_secs': t2 - t1,
+    'session_secs': t3 - t2,
+    'init_run_secs': t4 - t3,
+    'first_run_secs': t5 - t4,
+    'second_run_secs': t6 - t5,
+})
+'''
+
+EVAL_SNIPPET = '''
+import time, json, importlib
+t0 = time.time()
+import numpy as np
+import tensorflow as tf
+evaluation = importlib.import_module('eval')
+t1 = time.time()
+with tf.Graph().as_default():
+    with tf.Session() as sess:
+        t2 = time.time()
+        policy = evaluation.load_policy(sess, %(checkpoint_path)r,
+                                        %(checkpoint_path)r + '.meta', 'pi',
+                                        'sample', 0.)
+        t3 = time.time()
+        policy(np.zeros(%(observation_shape)r))
+        t4 = time.time()
+        policy(np.zeros(%(observation_shape)r))
+        t5 = time.time()
+print json.dumps({
+    'import_secs': t1 - t0,
+    'session_secs': t2 - t1,
+    'restore_secs': t3 - t2,
+    'first_run_secs': t4 - t3,
+    'second_run_secs': t5 - t4,
+})
+'''
+
+def run_python(code):
+    '''run code in a fresh interpreter and return its last output line'''
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=REPO_DIR)
+    return out.strip().split('\n')[-1]
+
+def time_import(module):
+    return float(run_python(IMPORT_SNIPPET % {'module': module}))
+
+def time_help(script):
+    t0 = time.time()
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call([sys.executable, script + '.py', '--help'],
+                              cwd=REPO_DIR, stdout=devnull)
+    return time.time() - t0
+
+def time_first_run(script, model, builder, output, observation_shape,
+                   n_actions, work_dir, checkpoint_path=None):
+    return json.loads(run_python(FIRST_RUN_SNIPPET % {
+        'script': script,
+        'model': model,
+        'builder': builder,
+        'output': output,
+        'observation_shape': list(observation_shape),
+        'n_actions': n_actions,
+        'checkpoint_dir': work_dir,
+        'checkpoint_path': checkpoint_path,
+    }))
+
+def time_eval_first_run(checkpoint_path, observation_shape):
+    return json.loads(run_python(EVAL_SNIPPET % {
+        'checkpoint_path': checkpoint_path,
+        'observation_shape': list(observation_shape),
+    }))
+
+def median_of(fn, n_repeats):
+    return float(np.median([fn() for _ in xrange(n_repeats)]))
+
+def benchmark(n_repeats, observation_shape, n_actions, work_dir):
+    results = {'heavy_modules': {}, 'scripts': {}}
+
+    print '* import time of dependencies'
+    for module in HEAVY_MODULES:
+        secs = median_of(lambda: time_import(module), n_repeats)
+        results['heavy_modules'][module] = {'import_secs': secs}
+        print '%-24s import %.3fs' % (module, secs)
+
+    # a checkpoint of the policy gradient trainer for eval.py to restore
+    checkpoint_path = os.path.join(work_dir, 'model')
+    time_first_run('train_policy_gradient', 'simple', 'build_model', 'probs',
+                   observation_shape, n_actions, work_dir, checkpoint_path)
+
+    print '* startup time of scripts'
+    for script, model, builder, output in SCRIPTS:
+        r = {
+            'import_secs': median_of(lambda: time_import(script), n_repeats),
+            'help_secs': median_of(lambda: time_help(script), n_repeats),
+        }
+        print '%-24s import %.3fs --help %.3fs' % (script, r['import_secs'],
+                                                   r['help_secs']),
+        if model is not None:
+            runs = [time_first_run(script, model, builder, output,
+                                   observation_shape, n_actions, work_dir)
+                    for _ in xrange(n_repeats)]
+            r['model'] = model
+        else:
+            runs = [time_eval_first_run(checkpoint_path, observation_shape)
+                    for _ in xrange(n_repeats)]
+        for k in runs[0]:
+            r['graph_%s' % k] = float(np.median([run[k] for run in runs]))
+        if model is not None:
+            print 'build_graph %.3fs first sess.run %.3fs (%s)' % (
+                r['graph_build_secs'], r['graph_first_run_secs'], model),
+        else:
+            print 'load_policy %.3fs first policy run %.3fs' % (
+                r['graph_restore_secs'], r['graph_first_run_secs']),
+        print
+        results['scripts'][script] = r
+    return results
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser()
+    parse.add_argument('--n_repeats', type=int, default=3)
+    parse.add_argument('--observation_shape', type=int, nargs='+',
+                       default=[4])
+    parse.add_argument('--n_actions', type=int, default=2)
+    parse.add_argument('--output', default='startup.json')
+
+    args = parse.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        results = benchmark(args.n_repeats, args.observation_shape,
+                            args.n_actions, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    results['python'] = sys.version
+    results['time'] = time.time()
+    with open(args.output, 'wb') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print '* results written to', args.output
@@ -0,0 +1,138 @@
+import sys, time, signal, threading
+
+class CheckpointManager(object):
+    '''Saves checkpoints off the training thread.
+
+    A save snapshots the values of all variables into memory with a single
+    sess.run and hands them to a writer thread, which loads them into a
+    shadow graph holding variables of the same names and saves that. The
+    checkpoints are therefore interchangeable with ones written by the
+    training graph's own saver. If the writer is still busy, a newer
+    snapshot replaces the pending one.
+
+    The metagraph is exported once to `save_path`.meta instead of along
+    with every checkpoint; see `util.find_meta_path`.
+    '''
+
+    def __init__(self, sess, saver, global_step, save_path,
+                 n_save_interval=1, save_secs=0., max_to_keep=2,
+                 keep_checkpoint_every_n_hours=1):
+        import tensorflow as tf
+
+        self.sess = sess
+        self.saver = saver
+        self.global_step = global_step
+        self.save_path = save_path
+        self.n_save_interval = n_save_interval
+        self.save_secs = save_secs
+        self.last_save_time = time.time()
+        self.wrote_meta_graph = False
+
+        self.variables = tf.all_variables()
+
+        # shadow graph to write snapshots from
+        self.shadow_graph = tf.Graph()
+        with self.shadow_graph.as_default():
+            shadow_vars = {}
+            self.assign_ops = []
+            self.value_phs = []
+            for v in self.variables:
+                dtype = v.dtype.base_dtype
+                shape = v.get_shape()
+                shadow_v = tf.Variable(tf.zeros(shape, dtype=dtype),
+                                       name=v.op.name)
+                value_ph = tf.placeholder(dtype, shape)
+                self.assign_ops.append(shadow_v.assign(value_ph))
+                self.value_phs.append(value_ph)
+                shadow_vars[v.op.name] = shadow_v
+            self.shadow_saver = tf.train.Saver(
+                shadow_vars, max_to_keep=max_to_keep,
+                keep_checkpoint_every_n_hours=keep_checkpoint_every_n_hours)
+        self.shadow_sess = tf.Session(graph=self.shadow_graph)
+
+        # at most one snapshot waits to be written
+        self.pending = None
+        self.writing = False
+        self.closed = False
+        self.cond = threading.Condition()
+        self.writer = threading.Thread(target=self._write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def should_save(self, i):
+        if self.n_save_interval > 0 and i % self.n_save_interval == 0:
+            return True
+        if self.save_secs > 0 \
+            and time.time() - self.last_save_time >= self.save_secs:
+            return True
+        return False
+
+    def maybe_save(self, i):
+        '''save if the step or the time policy says so at iteration i'''
+        if self.should_save(i):
+            self.save()
+
+    def snapshot(self):
+        values = self.sess.run([self.global_step] + self.variables)
+        return int(values[0]), values[1:]
+
+    def save(self):
+        '''snapshot the variables and queue them for writing'''
+        if not self.wrote_meta_graph:
+            self.saver.export_meta_graph(self.save_path + '.meta')
+            self.wrote_meta_graph = True
+        snapshot = self.snapshot()
+        self.last_save_time = time.time()
+        with self.cond:
+            self.pending = snapshot
+            self.cond.notify()
+
+    def wait(self):
+        '''block until every queued snapshot is on disk'''
+        with self.cond:
+            while self.pending is not None or self.writing:
+                self.cond.wait()
+
+    def close(self):
+        '''write a final snapshot and stop the writer'''
+        self.save()
+        self.wait()
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.writer.join()
+        self.shadow_sess.close()
+
+    def _write(self, step, values):
+        feed = dict(zip(self.value_phs, values))
+        self.shadow_sess.run(self.assign_ops, feed_dict=feed)
+        self.shadow_saver.save(self.shadow_sess, self.save_path,
+                               global_step=step, write_meta_graph=False)
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                step, values = self.pending
+                self.pending = None
+                self.writing = True
+            try:
+                self._write(step, values)
+            except Exception as e:
+                print '* failed to write checkpoint at step %i: %s' % (step,
+                                                                       e)
+            finally:
+                with self.cond:
+                    self.writing = False
+                    self.cond.notify_all()
+
+def exit_on_sigterm():
+    '''turn SIGTERM into SystemExit so that cleanup in finally clauses,
+    e.g. the final checkpoint, runs when a job is killed'''
+    def handler(signum, frame):
+        print '* received SIGTERM, exiting'
+        sys.exit(128 + signum)
+    signal.signal(signal.SIGTERM, handler)
@@ -1,17 +1,19 @@
 #!/usr/bin/env python
 
-import tensorflow as tf
 import numpy as np
-import os, sys, cPickle, time, glob, itertools, csv
+import os, sys, cPickle, time, glob, itertools, csv, signal
 from functools import partial
-import tqdm
 import argparse
-import gym
-from gym import envs
 from util import rollout, vector_slice, to_greedy, to_epsilon_greedy, \
-                 test_restore_vars
+                 test_restore_vars, find_meta_path
+from timing import PhaseTimer
+from tracing import RunTracer, NULL_TRACER
+from placement import set_affinity, parse_cpus
+from metrics import MetricsSink, NULL_METRICS
 
-def load_policy(sess, checkpoint_path, meta_path, model_type, policy_type, epsilon):
+def load_policy(sess, checkpoint_path, meta_path, model_type, policy_type,
+                epsilon, tracer=NULL_TRACER):
+    import tensorflow as tf
     test_restore_vars(sess, checkpoint_path, meta_path)
 
     if model_type == 'pi':
@@ -24,38 +26,44 @@ def load_policy(sess, checkpoint_path, meta_path, model_type, policy_type, epsil
         action_values = tf.get_collection('outputs')[0]
         probs = action_values
 
+    def model_output(obs):
+        return sess.run(probs, feed_dict={
+            obs_ph: [obs],
+            keep_prob_ph: 1.,
+        }, **tracer.run_kwargs())[0]
+
     # policy function
     if policy_type == 'greedy':
         print '* greedy policy'
-        policy = partial(to_greedy, lambda obs: probs.eval(feed_dict={
-            obs_ph: [obs],
-            keep_prob_ph: 1.,
-        })[0])
+        policy = partial(to_greedy, model_output)
     elif policy_type == 'epsilon_greedy':
         print '* epsilon-greedy policy with epsilon', epsilon
-        policy = partial(to_epsilon_greedy, epsilon, lambda obs:
-            probs.eval(feed_dict={
-                obs_ph: [obs],
-                keep_prob_ph: 1.,
-            })[0])
+        policy = partial(to_epsilon_greedy, epsilon, model_output)
     else:
         if model_type == 'q':
             print 'ERROR: a stochastic policy induced by Q is not defined.'
             sys.exit(1)
         print '* stochastic policy'
-        policy = lambda obs: probs.eval(feed_dict={
-            obs_ph: [obs],
-            keep_prob_ph: 1.,
-        })[0]
+        policy = model_output
     return policy
 
 def evaluate(env_spec, env_step, env_reset,
-             env_render, n_samples, n_obs_ticks, policy):
+             env_render, n_samples, n_obs_ticks, policy, progress=True,
+             tracer=NULL_TRACER, metrics=NULL_METRICS, step=None):
+    '''roll out n_samples episodes with policy and report their statistics;
+    every episode is also written to metrics, tagged with the global step
+    of the evaluated checkpoint if step is given'''
+    import tqdm
+
     # evaluation
     episode_rewards = []
     episode_lengths = []
+    # host-side phases for the timelines
+    timer = PhaseTimer(tracer.n_trace_interval > 0)
 
-    for i in tqdm.tqdm(xrange(n_samples)):
+    samples = tqdm.tqdm(xrange(n_samples)) if progress else xrange(n_samples)
+    for i in samples:
+        tracer.start(i, timer)
         # rollout with policy
         observations, actions, rewards = rollout(
             policy,
@@ -64,9 +72,19 @@ def evaluate(env_spec, env_step, env_reset,
             env_reset,
             env_render,
             n_obs_ticks,
+            timer=timer,
         )
+        tracer.finish('eval', i)
         episode_rewards.append(np.sum(rewards))
         episode_lengths.append(len(observations))
+        record = {
+            'episode': i,
+            'episode_reward': episode_rewards[-1],
+            'episode_length': episode_lengths[-1],
+        }
+        if step is not None:
+            record['global_step'] = step
+        metrics.write(record)
 
     # summary
     print '* summary'
@@ -84,8 +102,101 @@ def evaluate(env_spec, env_step, env_reset,
     print 'min', np.min(episode_rewards),
     print 'std', np.std(episode_rewards)
 
+    return episode_rewards, episode_lengths
+
+def write_eval_summary(writer, step, episode_rewards, episode_lengths):
+    import tensorflow as tf
+    summary = tf.Summary(value=[
+        tf.Summary.Value(tag='eval/average_episode_reward',
+                         simple_value=np.mean(episode_rewards)),
+        tf.Summary.Value(tag='eval/max_episode_reward',
+                         simple_value=np.max(episode_rewards)),
+        tf.Summary.Value(tag='eval/min_episode_reward',
+                         simple_value=np.min(episode_rewards)),
+        tf.Summary.Value(tag='eval/average_episode_length',
+                         simple_value=np.mean(episode_lengths)),
+    ])
+    writer.add_summary(summary, step)
+    writer.flush()
+
+def parent_alive(parent_pid):
+    if parent_pid is None:
+        return True
+    try:
+        os.kill(parent_pid, 0)
+    except OSError:
+        return False
+    return True
+
+def watch(checkpoint_dir, summary_dir, env_spec, env_step, env_reset,
+          n_samples, n_obs_ticks, model_type, policy_type, epsilon,
+          poll_secs=30., n_threads=1, parent_pid=None, metrics=NULL_METRICS):
+    '''evaluate every new checkpoint that appears in checkpoint_dir until
+    the parent process exits or asks us to stop with SIGTERM, and then the
+    latest one if it is new'''
+    import tensorflow as tf
+
+    # the trainer sends SIGTERM once it saved its last checkpoint
+    stop_requested = []
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: stop_requested.append(signum))
+
+    writer = None
+    if summary_dir is not None:
+        writer = tf.train.SummaryWriter(summary_dir)
+        print '* writing evaluation summary to', summary_dir
+    config = tf.ConfigProto(intra_op_parallelism_threads=n_threads,
+                            inter_op_parallelism_threads=n_threads)
+
+    last_path = None
+    while True:
+        # checked before polling, so the checkpoint the trainer saves on
+        # its way out is still evaluated
+        alive = parent_alive(parent_pid) and not stop_requested
+        checkpoint_path = tf.train.latest_checkpoint(checkpoint_dir)
+        if checkpoint_path is None or checkpoint_path == last_path:
+            if not alive:
+                break
+            time.sleep(poll_secs)
+            continue
+        last_path = checkpoint_path
+        step = int(checkpoint_path.split('-')[-1])
+
+        print '* evaluating %s' % checkpoint_path
+        try:
+            with tf.Graph().as_default():
+                with tf.Session(config=config) as sess:
+                    policy = load_policy(sess, checkpoint_path,
+                                         find_meta_path(checkpoint_path),
+                                         model_type, policy_type, epsilon)
+                    episode_rewards, episode_lengths = evaluate(
+                        env_spec, env_step, env_reset, None, n_samples,
+                        n_obs_ticks, policy, progress=False,
+                        metrics=metrics, step=step)
+        except (IOError, tf.errors.NotFoundError) as e:
+            # the trainer may have rotated the checkpoint away meanwhile
+            print '* skipping %s: %s' % (checkpoint_path, e)
+            continue
+        except ValueError as e:
+            # observations that do not fit the model, keep watching
+            print '* failed to evaluate %s: %s' % (checkpoint_path, e)
+            continue
+        if writer is not None:
+            write_eval_summary(writer, step, episode_rewards,
+                               episode_lengths)
+        metrics.flush()
+        sys.stdout.flush()
+
+    if writer is not None:
+        writer.close()
+    metrics.close()
+    if stop_requested:
+        print '* asked to stop, stopping'
+    else:
+        print '* parent process %i exited, stopping' % parent_pid
+
 if __name__ == '__main__':
-    from util import passthrough, use_render_state
+    from util import make_env_tuple
 
     # arguments
     parse = argparse.ArgumentParser()
@@ -107,29 +218,51 @@ if __name__ == '__main__':
                                                    'bicubic', 'cubic'],
                        default='nearest')
 
+    # background evaluation of a training run
+    parse.add_argument('--watch', action='store_true')
+    parse.add_argument('--summary_dir')
+    parse.add_argument('--poll_secs', type=float, default=30.)
+    # session threads, 0 leaves the choice to tensorflow
+    parse.add_argument('--n_threads', type=int, default=0)
+    parse.add_argument('--nice', type=int, default=0)
+    parse.add_argument('--parent_pid', type=int)
+    parse.add_argument('--cpus', help='cpu list like 0-3,8 to pin to')
+
+    # op-level timelines of every n-th episode
+    parse.add_argument('--n_trace_interval', type=int, default=0)
+    parse.add_argument('--trace_dir', default='tf-log/eval-timelines')
+
+    # per-episode records as json lines or csv
+    parse.add_argument('--metrics_path')
+
     args = parse.parse_args()
 
-    if args.latest:
-        # use the latest checkpoint in the folder
-        checkpoint_path = tf.train.latest_checkpoint(args.checkpoint_path)
-    else:
-        checkpoint_path = args.checkpoint_path
+    if args.nice > 0:
+        os.nice(args.nice)
+    if args.cpus is not None:
+        # before tensorflow starts any threads, so they all inherit it
+        set_affinity(parse_cpus(args.cpus))
+        print '* pinned to cpus', args.cpus
 
-    if args.meta_path == None:
-        meta_path = checkpoint_path + '.meta'
-    else:
-        meta_path = args.meta_path
+    # heavy dependencies are only loaded past argument parsing
+    import tensorflow as tf
 
-    # init env
-    gym_env = gym.make(args.env)
-    if args.use_render_state:
-        env_spec, env_step, env_reset, env_render = use_render_state(
-            gym_env, args.scale, args.interpolation)
-    else:
-        env_spec, env_step, env_reset, env_render = passthrough(gym_env)
+    # in watch mode checkpoint_path is the checkpoint directory of a run
+    if not args.watch:
+        if args.latest:
+            # use the latest checkpoint in the folder
+            checkpoint_path = tf.train.latest_checkpoint(args.checkpoint_path)
+        else:
+            checkpoint_path = args.checkpoint_path
+
+        if args.meta_path == None:
+            meta_path = find_meta_path(checkpoint_path)
+        else:
+            meta_path = args.meta_path
 
-    env_spec['timestep_limit'] = min(gym_env.spec.timestep_limit,
-                                     args.timestep_limit)
+    # init env, the way the trainers do
+    gym_env, (env_spec, env_step, env_reset, env_render) = make_env_tuple(
+        vars(args))
     env_render = None if args.no_render else env_render
 
     print '* environment', args.env
@@ -139,9 +272,21 @@ if __name__ == '__main__':
     print 'reward threshold', gym_env.spec.reward_threshold
 
     # eval
+    if args.watch:
+        watch(args.checkpoint_path, args.summary_dir, env_spec, env_step,
+              env_reset, args.n_samples, args.n_obs_ticks, args.model,
+              args.policy, args.epsilon, args.poll_secs, args.n_threads,
+              args.parent_pid, MetricsSink(args.metrics_path))
+        sys.exit(0)
+
     with tf.Graph().as_default() as g:
-        with tf.Session() as sess:
+        config = tf.ConfigProto(intra_op_parallelism_threads=args.n_threads,
+                                inter_op_parallelism_threads=args.n_threads)
+        with tf.Session(config=config) as sess:
+            tracer = RunTracer(args.trace_dir, args.n_trace_interval)
             policy = load_policy(sess, checkpoint_path, meta_path, args.model,
-                                 args.policy, args.epsilon)
+                                 args.policy, args.epsilon, tracer)
+            metrics = MetricsSink(args.metrics_path)
             evaluate(env_spec, env_step, env_reset, env_render, args.n_samples,
-                     args.n_obs_ticks, policy)
+                     args.n_obs_ticks, policy, tracer=tracer, metrics=metrics)
+            metrics.close()
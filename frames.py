@@ -0,0 +1,119 @@
+import os, sys, time, threading
+from functools import partial
+from collections import deque
+
+class FrameSink(object):
+    '''Hands frames to consumers, callables of a frame, in a consumer
+    thread.
+
+    The frames wait in a buffer of buffer_size frames that drops the oldest
+    one when full, so put() never blocks the rollout. close() hands out the
+    frames left and calls the close() of the consumers that have one.'''
+
+    def __init__(self, consumers, buffer_size=4):
+        self.consumers = consumers
+        self.buffer = deque(maxlen=buffer_size)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.n_dropped = 0
+        self.thread = threading.Thread(target=self.run, name='frames')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, frame):
+        with self.cond:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.n_dropped += 1
+            self.buffer.append(frame)
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.buffer and not self.closed:
+                    self.cond.wait()
+                if not self.buffer:
+                    break
+                frame = self.buffer.popleft()
+            for consume in self.consumers:
+                try:
+                    consume(frame)
+                except Exception as e:
+                    # visualization must not take training down
+                    print >> sys.stderr, '* frame consumer failed: %s' % e
+        for consume in self.consumers:
+            if hasattr(consume, 'close'):
+                consume.close()
+
+    def close(self, timeout=10.):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+        if self.n_dropped > 0:
+            print '* dropped %i frames' % self.n_dropped
+
+def throttled(grab, sink, fps):
+    '''an env_render for util.rollout that puts a frame from grab() into
+    sink at most fps times a second and otherwise returns at once'''
+    interval = 1. / fps
+    last = [0.]
+    def render():
+        now = time.time()
+        if now - last[0] >= interval:
+            last[0] = now
+            sink.put(grab())
+    return render
+
+class ImageViewer(object):
+    '''show frames in a window, opened by the first frame in the thread
+    that shows them'''
+
+    def __init__(self):
+        self.viewer = None
+
+    def __call__(self, frame):
+        if self.viewer is None:
+            from gym.envs.classic_control.rendering import SimpleImageViewer
+            self.viewer = SimpleImageViewer()
+        self.viewer.imshow(frame)
+
+    def close(self):
+        if self.viewer is not None:
+            self.viewer.close()
+
+class VideoWriter(object):
+    '''encode frames into a video at path with gym's ffmpeg encoder'''
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.encoder = None
+
+    def __call__(self, frame):
+        if self.encoder is None:
+            from gym.monitoring.video_recorder import ImageEncoder
+            self.encoder = ImageEncoder(self.path, frame.shape, self.fps)
+            print '* recording rollouts to', self.path
+        self.encoder.capture_frame(frame)
+
+    def close(self):
+        if self.encoder is not None:
+            self.encoder.close()
+
+def frames_from_args(args, env_render):
+    '''the env_render for the trainers and the FrameSink behind it, showing
+    the frames with --render and recording them to monitor_dir with
+    --monitor, or None and None with neither'''
+    consumers = []
+    if args['render']:
+        consumers.append(ImageViewer())
+    if args['monitor']:
+        consumers.append(VideoWriter(
+            os.path.join(args['monitor_dir'], 'rollouts.mp4'),
+            args['render_fps']))
+    if not consumers:
+        return None, None
+    sink = FrameSink(consumers, args['render_buffer_size'])
+    return throttled(partial(env_render, 'rgb_array'), sink,
+                     args['render_fps']), sink
@@ -0,0 +1,112 @@
+import sys, time, threading
+import numpy as np
+
+class UpdateCounter(object):
+    '''Hands out the training iterations to asynchronous actor-learner
+    threads and counts the updates they apply to the shared variables.
+
+    The host-side global step is start_step plus the updates applied so
+    far. The staleness of an update is the number of updates applied
+    between its thread reading the weights for the rollout and applying
+    its gradients. report() returns the aggregate rates and the staleness
+    since the last report.'''
+
+    def __init__(self, n_iterations, start_step=0):
+        self.lock = threading.Lock()
+        self.n_iterations = n_iterations
+        self.start_step = start_step
+        self.n_claimed = 0
+        self.n_updates = 0
+        self.stopped = False
+        self.error = None
+        self.staleness = []
+        self.n_samples = 0
+        self.last_report_time = time.time()
+        self.last_report_updates = 0
+
+    def claim(self):
+        '''the next iteration and the current global step, or None when
+        all iterations are handed out'''
+        with self.lock:
+            if self.stopped or self.n_claimed >= self.n_iterations:
+                return None
+            self.n_claimed += 1
+            return self.n_claimed - 1, self.start_step + self.n_updates
+
+    def applied(self, read_step, n_samples):
+        '''note an update computed on the weights of read_step from
+        n_samples ticks, returns the new global step'''
+        with self.lock:
+            self.staleness.append(self.start_step + self.n_updates
+                                  - read_step)
+            self.n_updates += 1
+            self.n_samples += n_samples
+            return self.start_step + self.n_updates
+
+    def stop(self, error=None):
+        with self.lock:
+            self.stopped = True
+            if error is not None and self.error is None:
+                self.error = error
+
+    def report(self):
+        with self.lock:
+            now = time.time()
+            elapsed = max(now - self.last_report_time, 1e-9)
+            stats = {
+                'async/updates_per_sec':
+                (self.n_updates - self.last_report_updates) / elapsed,
+                'async/learner_samples_per_sec': self.n_samples / elapsed,
+                'async/mean_staleness': float(np.mean(self.staleness))
+                if self.staleness else 0.,
+                'async/max_staleness': max(self.staleness)
+                if self.staleness else 0,
+            }
+            self.staleness = []
+            self.n_samples = 0
+            self.last_report_time = now
+            self.last_report_updates = self.n_updates
+        return stats
+
+def start_learners(n_threads, target, counter):
+    '''run target(thread_id) in n_threads daemon threads, an exception in
+    any of them stops the others after their current iteration'''
+    def run(thread_id):
+        try:
+            target(thread_id)
+        except Exception:
+            counter.stop(sys.exc_info())
+            raise
+
+    threads = []
+    for thread_id in xrange(n_threads):
+        thread = threading.Thread(target=run, args=(thread_id,),
+                                  name='learner-%i' % thread_id)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    return threads
+
+def supervise(threads, counter, checkpoints, n_report_interval, report,
+              poll_secs=1.):
+    '''wait for the learner threads, saving checkpoints by the number of
+    updates and calling report(global_step, stats) every
+    n_report_interval updates, then re-raise the first error of a
+    learner'''
+    last = 0
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(poll_secs)
+            n_updates = counter.n_updates
+            if any(checkpoints.should_save(j)
+                   for j in xrange(last, n_updates)):
+                checkpoints.save()
+            if n_report_interval > 0 and n_updates // n_report_interval \
+                > last // n_report_interval:
+                report(counter.start_step + n_updates, counter.report())
+            last = n_updates
+    except BaseException:
+        counter.stop()
+        raise
+    if counter.error is not None:
+        raise counter.error[0], counter.error[1], counter.error[2]
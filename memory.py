@@ -0,0 +1,100 @@
+import os, sys, resource
+import numpy as np
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def current_rss():
+    '''resident set size of this process in bytes'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except IOError:
+        # no procfs, fall back to the peak
+        return peak_rss()
+
+def peak_rss():
+    '''peak resident set size of this process in bytes'''
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def nbytes(x):
+    '''approximate size in bytes of nested lists, tuples and arrays'''
+    if isinstance(x, np.ndarray):
+        return x.nbytes
+    if isinstance(x, (list, tuple)):
+        return sys.getsizeof(x) + sum(nbytes(y) for y in x)
+    return sys.getsizeof(x)
+
+class MemoryMonitor(object):
+    '''Records for each training phase the highest RSS seen at its end and
+    how far the process peak RSS rose during it, the byte size of the
+    trajectory containers, and enforces a soft budget on the RSS during
+    rollouts.
+
+    The rise of the peak is the growth of ru_maxrss from the end of the
+    previous phase, so a phase that allocates and frees a transient
+    buffer shows up there even if its end RSS does not.
+
+    With action 'warn' crossing the budget prints a warning once per
+    rollout; with 'truncate' the rollout that would cross it ends early.
+    The RSS is only read every check_interval ticks.'''
+
+    def __init__(self, enabled=True, budget_mb=0., action='warn',
+                 check_interval=64):
+        self.enabled = enabled
+        self.budget = budget_mb * 2**20
+        self.action = action
+        self.check_interval = check_interval
+        self.phase_ends = {}
+        self.phase_peak_growth = {}
+        self.last_peak = peak_rss() if enabled else 0
+        self.sizes = {}
+        self.warned = False
+
+    def sample(self, phase):
+        '''note the current RSS at the end of phase and the rise of the
+        peak RSS since the previous sample'''
+        if self.enabled:
+            rss = current_rss()
+            self.phase_ends[phase] = max(rss, self.phase_ends.get(phase, 0))
+            peak = peak_rss()
+            self.phase_peak_growth[phase] = \
+                self.phase_peak_growth.get(phase, 0) + peak - self.last_peak
+            self.last_peak = peak
+
+    def record(self, name, container):
+        if self.enabled:
+            self.sizes[name] = nbytes(container)
+
+    def start_rollout(self):
+        self.warned = False
+
+    def over_budget(self, t):
+        '''whether the rollout should stop at tick t'''
+        if self.budget <= 0 or t % self.check_interval != 0:
+            return False
+        rss = current_rss()
+        if rss <= self.budget:
+            return False
+        if not self.warned:
+            print '* WARNING: RSS %.1fMB exceeds the memory budget of ' \
+                '%.1fMB at tick %i' % (rss / 2.**20, self.budget / 2.**20, t)
+            self.warned = True
+        return self.action == 'truncate'
+
+    def report(self):
+        '''return the recorded sizes in megabytes and reset the phase
+        statistics'''
+        stats = {'memory/peak_rss_mb': peak_rss() / 2.**20}
+        for phase, rss in self.phase_ends.iteritems():
+            stats['memory/%s_end_rss_mb' % phase] = rss / 2.**20
+        for phase, growth in self.phase_peak_growth.iteritems():
+            stats['memory/%s_peak_growth_mb' % phase] = growth / 2.**20
+        for name, size in self.sizes.iteritems():
+            stats['memory/%s_mb' % name] = size / 2.**20
+        self.phase_ends = {}
+        self.phase_peak_growth = {}
+        return stats
+
+# shared by callers that do not account memory
+NULL_MEMORY = MemoryMonitor(enabled=False)
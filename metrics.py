@@ -0,0 +1,107 @@
+import os, time, json, csv, threading
+
+class MetricsSink(object):
+    '''Buffered, append-only writer of per-iteration records.
+
+    Records are dicts of scalars. Each one gets a `time` timestamp and is
+    kept in memory until flush_secs have passed since the last flush; the
+    buffer is then written out in one go without syncing the file. The
+    format is CSV if path ends with .csv and JSON lines otherwise. CSV
+    columns are the keys seen so far; a flush with a new key rewrites the
+    file under a widened header, leaving the new columns of the earlier
+    rows empty. Writers may share a sink across threads.
+
+    A sink without a path ignores everything.'''
+
+    def __init__(self, path, flush_secs=30.):
+        self.path = path
+        self.flush_secs = flush_secs
+        self.buffer = []
+        self.last_flush_time = time.time()
+        self.csv_writer = None
+        self.fieldnames = []
+        self.f = None
+        self.lock = threading.Lock()
+        if path is None:
+            return
+
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.format = 'csv' if path.endswith('.csv') else 'jsonl'
+        if self.format == 'csv' and os.path.exists(path) \
+            and os.path.getsize(path) > 0:
+            # continue an existing file with its columns
+            with open(path, 'rb') as f:
+                self.fieldnames = csv.reader(f).next()
+            self.f = open(path, 'ab')
+            self.csv_writer = csv.DictWriter(self.f, self.fieldnames)
+        else:
+            self.f = open(path, 'ab')
+
+    def write(self, record):
+        if self.f is None:
+            return
+        record = dict(record)
+        record['time'] = time.time()
+        with self.lock:
+            self.buffer.append(record)
+            if record['time'] - self.last_flush_time >= self.flush_secs:
+                self._flush()
+
+    def flush(self):
+        if self.f is None:
+            return
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.format == 'csv':
+            keys = set().union(*self.buffer)
+            if not keys.issubset(self.fieldnames):
+                self._widen(keys)
+            for record in self.buffer:
+                self.csv_writer.writerow(record)
+        else:
+            self.f.write(''.join(json.dumps(record, sort_keys=True,
+                                            default=to_scalar) + '\n'
+                                 for record in self.buffer))
+        self.f.flush()
+        self.buffer = []
+        self.last_flush_time = time.time()
+
+    def _widen(self, keys):
+        '''rewrite the file with the columns of keys added to its header'''
+        self.f.flush()
+        with open(self.path, 'rb') as f:
+            rows = list(csv.DictReader(f))
+        self.fieldnames = sorted(keys.union(self.fieldnames))
+        # write aside and rename, so a crash leaves the old file intact
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            writer = csv.DictWriter(f, self.fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.rename(tmp_path, self.path)
+        self.f.close()
+        self.f = open(self.path, 'ab')
+        self.csv_writer = csv.DictWriter(self.f, self.fieldnames)
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush()
+        self.f.close()
+        self.f = None
+
+def to_scalar(x):
+    '''json fallback for numpy scalars'''
+    return x.item()
+
+def eval_metrics_path(path):
+    '''where a background evaluator of a run writing to path writes'''
+    root, ext = os.path.splitext(path)
+    return root + '.eval' + ext
+
+# shared by callers that do not record metrics
+NULL_METRICS = MetricsSink(None)
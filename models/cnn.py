@@ -1,7 +1,7 @@
 import tensorflow as tf
 import numpy as np
 
-def build_model(observation_shape, dim_action, batch=None):
+def build_model(observation_shape, dim_action, batch=None, value_head=False):
     obs_ph = tf.placeholder('float', [batch] + list(observation_shape), name='observation')
     keep_prob_ph = tf.placeholder('float', name='keep_prob')
     tf.add_to_collection('inputs', obs_ph)
@@ -43,9 +43,11 @@ def build_model(observation_shape, dim_action, batch=None):
             scope='fc0'
         )
 
+        features = net
+
         net = tf.contrib.layers.fully_connected(
             # inputs=tf.nn.dropout(obs_ph, keep_prob_ph),
-            inputs=net,
+            inputs=features,
             num_outputs=dim_action,
             biases_initializer=tf.zeros_initializer,
             weights_initializer=tf.contrib.layers.xavier_initializer(),
@@ -59,4 +61,17 @@ def build_model(observation_shape, dim_action, batch=None):
         tf.add_to_collection('outputs', logits)
         tf.add_to_collection('outputs', probs)
 
-    return obs_ph, keep_prob_ph, logits, probs, None
+        # state value head on the shared features
+        value = None
+        if value_head:
+            value = tf.contrib.layers.fully_connected(
+                inputs=features,
+                num_outputs=1,
+                biases_initializer=tf.zeros_initializer,
+                weights_initializer=tf.contrib.layers.xavier_initializer(),
+                activation_fn=None,
+                scope='val_fc1',
+            )
+            tf.add_to_collection('state_values', value)
+
+    return obs_ph, keep_prob_ph, logits, probs, value
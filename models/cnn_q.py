@@ -1,7 +1,8 @@
 import tensorflow as tf
 import numpy as np
 
-def build_q_model(observation_shape, dim_action, batch=None):
+def build_q_model(observation_shape, dim_action, trainable=True,
+                  batch=None):
     obs_ph = tf.placeholder('float', [batch] + list(observation_shape), name='observation')
     keep_prob_ph = tf.placeholder('float', name='keep_prob')
     tf.add_to_collection('inputs', obs_ph)
@@ -15,6 +16,7 @@ def build_q_model(observation_shape, dim_action, batch=None):
         activation_fn=tf.nn.relu,
         biases_initializer=tf.zeros_initializer,
         weights_initializer=tf.contrib.layers.xavier_initializer_conv2d(),
+        trainable=trainable,
         scope='conv0',
     )
     net = tf.nn.max_pool(net, [1, 2, 2, 1], [1, 2, 2, 1], 'SAME')
@@ -26,6 +28,7 @@ def build_q_model(observation_shape, dim_action, batch=None):
         activation_fn=tf.nn.relu,
         biases_initializer=tf.zeros_initializer,
         weights_initializer=tf.contrib.layers.xavier_initializer_conv2d(),
+        trainable=trainable,
         scope='conv1',
     )
     net = tf.nn.max_pool(net, [1, 2, 2, 1], [1, 2, 2, 1], 'SAME')
@@ -38,6 +41,7 @@ def build_q_model(observation_shape, dim_action, batch=None):
         num_outputs=64,
         biases_initializer=tf.zeros_initializer,
         weights_initializer=tf.contrib.layers.xavier_initializer(),
+        trainable=trainable,
         activation_fn=tf.nn.relu,
         scope='fc0'
     )
@@ -47,6 +51,7 @@ def build_q_model(observation_shape, dim_action, batch=None):
         num_outputs=32,
         biases_initializer=tf.zeros_initializer,
         weights_initializer=tf.contrib.layers.xavier_initializer(),
+        trainable=trainable,
         activation_fn=tf.nn.relu,
         scope='fc1',
     )
@@ -55,6 +60,7 @@ def build_q_model(observation_shape, dim_action, batch=None):
         num_outputs=dim_action,
         biases_initializer=tf.zeros_initializer,
         weights_initializer=tf.contrib.layers.xavier_initializer(),
+        trainable=trainable,
         activation_fn=None,
         scope='fc2',
     )
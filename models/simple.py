@@ -1,7 +1,7 @@
 import tensorflow as tf
 import numpy as np
 
-def build_model(observation_shape, dim_action, batch=None):
+def build_model(observation_shape, dim_action, batch=None, value_head=False):
     obs_ph = tf.placeholder('float', [batch] + list(observation_shape), name='observation')
     keep_prob_ph = tf.placeholder('float', name='keep_prob')
     tf.add_to_collection('inputs', obs_ph)
@@ -19,23 +19,24 @@ def build_model(observation_shape, dim_action, batch=None):
         )
         tf.add_to_collection(tf.GraphKeys.ACTIVATIONS, fc1)
 
-        # val_fc1 = tf.contrib.layers.fully_connected(
-        #     # inputs=tf.nn.dropout(obs_ph, keep_prob_ph),
-        #     inputs = obs_ph,
-        #     num_outputs=1,
-        #     biases_initializer=tf.zeros_initializer,
-        #     weights_initializer=tf.contrib.layers.xavier_initializer(),
-        #     activation_fn=None,
-        #     scope='val_fc1'
-        # )
-        # tf.add_to_collection(tf.GraphKeys.ACTIVATIONS, val_fc1)
-
         logits = fc1
         probs = tf.nn.softmax(logits, name='probs')
-        # value = val_fc1
-        value = None
         tf.add_to_collection('outputs', logits)
         tf.add_to_collection('outputs', probs)
-        # tf.add_to_collection('outputs', value)
+
+        # state value head
+        value = None
+        if value_head:
+            val_fc1 = tf.contrib.layers.fully_connected(
+                inputs = obs_ph,
+                num_outputs=1,
+                biases_initializer=tf.zeros_initializer,
+                weights_initializer=tf.contrib.layers.xavier_initializer(),
+                activation_fn=None,
+                scope='val_fc1'
+            )
+            tf.add_to_collection(tf.GraphKeys.ACTIVATIONS, val_fc1)
+            value = val_fc1
+            tf.add_to_collection('state_values', value)
 
     return obs_ph, keep_prob_ph, logits, probs, value
@@ -0,0 +1,125 @@
+import time, mmap, multiprocessing
+from Queue import Empty
+import numpy as np
+
+def split(n, k):
+    '''shares of n items over k workers, as even as possible'''
+    return [n // k + (1 if i < n % k else 0) for i in xrange(k)]
+
+class WorkerPool(object):
+    '''A fixed set of forked worker processes, each running
+    target(conn, worker_id, *args) and talking to the parent over its end
+    of a pipe.
+
+    The workers are forked, so they must be started before the parent
+    creates a tensorflow session; each worker builds its own graph and
+    session. Forked workers also inherit the numpy random state of the
+    parent, so with a seed every worker reseeds it with seed + worker_id
+    first; they should build their envs themselves for the same reason. A
+    worker leaves its loop on the message ('close',).'''
+
+    def __init__(self, n_workers, target, args=(), seed=None):
+        self.conns = []
+        self.processes = []
+        for worker_id in xrange(n_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(target, seed, child_conn, worker_id) + tuple(args))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+    def __len__(self):
+        return len(self.conns)
+
+    def scatter(self, messages):
+        '''send one message to every worker'''
+        for conn, message in zip(self.conns, messages):
+            conn.send(message)
+
+    def broadcast(self, message):
+        self.scatter([message] * len(self.conns))
+
+    def gather(self):
+        '''the replies of all workers, in worker order'''
+        return [conn.recv() for conn in self.conns]
+
+    def alive(self):
+        return any(process.is_alive() for process in self.processes)
+
+    def close(self, timeout=10.):
+        for conn in self.conns:
+            try:
+                conn.send(('close',))
+            except IOError:
+                # the worker is gone already
+                pass
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+def run_worker(target, seed, conn, worker_id, *args):
+    if seed is not None:
+        np.random.seed(seed + worker_id)
+    target(conn, worker_id, *args)
+
+def receive(queue, pool, poll_secs=1.):
+    '''the next item the workers of pool put on queue, raises RuntimeError
+    if they are all gone'''
+    while True:
+        try:
+            return queue.get(timeout=poll_secs)
+        except Empty:
+            if not pool.alive():
+                raise RuntimeError('all workers exited')
+
+class SharedWeights(object):
+    '''A versioned copy of a list of arrays, as float32, in anonymous
+    shared memory that processes forked after its creation share.
+
+    publish() writes all arrays under a sequence lock: the sequence number
+    is odd while a write is under way and the version is half of it.
+    read() copies the arrays out and retries if a publish overlapped.
+    Neither pickles nor touches tensorflow.'''
+
+    def __init__(self, shapes):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.buffer = mmap.mmap(-1, 8 + 4 * sum(self.sizes))
+        self.seq = np.ndarray((1,), np.int64, self.buffer, 0)
+        self.data = np.ndarray((sum(self.sizes),), np.float32, self.buffer, 8)
+
+    @property
+    def version(self):
+        '''the number of publishes, 0 before the first one'''
+        return int(self.seq[0]) // 2
+
+    def publish(self, arrays):
+        self.seq[0] += 1
+        offset = 0
+        for array, size in zip(arrays, self.sizes):
+            self.data[offset:offset + size] = np.ravel(array)
+            offset += size
+        self.seq[0] += 1
+        return self.version
+
+    def read(self):
+        '''copies of the arrays and their version'''
+        while True:
+            seq = int(self.seq[0])
+            if seq % 2 == 1:
+                time.sleep(0.001)
+                continue
+            data = self.data.copy()
+            if int(self.seq[0]) == seq:
+                break
+        arrays = []
+        offset = 0
+        for shape, size in zip(self.shapes, self.sizes):
+            arrays.append(data[offset:offset + size].reshape(shape))
+            offset += size
+        return arrays, seq // 2
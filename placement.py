@@ -0,0 +1,104 @@
+import os, glob, ctypes, ctypes.util
+from contextlib import contextmanager
+from collections import defaultdict
+
+# the affinity calls apply to the calling thread on linux, threads started
+# afterwards inherit its mask
+
+N_CPU_BITS = 1024
+N_LONG_BITS = 8 * ctypes.sizeof(ctypes.c_ulong)
+cpu_set_t = ctypes.c_ulong * (N_CPU_BITS // N_LONG_BITS)
+
+_libc = None
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+def parse_cpus(spec):
+    '''cpu list like 0-3,8 -> [0, 1, 2, 3, 8]'''
+    cpus = set()
+    for part in spec.split(','):
+        if '-' in part:
+            lo, hi = part.split('-')
+            cpus.update(xrange(int(lo), int(hi) + 1))
+        elif part != '':
+            cpus.add(int(part))
+    return sorted(cpus)
+
+def format_cpus(cpus):
+    '''[0, 1, 2, 3, 8] -> 0-3,8'''
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join('%i' % lo if lo == hi else '%i-%i' % (lo, hi)
+                    for lo, hi in ranges)
+
+def get_affinity():
+    '''cpus the calling thread may run on'''
+    mask = cpu_set_t()
+    if libc().sched_getaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)):
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return [cpu for cpu in xrange(N_CPU_BITS)
+            if mask[cpu // N_LONG_BITS] >> (cpu % N_LONG_BITS) & 1]
+
+def set_affinity(cpus):
+    '''restrict the calling thread to cpus'''
+    mask = cpu_set_t()
+    for cpu in cpus:
+        mask[cpu // N_LONG_BITS] |= 1 << (cpu % N_LONG_BITS)
+    if libc().sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)):
+        e = ctypes.get_errno()
+        raise OSError(e, 'cannot pin to cpus %s: %s' % (format_cpus(cpus),
+                                                         os.strerror(e)))
+
+@contextmanager
+def pinned(spec):
+    '''run the block, and the threads it starts, on the cpus of spec; no-op
+    if spec is None'''
+    if spec is None:
+        yield
+        return
+    previous = get_affinity()
+    set_affinity(parse_cpus(spec))
+    try:
+        yield
+    finally:
+        set_affinity(previous)
+
+def thread_placement():
+    '''cpu list -> number of threads of this process allowed on it'''
+    placement = defaultdict(int)
+    for path in glob.glob('/proc/self/task/*/status'):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith('Cpus_allowed_list:'):
+                        placement[line.split(':')[1].strip()] += 1
+        except IOError:
+            # the thread exited meanwhile
+            continue
+    return dict(placement)
+
+def report_placement(args):
+    '''print where the session threads and the actors run'''
+    def threads(n):
+        return n if n > 0 else 'tensorflow default'
+    print '* placement'
+    print 'main thread on cpus', format_cpus(get_affinity())
+    print 'intra_op_threads', threads(args['intra_op_threads'])
+    print 'inter_op_threads', threads(args['inter_op_threads'])
+    for role in ['learner', 'actor', 'eval']:
+        print '%s cpus %s' % (role, args['%s_cpus' % role] or 'any')
+    for cpus, n in sorted(thread_placement().iteritems()):
+        print '%i threads on cpus %s' % (n, cpus)
+    if args['learner_cpus'] is not None and args['actor_cpus'] is not None \
+        and set(parse_cpus(args['learner_cpus'])) \
+            & set(parse_cpus(args['actor_cpus'])):
+        print '* WARNING: learner and actor cpus overlap'
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+'''serve environments over a local socket so that they run in processes of
+their own, and use them from the trainers as if they were local
+
+Every connection gets an env of its own. Requests and replies are framed
+as a kind byte and a payload length followed by the payload, observations
+as their dtype, shape and raw bytes. The steps of several envs can be in
+flight at once: util.step_all sends all of them before it waits for the
+first reply, which util.rollouts and the trainers' --n_lockstep_envs use.
+
+usage: python remote_env.py --env CartPole-v0 --address /tmp/cartpole.sock
+       python train_q.py --env remote:/tmp/cartpole.sock ...
+'''
+
+import os, json, struct, socket, SocketServer
+import argparse
+import numpy as np
+from synthetic import Namespace
+
+# message kinds
+SPEC, RESET, STEP, RENDER, CLOSE, ERROR = range(6)
+
+HEADER = struct.Struct('<BI')
+ACTION = struct.Struct('<i')
+REWARD_DONE = struct.Struct('<dB')
+ARRAY = struct.Struct('<8sB')
+
+def pack_array(a):
+    a = np.ascontiguousarray(a)
+    return ARRAY.pack(a.dtype.str, a.ndim) \
+        + struct.pack('<%iI' % a.ndim, *a.shape) + a.tostring()
+
+def unpack_array(payload, offset=0):
+    dtype, ndim = ARRAY.unpack_from(payload, offset)
+    offset += ARRAY.size
+    shape = struct.unpack_from('<%iI' % ndim, payload, offset)
+    offset += 4 * ndim
+    return np.frombuffer(payload, np.dtype(dtype.rstrip('\0')),
+                         int(np.prod(shape)), offset).reshape(shape)
+
+def frame(kind, payload=''):
+    return HEADER.pack(kind, len(payload)) + payload
+
+def read_message(rfile):
+    '''the kind and payload of the next message, None at end of stream'''
+    header = rfile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    kind, length = HEADER.unpack(header)
+    payload = rfile.read(length)
+    if len(payload) < length:
+        return None
+    return kind, payload
+
+class EnvHandler(SocketServer.StreamRequestHandler):
+    '''serve one env, made by server.make_env, to one client'''
+
+    def handle(self):
+        env = self.server.make_env()
+        while True:
+            message = read_message(self.rfile)
+            if message is None or message[0] == CLOSE:
+                break
+            kind, payload = message
+            try:
+                if kind == STEP:
+                    obs, reward, done, _ = env.step(
+                        ACTION.unpack(payload)[0])
+                    reply = REWARD_DONE.pack(reward, done) + pack_array(obs)
+                elif kind == RESET:
+                    reply = pack_array(env.reset())
+                elif kind == RENDER:
+                    reply = pack_array(env.render('rgb_array'))
+                elif kind == SPEC:
+                    reply = json.dumps({
+                        'timestep_limit': env.spec.timestep_limit,
+                        'reward_threshold': env.spec.reward_threshold,
+                        'action_size': env.action_space.n,
+                        'observation_shape':
+                        list(env.observation_space.shape),
+                    })
+                else:
+                    raise ValueError('unknown request %i' % kind)
+            except Exception as e:
+                kind, reply = ERROR, '%s: %s' % (type(e).__name__, e)
+            self.wfile.write(frame(kind, reply))
+
+class EnvServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, address, make_env):
+        self.make_env = make_env
+        if os.path.exists(address):
+            os.remove(address)
+        SocketServer.UnixStreamServer.__init__(self, address, EnvHandler)
+
+class ProtocolError(RuntimeError):
+    pass
+
+class RemoteEnv(object):
+    '''A client of an EnvServer with enough of the gym interface for
+    util.passthrough and util.use_render_state, see util.make_env.
+
+    A step can be split into send_step() and recv_step(), and
+    util.step_all sends the steps of several remote envs before it
+    awaits any reply, so that their servers step them in parallel. Every
+    other request waits for its reply; one sent while a step is still in
+    flight raises ProtocolError.'''
+
+    def __init__(self, address):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.rfile = self.sock.makefile('rb', 1 << 16)
+        self.step_sent = False
+
+        spec = json.loads(self.request(SPEC))
+        self.spec = Namespace(timestep_limit=spec['timestep_limit'],
+                              reward_threshold=spec['reward_threshold'])
+        self.action_space = Namespace(n=spec['action_size'])
+        self.observation_space = Namespace(
+            shape=tuple(spec['observation_shape']))
+
+    def send(self, kind, payload=''):
+        self.sock.sendall(frame(kind, payload))
+
+    def recv(self, expected_kind):
+        message = read_message(self.rfile)
+        if message is None:
+            raise ProtocolError('the env server closed the connection')
+        kind, payload = message
+        if kind == ERROR:
+            raise RuntimeError('env server: %s' % payload)
+        if kind != expected_kind:
+            raise ProtocolError('expected reply %i, got %i'
+                                % (expected_kind, kind))
+        return payload
+
+    def request(self, kind, payload=''):
+        if self.step_sent:
+            raise ProtocolError('request %i with a step in flight' % kind)
+        self.send(kind, payload)
+        return self.recv(kind)
+
+    def send_step(self, action):
+        if self.step_sent:
+            raise ProtocolError('a step is in flight already')
+        self.send(STEP, ACTION.pack(action))
+        self.step_sent = True
+
+    def recv_step(self):
+        if not self.step_sent:
+            raise ProtocolError('no step in flight')
+        self.step_sent = False
+        payload = self.recv(STEP)
+        reward, done = REWARD_DONE.unpack_from(payload)
+        return unpack_array(payload, REWARD_DONE.size), reward, \
+            bool(done), {}
+
+    def step(self, action):
+        self.send_step(action)
+        return self.recv_step()
+
+    def reset(self):
+        return unpack_array(self.request(RESET))
+
+    def render(self, mode='human', close=False):
+        if mode == 'rgb_array':
+            return unpack_array(self.request(RENDER))
+        return None
+
+    def close(self):
+        try:
+            self.send(CLOSE)
+        except socket.error:
+            pass
+        self.sock.close()
+
+if __name__ == '__main__':
+    from util import make_env
+
+    parse = argparse.ArgumentParser()
+    parse.add_argument('--env', default='CartPole-v0')
+    parse.add_argument('--address', default='/tmp/remote-env.sock')
+
+    args = parse.parse_args()
+
+    server = EnvServer(args.address, lambda: make_env(args.env))
+    print '* serving %s at %s' % (args.env, args.address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(args.address)
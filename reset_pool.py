@@ -0,0 +1,54 @@
+import sys, threading
+from Queue import Queue
+
+class ResetPool(object):
+    '''An environment 4-tuple over several instances of the same env that
+    resets the instances in a background thread.
+
+    reset() hands out an instance that is already reset along with its
+    first observation, and queues the instance of the previous episode for
+    resetting, so with at least one spare instance the rollouts never wait
+    for a reset unless resets take longer than episodes. step() and
+    render() act on the instance of the current episode. Resets run off
+    the calling thread, which envs that render with an OpenGL context of
+    their thread may not allow.'''
+
+    def __init__(self, envs):
+        self.spec = envs[0][0]
+        self.current = None
+        self.to_reset = Queue()
+        self.ready = Queue()
+        for env in envs:
+            self.to_reset.put(env)
+        self.thread = threading.Thread(target=self.run, name='reset-pool')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            env = self.to_reset.get()
+            try:
+                self.ready.put((env, env[2](), None))
+            except Exception:
+                self.ready.put((env, None, sys.exc_info()))
+
+    def reset(self):
+        if self.current is not None:
+            self.to_reset.put(self.current)
+            self.current = None
+        env, obs, error = self.ready.get()
+        if error is not None:
+            # try again with this instance at the next reset
+            self.to_reset.put(env)
+            raise error[0], error[1], error[2]
+        self.current = env
+        return obs
+
+    def step(self, action):
+        return self.current[1](action)
+
+    def render(self, *args, **kwargs):
+        return self.current[3](*args, **kwargs)
+
+    def env(self):
+        return self.spec, self.step, self.reset, self.render
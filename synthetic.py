@@ -0,0 +1,106 @@
+import time
+import numpy as np
+
+class Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def spin(secs):
+    '''busy-wait for secs to stand in for the CPU cost of a simulator'''
+    end = time.time() + secs
+    while time.time() < end:
+        pass
+
+class SyntheticEnv(object):
+    '''A deterministic stand-in for a gym environment.
+
+    Observations are drawn from a fixed pool of n_frames random frames,
+    float vectors or uint8 images when observation_shape is HxWxC. Every
+    frame carries a cue action, its brightest entry, and stepping with the
+    cue action of the current frame earns a reward of 1. Episode lengths
+    are `episode_length` ticks ('fixed'), uniform in [1, 2 *
+    episode_length) ('uniform') or geometric with that mean ('geometric').
+    Every step costs step_secs, spent busy ('spin') or idle ('sleep').
+
+    It exposes just enough of the gym interface for util.passthrough and
+    util.use_render_state: spec.timestep_limit, action_space.n,
+    observation_space.shape, reset(), step() and render('rgb_array'). The
+    frames are drawn with seed and the episodes with episode_seed, seed if
+    it is None, so instances with the same seed but episode seeds of their
+    own pose the same task with different trajectories. The same seeds give
+    the same episodes.'''
+
+    def __init__(self, observation_shape=(4,), action_size=2,
+                 episode_length=200, length_distribution='fixed',
+                 step_secs=0., cost='spin', n_frames=64, seed=0,
+                 episode_seed=None, timestep_limit=10**9):
+        self.observation_shape = tuple(observation_shape)
+        self.action_size = action_size
+        self.episode_length = episode_length
+        self.length_distribution = length_distribution
+        self.step_secs = step_secs
+        self.cost = spin if cost == 'spin' else time.sleep
+        rng = np.random.RandomState(seed)
+
+        self.spec = Namespace(timestep_limit=timestep_limit,
+                              reward_threshold=None)
+        self.action_space = Namespace(n=action_size)
+        self.observation_space = Namespace(shape=self.observation_shape)
+
+        # frames and their cue actions
+        image = len(self.observation_shape) == 3
+        self.cues = rng.randint(action_size, size=n_frames)
+        self.frames = []
+        for cue in self.cues:
+            if image:
+                frame = rng.randint(0, 128, self.observation_shape)
+                frame = frame.astype(np.uint8)
+                frame.flat[cue] = 255
+            else:
+                frame = rng.uniform(size=self.observation_shape)
+                frame.flat[cue] += 1.
+            self.frames.append(frame)
+        self.rng = rng if episode_seed is None \
+            else np.random.RandomState(episode_seed)
+
+        self.frame = 0
+        self.t = 0
+        self.length = 0
+
+    def sample_length(self):
+        if self.length_distribution == 'uniform':
+            return self.rng.randint(1, 2 * self.episode_length)
+        if self.length_distribution == 'geometric':
+            return self.rng.geometric(1. / self.episode_length)
+        return self.episode_length
+
+    def reset(self):
+        self.t = 0
+        self.length = self.sample_length()
+        self.frame = self.rng.randint(len(self.frames))
+        return self.frames[self.frame]
+
+    def step(self, action):
+        if self.step_secs > 0:
+            self.cost(self.step_secs)
+        reward = 1. if action == self.cues[self.frame] else 0.
+        self.t += 1
+        self.frame = self.rng.randint(len(self.frames))
+        done = self.t >= self.length
+        return self.frames[self.frame], reward, done, {}
+
+    def render(self, mode='human', close=False):
+        if mode == 'rgb_array':
+            frame = self.frames[self.frame]
+            if frame.dtype != np.uint8:
+                # show a vector observation as a gray strip
+                frame = np.tile(np.uint8(frame.reshape(1, -1, 1) * 127),
+                                (8, 1, 3))
+            return frame
+        return None
+
+def synthetic_env(observation_shape=(4,), action_size=2, **kwargs):
+    '''a SyntheticEnv as an environment 4-tuple, see util.passthrough'''
+    from util import passthrough
+    return passthrough(SyntheticEnv(observation_shape, action_size,
+                                    **kwargs))
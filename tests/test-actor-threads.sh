@@ -0,0 +1,3 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-actor-threads --optimizer rmsprop --n_train_steps 1000 --env CartPole-v0 --momentum 0 --initial_learning_rate 1e-2 --n_update_episodes 8 --n_batch_ticks 128 --n_decay_steps 1000 --decay_rate 0.8 --n_actor_threads 4 --actor_queue_size 8
+python train_q.py --model simple2_q --checkpoint_dir checkpoints/test-q-actor-threads --optimizer rmsprop --n_train_steps 1000 --env CartPole-v0 --n_update_episodes 4 --initial_epsilon 0.2 --epsilon_decay_rate 0.01 --n_actor_threads 4 --actor_queue_size 8
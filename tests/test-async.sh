@@ -0,0 +1,3 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-async --n_train_steps 1000 --env CartPole-v0 --initial_learning_rate 1e-2 --n_learner_threads 4 --n_timing_interval 50
+python train_q.py --model simple_q --checkpoint_dir checkpoints/test-q-async --n_train_steps 1000 --env CartPole-v0 --n_learner_threads 3 --thread_initial_epsilons 0.5 0.1 0.01 --n_timing_interval 50
@@ -0,0 +1,3 @@
+#!/bin/bash
+python autotune.py --trainer train_policy_gradient --n_trial_steps 5 --memory_cap_mb 2000 --output checkpoints/tuned-pg.json -- --model simple --env synthetic-4-2-200
+python train_policy_gradient.py --model simple --env synthetic-4-2-200 --checkpoint_dir checkpoints/test-pg-tuned --n_train_steps 20 --no_summary --tuned_config checkpoints/tuned-pg.json
@@ -0,0 +1,2 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-bg-eval --optimizer rmsprop --n_train_steps 500 --env CartPole-v0 --momentum 0 --initial_learning_rate 1e-2 --n_update_episodes 4 --n_batch_ticks 128 --n_decay_steps 1000 --decay_rate 0.8 --background_eval --eval_poll_secs 5 --n_eval_samples 4
@@ -0,0 +1,2 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-clipped --optimizer adam --n_train_steps 200 --env CartPole-v0 --initial_learning_rate 1e-3 --n_update_episodes 8 --objective baseline --n_epochs 4 --n_minibatch_ticks 64 --clip_epsilon 0.2 --metrics_path checkpoints/test-pg-clipped/metrics.jsonl
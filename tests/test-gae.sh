@@ -0,0 +1,3 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-gae --optimizer rmsprop --n_train_steps 1000 --env CartPole-v0 --momentum 0 --initial_learning_rate 1e-2 --n_update_episodes 2 --n_batch_ticks 128 --objective gae --reward_gamma 0.99 --gae_lambda 0.95 --value_coeff 0.5
+python train_policy_gradient.py --model cnn --checkpoint_dir checkpoints/test-pg-gae-cnn --n_train_steps 20 --env synthetic-42x42x3-6 --objective gae --reward_gamma 0.99 --n_epochs 2 --no_summary
@@ -0,0 +1,2 @@
+#!/bin/bash
+python -m benchmarks.hotpaths --n_repeats 3 --output hotpaths.json
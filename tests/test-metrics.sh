@@ -0,0 +1,3 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-metrics --n_train_steps 20 --env CartPole-v0 --no_summary --n_timing_interval 10 --metrics_path checkpoints/test-pg-metrics/metrics.jsonl --metrics_flush_secs 1
+python train_q.py --model simple_q --checkpoint_dir checkpoints/test-q-metrics --n_train_steps 20 --env CartPole-v0 --no_summary --metrics_path checkpoints/test-q-metrics/metrics.csv
@@ -0,0 +1,2 @@
+#!/bin/bash
+python -m benchmarks.model_cost --n_repeats 3 --latency_budget_ms 20 --output model_cost.csv
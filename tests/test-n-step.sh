@@ -0,0 +1,4 @@
+#!/bin/bash
+python train_q.py --model simple2_q --checkpoint_dir checkpoints/test-q-n-step --optimizer rmsprop --n_train_steps 1000 --env CartPole-v0 --n_update_episodes 4 --reward_gamma 0.99 --initial_epsilon 0.2 --epsilon_decay_rate 0.01 --n_step 4
+python train_sars.py --model simple2_q --checkpoint_dir checkpoints/test-sars-n-step --n_train_steps 200 --env CartPole-v0 --reward_gamma 0.99 --n_step 4 --no_summary
+python train_sarsa.py --model simple2_q --checkpoint_dir checkpoints/test-sarsa-n-step --n_train_steps 200 --env CartPole-v0 --reward_gamma 0.99 --n_step 4 --no_summary
@@ -0,0 +1,2 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --env synthetic-4-2-200 --checkpoint_dir checkpoints/test-pg-placement --n_train_steps 50 --no_summary --intra_op_threads 2 --inter_op_threads 1 --learner_cpus 0-1 --actor_cpus 2 --background_eval --eval_cpus 3
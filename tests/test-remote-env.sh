@@ -0,0 +1,8 @@
+#!/bin/bash
+python remote_env.py --env CartPole-v0 --address /tmp/test-remote-env.sock &
+server=$!
+sleep 2
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-remote --n_train_steps 200 --env remote:/tmp/test-remote-env.sock --n_actor_threads 4 --no_summary
+python train_q.py --model simple2_q --checkpoint_dir checkpoints/test-q-remote --n_train_steps 200 --env remote:/tmp/test-remote-env.sock --n_lockstep_envs 4 --no_summary
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-remote-lockstep --n_train_steps 100 --env remote:/tmp/test-remote-env.sock --n_lockstep_envs 4 --n_epochs 2 --no_summary
+kill $server
@@ -0,0 +1,3 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-render --n_train_steps 20 --env CartPole-v0 --render --render_fps 10 --no_summary
+python train_q.py --model simple2_q --checkpoint_dir checkpoints/test-q-monitor --n_train_steps 20 --env CartPole-v0 --monitor --monitor_dir /tmp/test-q-monitor --render_fps 15 --no_summary
@@ -0,0 +1,4 @@
+#!/bin/bash
+python train_policy_gradient.py --model cnn --checkpoint_dir checkpoints/test-pg-reset-pool --n_train_steps 20 --env synthetic-84x84x3-6-50 --use_render_state --scale 0.5 --n_spare_envs 2 --no_summary
+python train_q.py --model simple2_q --checkpoint_dir checkpoints/test-q-reset-pool --n_train_steps 200 --env CartPole-v0 --n_spare_envs 1 --no_summary
+python benchmarks/hotpaths.py --n_repeats 3 --only 'rollout/render_state' --output /tmp/hotpaths-reset-pool.json
@@ -0,0 +1,2 @@
+#!/bin/bash
+python -m benchmarks.startup --n_repeats 3 --output startup.json
@@ -0,0 +1,5 @@
+#!/bin/bash
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-synthetic --n_train_steps 200 --env synthetic-4-2-100-geometric --no_summary
+python train_q.py --model cnn_q --checkpoint_dir checkpoints/test-q-synthetic --n_train_steps 20 --env synthetic-42x42x3-6 --no_summary
+python train_policy_gradient.py --model cnn --checkpoint_dir checkpoints/test-pg-synthetic-render --n_train_steps 20 --env synthetic-84x84x3-6 --use_render_state --scale 0.5 --no_summary
+python train_policy_gradient.py --model simple --checkpoint_dir checkpoints/test-pg-synthetic-cost --n_train_steps 20 --env synthetic-4-2-50-fixed-1e-4 --n_spare_envs 1 --no_summary
@@ -0,0 +1,67 @@
+import time
+from collections import defaultdict
+
+class PhaseTimer(object):
+    '''Accumulates wall time per named phase and counts of events (env
+    ticks, policy calls, learner samples) between reports.
+
+    Phases are delimited with start(name) and stop(name) and may nest. A
+    disabled timer returns right away from every call, so instrumented code
+    pays next to nothing when timing is off.
+
+    While events is a list, stop() also appends (name, start, stop)
+    spans to it; see tracing.RunTracer.'''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.starts = {}
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.last_report_time = time.time()
+        self.events = None
+
+    def start(self, name):
+        if self.enabled:
+            self.starts[name] = time.time()
+
+    def stop(self, name):
+        if self.enabled:
+            now = time.time()
+            self.totals[name] += now - self.starts[name]
+            if self.events is not None:
+                self.events.append((name, self.starts[name], now))
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] += n
+
+    def report(self):
+        '''return the seconds spent in every phase, their fractions of the
+        wall time and the event rates since the last report, then reset'''
+        now = time.time()
+        elapsed = max(now - self.last_report_time, 1e-9)
+        stats = {'time/wall_secs': elapsed}
+        for name, secs in self.totals.iteritems():
+            stats['time/%s_secs' % name] = secs
+            stats['time/%s_fraction' % name] = secs / elapsed
+        for name, n in self.counts.iteritems():
+            stats['throughput/%s_per_sec' % name] = n / elapsed
+        self.totals.clear()
+        self.counts.clear()
+        self.last_report_time = now
+        return stats
+
+# shared by callers that do not time anything
+NULL_TIMER = PhaseTimer(enabled=False)
+
+def print_stats(stats, title='timing'):
+    print '* %s' % title
+    for k in sorted(stats.keys()):
+        print '%s %.4g' % (k, stats[k])
+
+def write_stats(writer, step, stats):
+    '''write a dict of scalars to a summary writer'''
+    import tensorflow as tf
+    summary = tf.Summary(value=[tf.Summary.Value(tag=k, simple_value=v)
+                                for k, v in sorted(stats.iteritems())])
+    writer.add_summary(summary, step)
@@ -0,0 +1,90 @@
+import os, json
+
+class RunTracer(object):
+    '''Captures Chrome-trace timelines of sampled iterations.
+
+    On every n_trace_interval-th iteration the sess.run calls made with
+    **tracer.run_kwargs() run with full tracing and their RunMetadata is
+    collected. finish() merges the step stats of all of them into one
+    timeline and adds the host-side phases recorded by a timing.PhaseTimer
+    as a separate "python" process, then writes
+    `trace_dir`/timeline-`name`-`step`.json for chrome://tracing.'''
+
+    def __init__(self, trace_dir, n_trace_interval):
+        self.trace_dir = trace_dir
+        self.n_trace_interval = n_trace_interval
+        self.active = False
+        self.run_metadatas = []
+        self.timer = None
+
+    def start(self, i, timer=None):
+        '''begin tracing if iteration i is sampled'''
+        if self.n_trace_interval <= 0 or i % self.n_trace_interval != 0:
+            return
+        import tensorflow as tf
+        self.active = True
+        self.run_metadatas = []
+        self.options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        self.timer = timer
+        if timer is not None:
+            timer.events = []
+
+    def run_kwargs(self):
+        '''extra keyword arguments for sess.run'''
+        if not self.active:
+            return {}
+        import tensorflow as tf
+        run_metadata = tf.RunMetadata()
+        self.run_metadatas.append(run_metadata)
+        return {'options': self.options, 'run_metadata': run_metadata}
+
+    def finish(self, name, step):
+        '''write the timeline of the traced iteration if there is one'''
+        if not self.active:
+            return None
+        from tensorflow.core.framework import step_stats_pb2
+        from tensorflow.python.client import timeline
+
+        # merge the device stats of all traced runs
+        step_stats = step_stats_pb2.StepStats()
+        dev_stats = {}
+        for run_metadata in self.run_metadatas:
+            for ds in run_metadata.step_stats.dev_stats:
+                if ds.device not in dev_stats:
+                    dev_stats[ds.device] = step_stats.dev_stats.add(
+                        device=ds.device)
+                dev_stats[ds.device].node_stats.extend(ds.node_stats)
+        trace = json.loads(timeline.Timeline(step_stats)
+                           .generate_chrome_trace_format())
+
+        # annotate the host-side phases
+        if self.timer is not None:
+            pid = 1 + max([e.get('pid', 0) for e in trace['traceEvents']]
+                          + [0])
+            trace['traceEvents'].append({
+                'name': 'process_name', 'ph': 'M', 'pid': pid,
+                'args': {'name': 'python'},
+            })
+            for phase, start, stop in self.timer.events:
+                trace['traceEvents'].append({
+                    'name': phase, 'cat': 'python', 'ph': 'X',
+                    'pid': pid, 'tid': 0,
+                    'ts': start * 1e6, 'dur': (stop - start) * 1e6,
+                })
+            self.timer.events = None
+
+        if not os.path.exists(self.trace_dir):
+            os.makedirs(self.trace_dir)
+        path = os.path.join(self.trace_dir,
+                            'timeline-%s-%i.json' % (name, step))
+        with open(path, 'wb') as f:
+            json.dump(trace, f)
+        print '* wrote timeline to', path
+
+        self.active = False
+        self.run_metadatas = []
+        self.timer = None
+        return path
+
+# shared by callers that do not trace
+NULL_TRACER = RunTracer(None, 0)
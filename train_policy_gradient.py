@@ -1,14 +1,26 @@
 #!/usr/bin/env python
 
-import tensorflow as tf
 import numpy as np
-import os, sys, cPickle, time, glob, itertools, json
+import os, sys, cPickle, time, glob, itertools, json, multiprocessing
+from Queue import Full
 from Queue import deque
-import tqdm
 import argparse
 import importlib
-import gym
-from util import pad_zeros, duplicate_obs, rollout, vector_slice
+import inspect
+from functools import partial
+from checkpoint import CheckpointManager, exit_on_sigterm
+from timing import PhaseTimer, print_stats, write_stats
+from tracing import RunTracer, NULL_TRACER
+from memory import MemoryMonitor
+from placement import pinned, set_affinity, parse_cpus, report_placement
+from metrics import MetricsSink, NULL_METRICS
+from parallel import WorkerPool, SharedWeights, split, receive
+from hogwild import UpdateCounter, start_learners, supervise
+from actor_pool import ActorPool
+from util import pad_zeros, duplicate_obs, rollout, vector_slice, \
+    generalized_advantages, launch_evaluator, stop_evaluator, \
+    graph_cache_key, load_or_build_graph, TrainingState, session_config, \
+    parse_args_with_config, env_from_args, rollouts
 
 def get_current_run_id(checkpoint_dir):
     paths = glob.glob('%s/hyperparameters.*.json' % checkpoint_dir)
@@ -19,6 +31,7 @@ def get_current_run_id(checkpoint_dir):
 def restore_vars(saver, sess, checkpoint_dir, restart=False):
     ''' Restore saved net, global score and step, and epsilons OR
     create checkpoint directory for later storage. '''
+    import tensorflow as tf
     sess.run(tf.initialize_all_variables())
 
     if not restart:
@@ -36,7 +49,488 @@ def restore_vars(saver, sess, checkpoint_dir, restart=False):
 def load_rollout(data_dir):
     pass
 
+# hyperparameters that change the training graph
+GRAPH_ARGS = ['reg_coeff', 'optimizer', 'initial_learning_rate',
+              'n_decay_steps', 'decay_rate', 'no_decay_staircase', 'momentum',
+              'adam_beta1', 'adam_beta2', 'adam_epsilon', 'rmsprop_decay',
+              'rmsprop_epsilon', 'no_summary', 'tf_seed', 'clip_epsilon',
+              'objective', 'value_coeff', 'n_epochs']
+
+def build_graph(policy_input_shape, action_size, args, build_model):
+    '''build the training graph and return the handles to its tensors'''
+    import tensorflow as tf
+
+    # model
+    print '* building model %s' % args['model']
+    if args['objective'] == 'gae':
+        # with a value head, fitted along with the policy
+        if 'value_head' not in inspect.getargspec(build_model).args:
+            raise ValueError('model %s has no value head' % args['model'])
+        obs_ph, keep_prob_ph, logits, probs, state_value = build_model(
+            policy_input_shape,
+            action_size,
+            value_head=True)
+        state_value = tf.reshape(state_value, [-1])
+    else:
+        obs_ph, keep_prob_ph, logits, probs, state_value = build_model(
+            policy_input_shape,
+            action_size)
+    actions_taken_ph = tf.placeholder('int32')
+    avg_len_episode_ph = tf.placeholder('float')
+    avg_episode_reward_ph = tf.placeholder('float')
+    max_episode_reward_ph = tf.placeholder('float')
+    min_episode_reward_ph = tf.placeholder('float')
+    avg_tick_reward_ph = tf.placeholder('float')
+    avg_reg_ph = tf.placeholder('float')
+
+    # expected reward under policy
+    # entropy regularizer to encourage action diversity
+    entropy_reg = - tf.reduce_mean(tf.reduce_sum(probs * tf.log(probs), 1))
+    action_logits = vector_slice(tf.log(probs), actions_taken_ph)
+    advantage_ph = tf.placeholder('float')
+
+    # with rewards to go and baseline
+    objective = tf.reduce_sum(action_logits * advantage_ph) \
+        + args['reg_coeff'] * entropy_reg
+
+    # squared error of the value head to the lambda-returns
+    return_ph = tf.placeholder('float')
+    if state_value is not None:
+        value_loss = tf.reduce_sum(tf.square(return_ph - state_value))
+        objective -= args['value_coeff'] * value_loss
+
+    # clipped importance ratio objective of the multi-epoch minibatch
+    # updates, scaled like the per-episode sums above
+    behavior_log_prob_ph = None
+    clipped_objective = None
+    clip_fraction = None
+    if args['n_epochs'] > 0:
+        behavior_log_prob_ph = tf.placeholder('float')
+        ratio = tf.exp(action_logits - behavior_log_prob_ph)
+        clipped_ratio = tf.clip_by_value(ratio, 1. - args['clip_epsilon'],
+                                         1. + args['clip_epsilon'])
+        clipped_objective = avg_len_episode_ph * tf.reduce_mean(tf.minimum(
+            ratio * advantage_ph, clipped_ratio * advantage_ph)) \
+            + args['reg_coeff'] * entropy_reg
+        if state_value is not None:
+            clipped_objective -= args['value_coeff'] * avg_len_episode_ph \
+                * tf.reduce_mean(tf.square(return_ph - state_value))
+        clip_fraction = tf.reduce_mean(tf.to_float(
+            tf.abs(ratio - 1.) > args['clip_epsilon']))
+
+    # optimization
+    global_step = tf.Variable(0, trainable=False, name='global_step')
+    learning_rate = tf.train.exponential_decay(
+        args['initial_learning_rate'],
+        global_step, args['n_decay_steps'],
+        args['decay_rate'],
+        staircase=not args['no_decay_staircase'])
+
+    if args['optimizer'] == 'adam':
+        optimizer = tf.train.AdamOptimizer(learning_rate,
+                                           args['adam_beta1'],
+                                           args['adam_beta2'],
+                                           args['adam_epsilon'])
+    elif args['optimizer'] == 'ag':
+        optimizer = tf.train.MomentumOptimizer(learning_rate,
+                                               args['momentum'],
+                                               use_nesterov=True)
+    elif args['optimizer'] == 'rmsprop':
+        optimizer = tf.train.RMSPropOptimizer(learning_rate,
+                                               args['rmsprop_decay'],
+                                               args['momentum'],
+                                               args['rmsprop_epsilon'])
+    else:
+        optimizer = tf.train.MomentumOptimizer(learning_rate,
+                                               args['momentum'])
+
+    # train ops
+    grad_vars = optimizer.compute_gradients(-objective)
+    grads = [grad for grad, var in grad_vars]
+    update_policy_op = optimizer.apply_gradients(
+        grad_vars,
+        global_step=global_step)
+    update_clipped_op = None
+    if clipped_objective is not None:
+        update_clipped_op = optimizer.minimize(-clipped_objective,
+                                               global_step=global_step)
+
+    # summary
+    if not args['no_summary']:
+        # cheap scalar summaries
+        scalar_summary_op = tf.merge_summary([
+            tf.scalar_summary('learning_rate', learning_rate),
+            tf.scalar_summary('average_episode_reward', avg_episode_reward_ph),
+            tf.scalar_summary('max_episode_reward', max_episode_reward_ph),
+            tf.scalar_summary('min_episode_reward', min_episode_reward_ph),
+            tf.scalar_summary('average_tick_reward', avg_tick_reward_ph),
+            tf.scalar_summary('average_episode_length', avg_len_episode_ph),
+            tf.scalar_summary('average_tick_regularization', avg_reg_ph),
+        ])
+
+        # expensive histogram summaries
+        print '* extra summary'
+        histogram_summaries = []
+        for g, v in grad_vars:
+            histogram_summaries.append(
+                tf.histogram_summary('gradients/%s' % v.name, g))
+            print 'gradients/%s' % v.name
+        histogram_summary_op = tf.merge_summary(histogram_summaries)
+    else:
+        scalar_summary_op = None
+        histogram_summary_op = None
+
+    saver = tf.train.Saver(max_to_keep=2, keep_checkpoint_every_n_hours=1)
+
+    return {
+        'obs_ph': obs_ph,
+        'keep_prob_ph': keep_prob_ph,
+        'probs': probs,
+        'state_value': state_value,
+        'return_ph': return_ph,
+        'actions_taken_ph': actions_taken_ph,
+        'advantage_ph': advantage_ph,
+        'avg_len_episode_ph': avg_len_episode_ph,
+        'avg_episode_reward_ph': avg_episode_reward_ph,
+        'max_episode_reward_ph': max_episode_reward_ph,
+        'min_episode_reward_ph': min_episode_reward_ph,
+        'avg_tick_reward_ph': avg_tick_reward_ph,
+        'avg_reg_ph': avg_reg_ph,
+        'entropy_reg': entropy_reg,
+        'global_step': global_step,
+        'learning_rate': learning_rate,
+        'grads': grads,
+        'update_policy_op': update_policy_op,
+        'behavior_log_prob_ph': behavior_log_prob_ph,
+        'update_clipped_op': update_clipped_op,
+        'clip_fraction': clip_fraction,
+        'scalar_summary_op': scalar_summary_op,
+        'histogram_summary_op': histogram_summary_op,
+        'saver': saver,
+    }
+
+def predict_values(sess, handles, args, obs):
+    '''the state values of obs in batches of n_batch_ticks'''
+    return np.concatenate([sess.run(handles['state_value'], feed_dict={
+        handles['obs_ph']: obs[start:start + args['n_batch_ticks']],
+        handles['keep_prob_ph']: 1. - args['dropout_rate'],
+    }) for start in xrange(0, len(obs), args['n_batch_ticks'])])
+
+def preprocess(episodes, args, avg_tick_reward, value_fn=None):
+    '''stacked observations, actions taken and objective values of every
+    tick of the episodes, and the lambda-returns the value head is fitted
+    to for the gae objective, None otherwise, with value_fn giving the
+    state values of stacked observations'''
+    obs = []
+    action_inds = []
+    f_vals = []
+    for observations, actions, rewards in episodes:
+        len_episode = len(observations)
+        obs += list(duplicate_obs(pad_zeros(observations,
+                                            args['n_obs_ticks']),
+                                  args['n_obs_ticks']))
+        action_inds += actions
+        # compute the objective values
+        if args['objective'] == 'gae':
+            # estimated for the whole batch below
+            pass
+        elif args['objective'] == 'episodic_reward':
+            # total episodic reward with lambda decay over ticks
+            f_vals += [np.sum(np.prod([
+                rewards,
+                [args['reward_gamma']**t
+                 for t in xrange(len_episode)]],
+                axis=0))
+            ] * len_episode
+        elif args['objective'] == 'reward_to_go':
+            # rewards to go with lambda decay
+            f_vals += [np.sum(np.prod([
+                rewards[t:],
+                [args['reward_gamma']**u
+                 for u in xrange(len_episode-t)]],
+                axis=0))
+            for t in xrange(len_episode)]
+        else:
+            # rewards to go with lambda decay and baseline
+            f_vals += [np.sum(np.prod([
+                rewards[t:],
+                [args['reward_gamma']**u
+                 for u in xrange(len_episode-t)]],
+                axis=0)) - avg_tick_reward * (len_episode-t)
+            for t in xrange(len_episode)]
+    if args['objective'] != 'gae':
+        return obs, action_inds, f_vals, None
+    # advantages of the whole batch at once
+    values = value_fn(obs)
+    lengths = [len(observations) for observations, _, _ in episodes]
+    f_vals, returns = generalized_advantages(
+        [rewards for _, _, rewards in episodes],
+        np.split(values, np.cumsum(lengths)[:-1]),
+        args['reward_gamma'], args['gae_lambda'])
+    return obs, action_inds, list(f_vals), list(returns)
+
+def accumulate_gradients(sess, handles, obs, action_inds, f_vals, args,
+                         tracer=NULL_TRACER, returns=None):
+    '''sums of the policy gradients and of the entropy regularization
+    over batches of n_batch_ticks ticks, fitting the value head to returns
+    if given'''
+    grads = handles['grads']
+    acc_grads = [np.zeros(grad.get_shape()) for grad in grads]
+    acc_reg = 0.
+    n_ticks = len(obs)
+    n_batch = int(np.ceil(n_ticks * 1. / args['n_batch_ticks']))
+    for j in xrange(n_batch):
+        start = j * args['n_batch_ticks']
+        end = min(start + args['n_batch_ticks'], n_ticks)
+        grad_feed = {
+            handles['obs_ph']: obs[start:end],
+            handles['keep_prob_ph']: 1. - args['dropout_rate'],
+            handles['actions_taken_ph']: action_inds[start:end],
+            handles['advantage_ph']: f_vals[start:end],
+        }
+        if returns is not None:
+            grad_feed[handles['return_ph']] = returns[start:end]
+
+        # compute the expectation of gradients
+        grads_val, entropy_reg_val = sess.run([
+            grads,
+            handles['entropy_reg'],
+            ], feed_dict=grad_feed,
+            **tracer.run_kwargs())
+        for k, g_val in enumerate(grads_val):
+            acc_grads[k] += g_val
+        acc_reg += entropy_reg_val * (end - start)
+    return acc_grads, acc_reg
+
+def clipped_updates(sess, handles, obs, action_inds, f_vals,
+                    behavior_log_probs, state, args, tracer=NULL_TRACER,
+                    returns=None):
+    '''n_epochs epochs of updates on shuffled minibatches of
+    n_minibatch_ticks ticks with the clipped importance ratio objective,
+    returns the entropy regularization summed over the ticks and the
+    fraction of clipped ratios in the last epoch, and the feed of its last
+    minibatch'''
+    obs = np.asarray(obs)
+    action_inds = np.asarray(action_inds)
+    f_vals = np.asarray(f_vals)
+    behavior_log_probs = np.asarray(behavior_log_probs)
+    if returns is not None:
+        returns = np.asarray(returns)
+    n_ticks = len(obs)
+    for epoch in xrange(args['n_epochs']):
+        order = np.random.permutation(n_ticks)
+        acc_reg = 0.
+        acc_clipped = 0.
+        for start in xrange(0, n_ticks, args['n_minibatch_ticks']):
+            inds = order[start:start + args['n_minibatch_ticks']]
+            feed = {
+                handles['obs_ph']: obs[inds],
+                # without dropout, as the behavior log-probs were taken
+                handles['keep_prob_ph']: 1.,
+                handles['actions_taken_ph']: action_inds[inds],
+                handles['advantage_ph']: f_vals[inds],
+                handles['behavior_log_prob_ph']: behavior_log_probs[inds],
+                handles['avg_len_episode_ph']: n_ticks * 1.
+                / args['n_update_episodes'],
+            }
+            if returns is not None:
+                feed[handles['return_ph']] = returns[inds]
+            _, learning_rate_val, entropy_reg_val, clip_fraction_val = \
+                sess.run([
+                    handles['update_clipped_op'],
+                    handles['learning_rate'],
+                    handles['entropy_reg'],
+                    handles['clip_fraction'],
+                ], feed_dict=feed, **tracer.run_kwargs())
+            state.update(learning_rate_val)
+            acc_reg += entropy_reg_val * len(inds)
+            acc_clipped += clip_fraction_val * len(inds)
+    return acc_reg, acc_clipped / n_ticks, feed
+
+def gradient_worker(conn, worker_id, args, build_model):
+    '''serve rollouts and gradients with the weights sent by the learner,
+    see parallel.WorkerPool'''
+    import tensorflow as tf
+    # an env of our own rather than a forked copy of the learner's
+    gym_env, (env_spec, env_step, env_reset, _) = env_from_args(
+        args, 1 + worker_id)
+
+    policy_input_shape = list(env_spec['observation_shape'])
+    policy_input_shape[-1] *= args['n_obs_ticks']
+    with tf.Graph().as_default():
+        tf.set_random_seed(args['tf_seed'])
+        handles = build_graph(policy_input_shape, env_spec['action_size'],
+                              args, build_model)
+        # the learner sends its trainable variables by name
+        weight_phs = dict((v.name, tf.placeholder(v.dtype.base_dtype,
+                                                  v.get_shape()))
+                          for v in tf.trainable_variables())
+        assign_op = tf.group(*[v.assign(weight_phs[v.name])
+                               for v in tf.trainable_variables()])
+        config = tf.ConfigProto(
+            intra_op_parallelism_threads=args['worker_threads'],
+            inter_op_parallelism_threads=args['worker_threads'])
+        with tf.Session(config=config) as sess:
+            sess.run(tf.initialize_all_variables())
+            policy = lambda obs: sess.run(handles['probs'], feed_dict={
+                handles['obs_ph']: [obs],
+                handles['keep_prob_ph']: 1. - args['dropout_rate'],
+            })[0]
+
+            while True:
+                message = conn.recv()
+                if message[0] == 'rollout':
+                    # load the learner's weights and roll out our share
+                    _, weights, n_episodes = message
+                    sess.run(assign_op, feed_dict=dict(
+                        (weight_phs[name], w)
+                        for name, w in weights.iteritems()))
+                    episodes = [rollout(policy, env_spec, env_step,
+                                        env_reset,
+                                        n_obs_ticks=args['n_obs_ticks'])
+                                for _ in xrange(n_episodes)]
+                    conn.send(([np.sum(rewards)
+                                for _, _, rewards in episodes],
+                               sum(len(observations)
+                                   for observations, _, _ in episodes)))
+                elif message[0] == 'gradients':
+                    # gradients on our episodes given the overall baseline
+                    obs, action_inds, f_vals, returns = preprocess(
+                        episodes, args, message[1],
+                        partial(predict_values, sess, handles, args))
+                    conn.send(accumulate_gradients(sess, handles, obs,
+                                                   action_inds, f_vals,
+                                                   args, returns=returns))
+                else:
+                    break
+
+def policy_actor(conn, actor_id, weights, episode_queue, variable_names,
+                 args, build_model):
+    '''roll out episodes with a local copy of the weights the learner
+    publishes to weights, a parallel.SharedWeights, and put them on
+    episode_queue tagged with the weight version, until the learner closes
+    the pool'''
+    import tensorflow as tf
+    # the queue may be full when we are told to close
+    episode_queue.cancel_join_thread()
+
+    gym_env, (env_spec, env_step, env_reset, _) = env_from_args(
+        args, 1 + actor_id)
+    policy_input_shape = list(env_spec['observation_shape'])
+    policy_input_shape[-1] *= args['n_obs_ticks']
+    with tf.Graph().as_default():
+        # the same variables as the learner's model
+        kwargs = {'value_head': True} if args['objective'] == 'gae' else {}
+        obs_ph, keep_prob_ph, _, probs, _ = build_model(
+            policy_input_shape, env_spec['action_size'], **kwargs)
+        # the published arrays are in the order of the learner's variables
+        by_name = dict((v.name, v) for v in tf.trainable_variables())
+        local_variables = [by_name[name] for name in variable_names]
+        weight_phs = [tf.placeholder(v.dtype.base_dtype, v.get_shape())
+                      for v in local_variables]
+        assign_op = tf.group(*[v.assign(ph) for v, ph
+                               in zip(local_variables, weight_phs)])
+        config = tf.ConfigProto(
+            intra_op_parallelism_threads=args['worker_threads'],
+            inter_op_parallelism_threads=args['worker_threads'])
+        with tf.Session(config=config) as sess:
+            sess.run(tf.initialize_all_variables())
+            policy = lambda obs: sess.run(probs, feed_dict={
+                obs_ph: [obs],
+                keep_prob_ph: 1. - args['dropout_rate'],
+            })[0]
+
+            version = 0
+            while not conn.poll():
+                if weights.version == 0:
+                    # nothing published yet
+                    time.sleep(0.01)
+                    continue
+                if weights.version != version:
+                    arrays, version = weights.read()
+                    sess.run(assign_op, feed_dict=dict(zip(weight_phs,
+                                                           arrays)))
+                observations, actions, rewards = rollout(
+                    policy, env_spec, env_step, env_reset,
+                    n_obs_ticks=args['n_obs_ticks'])
+                # block while the learner is behind
+                while not conn.poll():
+                    try:
+                        episode_queue.put((version, observations, actions,
+                                           rewards), timeout=1.)
+                        break
+                    except Full:
+                        pass
+
+def async_learner(thread_id, sess, handles, env, args, counter, writer=None,
+                  metrics=NULL_METRICS):
+    '''a Hogwild actor-learner thread: roll out with the shared weights and
+    apply the gradients without waiting for the other threads'''
+    env_spec, env_step, env_reset, env_render = env
+    # the session is not the default one outside of the main thread
+    policy = lambda obs: sess.run(handles['probs'], feed_dict={
+        handles['obs_ph']: [obs],
+        handles['keep_prob_ph']: 1. - args['dropout_rate'],
+    })[0]
+
+    while True:
+        claimed = counter.claim()
+        if claimed is None:
+            return
+        i, read_step = claimed
+        episodes = [rollout(policy, env_spec, env_step, env_reset, env_render,
+                            n_obs_ticks=args['n_obs_ticks'])
+                    for _ in xrange(args['n_update_episodes'])]
+        n_ticks = sum(len(observations) for observations, _, _ in episodes)
+        episode_rewards = [np.sum(rewards) for _, _, rewards in episodes]
+        avg_len_episode = n_ticks * 1. / args['n_update_episodes']
+        avg_tick_reward = np.sum(episode_rewards) * 1. / n_ticks
+
+        obs, action_inds, f_vals, returns = preprocess(
+            episodes, args, avg_tick_reward,
+            partial(predict_values, sess, handles, args))
+        acc_grads_val, acc_reg = accumulate_gradients(
+            sess, handles, obs, action_inds, f_vals, args, returns=returns)
+
+        update_dict = {
+            handles['avg_len_episode_ph']: avg_len_episode,
+            handles['avg_episode_reward_ph']: np.mean(episode_rewards),
+            handles['max_episode_reward_ph']: np.max(episode_rewards),
+            handles['min_episode_reward_ph']: np.min(episode_rewards),
+            handles['avg_tick_reward_ph']: avg_tick_reward,
+            handles['avg_reg_ph']: acc_reg / n_ticks,
+        }
+        for g, g_val in zip(handles['grads'], acc_grads_val):
+            update_dict[g] = g_val / args['n_update_episodes']
+        summary_ops = []
+        if writer is not None:
+            if i % args['n_summary_interval'] == 0:
+                summary_ops.append(handles['scalar_summary_op'])
+            if i % args['n_histogram_interval'] == 0:
+                summary_ops.append(handles['histogram_summary_op'])
+        results = sess.run([handles['update_policy_op']] + summary_ops,
+                           feed_dict=update_dict)
+        step = counter.applied(read_step, n_ticks)
+        for summary_val in results[1:]:
+            writer.add_summary(summary_val, step)
+        metrics.write({
+            'iteration': i,
+            'thread': thread_id,
+            'global_step': step,
+            'staleness': step - 1 - read_step,
+            'avg_len_episode': avg_len_episode,
+            'avg_episode_reward': np.mean(episode_rewards),
+            'max_episode_reward': np.max(episode_rewards),
+            'min_episode_reward': np.min(episode_rewards),
+            'avg_tick_reward': avg_tick_reward,
+            'avg_reg': acc_reg / n_ticks,
+            'env_ticks': n_ticks,
+        })
+
 def train(env_spec, env_step, env_reset, env_render, args, build_model):
+    import tensorflow as tf
+    import tqdm
+
     summary_dir = 'tf-log/%s%d-%s' % (args['summary_prefix'], time.time(),
                                       os.path.basename(args['checkpoint_dir']))
 
@@ -59,83 +553,84 @@ def train(env_spec, env_step, env_reset, env_render, args, build_model):
               'wb') as hpf:
         json.dump(args, hpf)
 
+    if sum([args['n_workers'] > 1, args['n_learner_threads'] > 1,
+            args['n_actors'] > 0, args['n_actor_threads'] > 0,
+            args['n_lockstep_envs'] > 1]) > 1:
+        raise ValueError('--n_workers, --n_learner_threads, --n_actors, '
+                         '--n_actor_threads and --n_lockstep_envs are '
+                         'exclusive')
+    if args['n_epochs'] > 0 and (args['n_workers'] > 1
+                                 or args['n_learner_threads'] > 1
+                                 or args['n_actors'] > 0
+                                 or args['n_actor_threads'] > 0):
+        raise ValueError('--n_epochs needs the rollouts of the learner')
+
+    # data-parallel workers, forked before any session exists
+    pool = None
+    if args['n_workers'] > 1:
+        print '* starting %i gradient workers' % args['n_workers']
+        pool = WorkerPool(args['n_workers'], gradient_worker,
+                          (args, build_model), args['np_seed'] + 1)
+        shares = split(args['n_update_episodes'], args['n_workers'])
+
     with tf.Graph().as_default() as g:
-        # model
-        print '* building model %s' % args['model']
         policy_input_shape = list(env_spec['observation_shape'])
         policy_input_shape[-1] *= args['n_obs_ticks']
-        obs_ph, keep_prob_ph, logits, probs, state_value = build_model(
-            policy_input_shape,
-            env_spec['action_size'])
-        actions_taken_ph = tf.placeholder('int32')
-        avg_len_episode_ph = tf.placeholder('float')
-        avg_episode_reward_ph = tf.placeholder('float')
-        max_episode_reward_ph = tf.placeholder('float')
-        min_episode_reward_ph = tf.placeholder('float')
-        avg_tick_reward_ph = tf.placeholder('float')
-        avg_reg_ph = tf.placeholder('float')
-
-        # expected reward under policy
-        # entropy regularizer to encourage action diversity
-        entropy_reg = - tf.reduce_mean(tf.reduce_sum(probs * tf.log(probs), 1))
-        action_logits = vector_slice(tf.log(probs), actions_taken_ph)
-        advantage_ph = tf.placeholder('float')
-
-        # with rewards to go and baseline
-        objective = tf.reduce_sum(action_logits * advantage_ph) \
-            + args['reg_coeff'] * entropy_reg
+        graph_key = graph_cache_key(
+            args['model'], policy_input_shape, env_spec['action_size'],
+            dict((k, args[k]) for k in GRAPH_ARGS),
+            [inspect.getsourcefile(build_graph),
+             inspect.getsourcefile(build_model)])
+        handles = load_or_build_graph(
+            args['graph_cache_dir'], graph_key,
+            partial(build_graph, policy_input_shape, env_spec['action_size'],
+                    args, build_model))
 
-        # optimization
-        global_step = tf.Variable(0, trainable=False, name='global_step')
-        learning_rate = tf.train.exponential_decay(
-            args['initial_learning_rate'],
-            global_step, args['n_decay_steps'],
-            args['decay_rate'],
-            staircase=not args['no_decay_staircase'])
-
-        if args['optimizer'] == 'adam':
-            optimizer = tf.train.AdamOptimizer(learning_rate,
-                                               args['adam_beta1'],
-                                               args['adam_beta2'],
-                                               args['adam_epsilon'])
-        elif args['optimizer'] == 'ag':
-            optimizer = tf.train.MomentumOptimizer(learning_rate,
-                                                   args['momentum'],
-                                                   use_nesterov=True)
-        elif args['optimizer'] == 'rmsprop':
-            optimizer = tf.train.RMSPropOptimizer(learning_rate,
-                                                   args['rmsprop_decay'],
-                                                   args['momentum'],
-                                                   args['rmsprop_epsilon'])
-        else:
-            optimizer = tf.train.MomentumOptimizer(learning_rate,
-                                                   args['momentum'])
-
-        # train ops
-        grad_vars = optimizer.compute_gradients(-objective)
-        update_policy_op = optimizer.apply_gradients(
-            grad_vars,
-            global_step=global_step)
-
-        # summary
-        if not args['no_summary']:
-            tf.scalar_summary('learning_rate', learning_rate)
-            tf.scalar_summary('average_episode_reward', avg_episode_reward_ph)
-            tf.scalar_summary('max_episode_reward', max_episode_reward_ph)
-            tf.scalar_summary('min_episode_reward', min_episode_reward_ph)
-            tf.scalar_summary('average_tick_reward', avg_tick_reward_ph)
-            tf.scalar_summary('average_episode_length', avg_len_episode_ph)
-            tf.scalar_summary('average_tick_regularization', avg_reg_ph)
-
-            print '* extra summary'
-            for g, v in grad_vars:
-                tf.histogram_summary('gradients/%s' % v.name, g)
-                print 'gradients/%s' % v.name
-
-            summary_op = tf.merge_all_summaries()
-
-        saver = tf.train.Saver(max_to_keep=2, keep_checkpoint_every_n_hours=1)
-        with tf.Session() as sess:
+        obs_ph = handles['obs_ph']
+        keep_prob_ph = handles['keep_prob_ph']
+        probs = handles['probs']
+        actions_taken_ph = handles['actions_taken_ph']
+        advantage_ph = handles['advantage_ph']
+        avg_len_episode_ph = handles['avg_len_episode_ph']
+        avg_episode_reward_ph = handles['avg_episode_reward_ph']
+        max_episode_reward_ph = handles['max_episode_reward_ph']
+        min_episode_reward_ph = handles['min_episode_reward_ph']
+        avg_tick_reward_ph = handles['avg_tick_reward_ph']
+        avg_reg_ph = handles['avg_reg_ph']
+        entropy_reg = handles['entropy_reg']
+        global_step = handles['global_step']
+        learning_rate = handles['learning_rate']
+        grads = handles['grads']
+        update_policy_op = handles['update_policy_op']
+        scalar_summary_op = handles.get('scalar_summary_op')
+        histogram_summary_op = handles.get('histogram_summary_op')
+        saver = handles['saver']
+
+        # the weights sent to the workers
+        variables = tf.trainable_variables()
+        variable_names = [v.name for v in variables]
+
+        # actor processes, forked before any session exists, reading the
+        # weights from shared memory
+        actors = None
+        if args['n_actors'] > 0:
+            print '* starting %i actors' % args['n_actors']
+            shared_weights = SharedWeights([v.get_shape().as_list()
+                                            for v in variables])
+            episode_queue = multiprocessing.Queue(args['actor_queue_size'])
+            with pinned(args['actor_cpus']):
+                actors = WorkerPool(args['n_actors'], policy_actor,
+                                    (shared_weights, episode_queue,
+                                     variable_names, args, build_model),
+                                    args['np_seed'] + 1)
+        elif args['actor_cpus'] is not None:
+            # the main thread steps the env and runs the policy
+            set_affinity(parse_cpus(args['actor_cpus']))
+        with pinned(args['learner_cpus']):
+            # tensorflow starts its thread pools with the session
+            sess = tf.Session(config=session_config(args))
+        with sess:
+            report_placement(args)
             if not args['no_summary']:
                 writer = tf.train.SummaryWriter(summary_dir, sess.graph,
                                                 flush_secs=30)
@@ -146,117 +641,340 @@ def train(env_spec, env_step, env_reset, env_render, args, build_model):
             for v in tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES):
                 print v.name
 
-            # stochastic policy
+            # stochastic policy, without dropout for the clipped
+            # objective, whose ratios compare the very network that acted
+            keep_prob = 1. if args['n_epochs'] > 0 \
+                else 1. - args['dropout_rate']
             policy = lambda obs: probs.eval(feed_dict={
                 obs_ph: [obs],
-                keep_prob_ph: 1. - args['dropout_rate'],
+                keep_prob_ph: keep_prob,
             })[0]
 
-            for i in tqdm.tqdm(xrange(args['n_train_steps'])):
-                # on-policy rollout for some episodes
-                episodes = []
-                n_ticks = 0
-                episode_rewards = []
-                for j in xrange(args['n_update_episodes']):
-                    observations, actions, rewards = rollout(
-                        policy,
-                        env_spec,
-                        env_step,
-                        env_reset,
-                        env_render,
-                        n_obs_ticks=args['n_obs_ticks'],
-                    )
-                    episodes.append((observations, actions, rewards))
-                    n_ticks += len(observations)
-                    episode_rewards.append(np.sum(rewards))
-
-                avg_len_episode = n_ticks * 1. / args['n_update_episodes']
-                avg_tick_reward = np.sum(episode_rewards) * 1. / n_ticks
-
-                # transform and preprocess the rollouts
-                obs = []
-                action_inds = []
-                f_vals = []
-                for observations, actions, rewards in episodes:
-                    len_episode = len(observations)
-                    obs += list(duplicate_obs(pad_zeros(observations,
-                                                        args['n_obs_ticks']),
-                                              args['n_obs_ticks']))
-                    action_inds += actions
-                    # compute the objective values
-                    if args['objective'] == 'episodic_reward':
-                        # total episodic reward with lambda decay over ticks
-                        f_vals += [np.sum(np.prod([
-                            rewards,
-                            [args['reward_gamma']**t
-                             for t in xrange(len_episode)]],
-                            axis=0))
-                        ] * len_episode
-                    elif args['objective'] == 'reward_to_go':
-                        # rewards to go with lambda decay
-                        f_vals += [np.sum(np.prod([
-                            rewards[t:],
-                            [args['reward_gamma']**u
-                             for u in xrange(len_episode-t)]],
-                            axis=0))
-                        for t in xrange(len_episode)]
-                    else:
-                        # rewards to go with lambda decay and baseline
-                        f_vals += [np.sum(np.prod([
-                            rewards[t:],
-                            [args['reward_gamma']**u
-                             for u in xrange(len_episode-t)]],
-                            axis=0)) - avg_tick_reward * (len_episode-t)
-                        for t in xrange(len_episode)]
-
-                # estimate policy gradient by batches
-                # accumulate gradients over batches
-                acc_grads = dict([(grad, np.zeros(grad.get_shape()))
-                                      for grad, var in grad_vars])
-                acc_reg = 0.
-                n_batch = int(np.ceil(n_ticks * 1. / args['n_batch_ticks']))
-                for j in xrange(n_batch):
-                    start = j * args['n_batch_ticks']
-                    end = min(start + args['n_batch_ticks'], n_ticks)
-                    grad_feed = {
-                        obs_ph: obs[start:end],
+            # host-side mirror of the global step and the schedules
+            state = TrainingState()
+            state.sync(sess, global_step, learning_rate)
+
+            # per-phase timing and throughput
+            timer = PhaseTimer(args['n_timing_interval'] > 0
+                               or args['n_trace_interval'] > 0)
+            # memory accounting and the soft memory budget
+            memory = MemoryMonitor(args['n_memory_interval'] > 0,
+                                   args['memory_budget_mb'],
+                                   args['memory_budget_action'])
+            # op-level timelines of sampled iterations
+            tracer = RunTracer(summary_dir, args['n_trace_interval'])
+            # per-iteration records outside of the tf summaries
+            metrics = MetricsSink(args['metrics_path'],
+                                  args['metrics_flush_secs'])
+
+            checkpoints = CheckpointManager(
+                sess, saver, global_step, args['checkpoint_dir'] + '/model',
+                args['n_save_interval'], args['save_secs'])
+            if actors is not None:
+                shared_weights.publish(sess.run(variables))
+            n_sync_steps = args['n_train_steps']
+            actor_pool = None
+            # env instances for the rollouts in lockstep of the learner
+            lockstep_envs = None
+            if args['n_lockstep_envs'] > 1:
+                lockstep_envs = [(env_step, env_reset)] + [
+                    env_from_args(args, k)[1][1:3]
+                    for k in xrange(1, args['n_lockstep_envs'])]
+            # evaluate new checkpoints in a side process, stopped in the
+            # finally below
+            evaluator = None
+            if args['background_eval']:
+                evaluator = launch_evaluator(
+                    args, 'pi', None if args['no_summary'] else summary_dir)
+            try:
+                if args['n_actor_threads'] > 0:
+                    # actor threads roll out with the shared session, each
+                    # with an env of its own and without rendering
+                    actor_envs = [(env_spec, env_step, env_reset)] + [
+                        env_from_args(args, k)[1][:3]
+                        for k in xrange(1, args['n_actor_threads'])]
+                    # the session is not the default one outside of the
+                    # main thread
+                    actor_policy = lambda obs: sess.run(probs, feed_dict={
+                        obs_ph: [obs],
                         keep_prob_ph: 1. - args['dropout_rate'],
-                        actions_taken_ph: action_inds[start:end],
-                        advantage_ph: f_vals[start:end],
+                    })[0]
+                    actor_pool = ActorPool(
+                        args['n_actor_threads'],
+                        lambda k: rollout(actor_policy, *actor_envs[k],
+                                          n_obs_ticks=args['n_obs_ticks']),
+                        lambda: state.global_step,
+                        args['actor_queue_size'])
+
+                if args['n_learner_threads'] > 1:
+                    # asynchronous actor-learner threads do all iterations,
+                    # each with an env of its own and without rendering,
+                    # which only works from the main thread
+                    envs = [(env_spec, env_step, env_reset, None)] + [
+                        env_from_args(args, k)[1][:3] + (None,)
+                        for k in xrange(1, args['n_learner_threads'])]
+                    counter = UpdateCounter(args['n_train_steps'],
+                                            state.global_step)
+                    threads = start_learners(
+                        args['n_learner_threads'],
+                        lambda k: async_learner(
+                            k, sess, handles, envs[k], args, counter,
+                            None if args['no_summary'] else writer, metrics),
+                        counter)
+
+                    def report(step, stats):
+                        print_stats(stats, 'asynchronous learners')
+                        metrics.write(dict(stats, global_step=step))
+                        if not args['no_summary']:
+                            write_stats(writer, step, stats)
+
+                    supervise(threads, counter, checkpoints,
+                              args['n_timing_interval'], report)
+                    n_sync_steps = 0
+
+                for i in tqdm.tqdm(xrange(n_sync_steps)):
+                    tracer.start(i, timer)
+                    if pool is not None:
+                        # the workers roll out their shares of the episodes
+                        # with the current weights
+                        timer.start('rollout')
+                        weights = dict(zip(variable_names,
+                                           sess.run(variables)))
+                        pool.scatter([('rollout', weights, n)
+                                      for n in shares])
+                        replies = pool.gather()
+                        episode_rewards = sum([r[0] for r in replies], [])
+                        n_ticks = sum([r[1] for r in replies])
+                        timer.stop('rollout')
+                    elif actors is not None:
+                        # episodes of the actors with recently published
+                        # weights
+                        timer.start('rollout')
+                        episodes = []
+                        versions = []
+                        for j in xrange(args['n_update_episodes']):
+                            version, observations, actions, rewards = \
+                                receive(episode_queue, actors)
+                            episodes.append((observations, actions, rewards))
+                            versions.append(version)
+                        n_ticks = sum(len(observations)
+                                      for observations, _, _ in episodes)
+                        episode_rewards = [np.sum(rewards)
+                                           for _, _, rewards in episodes]
+                        timer.stop('rollout')
+                    elif actor_pool is not None:
+                        # episodes of the actor threads, with the policy of
+                        # a few updates ago
+                        timer.start('rollout')
+                        versions, episodes = actor_pool.get(
+                            args['n_update_episodes'])
+                        n_ticks = sum(len(observations)
+                                      for observations, _, _ in episodes)
+                        episode_rewards = [np.sum(rewards)
+                                           for _, _, rewards in episodes]
+                        timer.stop('rollout')
+                    else:
+                        # on-policy rollout for some episodes
+                        timer.start('rollout')
+                        episodes = []
+                        n_ticks = 0
+                        episode_rewards = []
+                        # the behavior of the clipped objective
+                        behavior_log_probs = [] if args['n_epochs'] > 0 \
+                            else None
+                        if lockstep_envs is not None:
+                            # in lockstep over several env instances
+                            episodes = rollouts(
+                                policy, env_spec, lockstep_envs,
+                                args['n_update_episodes'], env_render,
+                                n_obs_ticks=args['n_obs_ticks'], timer=timer,
+                                memory=memory,
+                                log_probs=behavior_log_probs)
+                            n_ticks = sum(len(observations)
+                                          for observations, _, _ in episodes)
+                            episode_rewards = [np.sum(rewards)
+                                               for _, _, rewards in episodes]
+                        else:
+                            for j in xrange(args['n_update_episodes']):
+                                observations, actions, rewards = rollout(
+                                    policy,
+                                    env_spec,
+                                    env_step,
+                                    env_reset,
+                                    env_render,
+                                    n_obs_ticks=args['n_obs_ticks'],
+                                    timer=timer,
+                                    memory=memory,
+                                    log_probs=behavior_log_probs,
+                                )
+                                episodes.append((observations, actions, rewards))
+                                n_ticks += len(observations)
+                                episode_rewards.append(np.sum(rewards))
+                        timer.stop('rollout')
+                    memory.sample('rollout')
+
+                    avg_len_episode = n_ticks * 1. / args['n_update_episodes']
+                    avg_tick_reward = np.sum(episode_rewards) * 1. / n_ticks
+
+                    if pool is not None:
+                        # sum up the gradients of all workers
+                        timer.start('gradients')
+                        pool.broadcast(('gradients', avg_tick_reward))
+                        results = pool.gather()
+                        acc_grads_val = [np.sum(g_vals, axis=0)
+                                         for g_vals in zip(*[
+                                             r[0] for r in results])]
+                        acc_reg = np.sum([r[1] for r in results])
+                        timer.stop('gradients')
+                    else:
+                        # transform and preprocess the rollouts
+                        timer.start('preprocess')
+                        obs, action_inds, f_vals, returns = preprocess(
+                            episodes, args, avg_tick_reward,
+                            partial(predict_values, sess, handles, args))
+                        timer.stop('preprocess')
+                        memory.sample('preprocess')
+                        memory.record('episodes', episodes)
+                        memory.record('obs', obs)
+                        memory.record('f_vals', f_vals)
+
+                        if args['n_epochs'] == 0:
+                            # estimate policy gradient by batches
+                            # accumulate gradients over batches
+                            timer.start('gradients')
+                            acc_grads_val, acc_reg = accumulate_gradients(
+                                sess, handles, obs, action_inds, f_vals,
+                                args, tracer, returns)
+                            timer.stop('gradients')
+                    if args['n_epochs'] == 0:
+                        memory.sample('gradients')
+                    timer.count('learner_samples', n_ticks)
+
+                    stats_dict = {
+                        avg_len_episode_ph: avg_len_episode,
+                        avg_episode_reward_ph: np.mean(episode_rewards),
+                        max_episode_reward_ph: np.max(episode_rewards),
+                        min_episode_reward_ph: np.min(episode_rewards),
+                        avg_tick_reward_ph: avg_tick_reward,
                     }
+                    # summaries are only computed on the sampled iterations
+                    summary_ops = []
+                    if not args['no_summary']:
+                        if i % args['n_summary_interval'] == 0:
+                            summary_ops.append(scalar_summary_op)
+                        if i % args['n_histogram_interval'] == 0:
+                            summary_ops.append(histogram_summary_op)
+                    if args['n_epochs'] > 0:
+                        # reuse the rollouts for several epochs of clipped
+                        # updates on shuffled minibatches
+                        timer.start('apply_gradients')
+                        acc_reg, clip_fraction_val, feed = clipped_updates(
+                            sess, handles, obs, action_inds, f_vals,
+                            behavior_log_probs, state, args, tracer,
+                            returns)
+                        timer.stop('apply_gradients')
+                        memory.sample('gradients')
+                        summary_vals = []
+                        if summary_ops:
+                            # on the last minibatch
+                            feed.update(stats_dict)
+                            feed[avg_reg_ph] = acc_reg / n_ticks
+                            summary_vals = sess.run(summary_ops,
+                                                    feed_dict=feed)
+                    else:
+                        # update policy with the sample expectation of
+                        # gradients
+                        update_dict = dict(stats_dict)
+                        update_dict[avg_reg_ph] = acc_reg / n_ticks
+                        update_dict.update(
+                            (g, g_val / args['n_update_episodes'])
+                            for g, g_val in zip(grads, acc_grads_val))
+                        timer.start('apply_gradients')
+                        results = sess.run(
+                            [update_policy_op, learning_rate] + summary_ops,
+                            feed_dict=update_dict,
+                            **tracer.run_kwargs())
+                        timer.stop('apply_gradients')
+                        state.update(results[1])
+                        summary_vals = results[2:]
+
+                    if actors is not None and \
+                        (i + 1) % args['n_publish_interval'] == 0:
+                        timer.start('publish')
+                        shared_weights.publish(sess.run(variables))
+                        timer.stop('publish')
+
+                    timer.start('summary')
+                    for summary_val in summary_vals:
+                        writer.add_summary(summary_val, state.global_step)
+                    timer.stop('summary')
+
+                    timer.start('checkpoint')
+                    checkpoints.maybe_save(i)
+                    timer.stop('checkpoint')
+                    tracer.finish('train', state.global_step)
+
+                    record = {
+                        'iteration': i,
+                        'global_step': state.global_step,
+                        'learning_rate': state.learning_rate,
+                        'avg_len_episode': avg_len_episode,
+                        'avg_episode_reward': np.mean(episode_rewards),
+                        'max_episode_reward': np.max(episode_rewards),
+                        'min_episode_reward': np.min(episode_rewards),
+                        'avg_tick_reward': avg_tick_reward,
+                        'avg_reg': acc_reg / n_ticks,
+                        'env_ticks': n_ticks,
+                    }
+                    if actors is not None:
+                        # how many publishes behind the episodes were
+                        lags = [shared_weights.version - v for v in versions]
+                        record.update({
+                            'weight_version': shared_weights.version,
+                            'avg_weight_lag': np.mean(lags),
+                            'max_weight_lag': np.max(lags),
+                        })
+                    if args['n_epochs'] > 0:
+                        record['clip_fraction'] = clip_fraction_val
+                    if actor_pool is not None:
+                        # how many updates behind the episodes were
+                        lags = [state.global_step - v for v in versions]
+                        record.update({
+                            'avg_policy_lag': np.mean(lags),
+                            'max_policy_lag': np.max(lags),
+                        })
+
+                    if args['n_timing_interval'] > 0 \
+                        and (i + 1) % args['n_timing_interval'] == 0:
+                        stats = timer.report()
+                        print_stats(stats)
+                        record.update(stats)
+                        if not args['no_summary']:
+                            write_stats(writer, state.global_step, stats)
 
-                    # compute the expectation of gradients
-                    grad_vars_val, entropy_reg_val = sess.run([
-                        grad_vars,
-                        entropy_reg,
-                        ], feed_dict=grad_feed)
-                    for (g, _), (g_val, _) in zip(grad_vars, grad_vars_val):
-                        acc_grads[g] += g_val / args['n_update_episodes']
-                    acc_reg += entropy_reg_val * (end - start)
-
-                # update policy with the sample expectation of gradients
-                update_dict = {
-                    avg_len_episode_ph: avg_len_episode,
-                    avg_episode_reward_ph: np.mean(episode_rewards),
-                    max_episode_reward_ph: np.max(episode_rewards),
-                    min_episode_reward_ph: np.min(episode_rewards),
-                    avg_tick_reward_ph: avg_tick_reward,
-                    avg_reg_ph: acc_reg / n_ticks,
-                }
-                update_dict.update(acc_grads)
-                summary_val, _ = sess.run([summary_op, update_policy_op],
-                                          feed_dict=update_dict)
-
-                if not args['no_summary']:
-                    writer.add_summary(summary_val, global_step.eval())
-
-                if i % args['n_save_interval'] == 0:
-                    saver.save(sess, args['checkpoint_dir'] + '/model',
-                               global_step=global_step.eval())
-
-            # save again at the end
-            saver.save(sess, args['checkpoint_dir'] + '/model',
-                       global_step=global_step.eval())
+                    if args['n_memory_interval'] > 0 \
+                        and (i + 1) % args['n_memory_interval'] == 0:
+                        stats = memory.report()
+                        print_stats(stats, 'memory')
+                        record.update(stats)
+                        if not args['no_summary']:
+                            write_stats(writer, state.global_step, stats)
+
+                    metrics.write(record)
+            finally:
+                # the actors use the session
+                if actor_pool is not None:
+                    actor_pool.close()
+                # save again at the end
+                checkpoints.close()
+                if evaluator is not None:
+                    # after the last checkpoint, which it still evaluates
+                    stop_evaluator(evaluator)
+                metrics.close()
+                if pool is not None:
+                    pool.close()
+                if actors is not None:
+                    actors.close()
 
 def build_argparser():
     parse = argparse.ArgumentParser()
@@ -271,6 +989,11 @@ def build_argparser():
     parse.add_argument('--n_obs_ticks', type=int, default=1)
     parse.add_argument('--timestep_limit', type=int, default=10**9)
     parse.add_argument('--use_render_state', action='store_true')
+    # env instances kept reset in the background for the next episodes
+    parse.add_argument('--n_spare_envs', type=int, default=0)
+    # env instances the learner rolls out the episodes of an update on in
+    # lockstep, with the steps of remote envs all in flight at once
+    parse.add_argument('--n_lockstep_envs', type=int, default=1)
     parse.add_argument('--scale', type=float, default=1.)
     parse.add_argument('--interpolation', choices=['nearest', 'bilinear',
                                                    'bicubic', 'cubic'],
@@ -279,8 +1002,12 @@ def build_argparser():
     # objective options
     parse.add_argument('--objective', choices=['episodic_reward',
                                                'reward_to_go',
-                                               'baseline'],
+                                               'baseline',
+                                               'gae'],
                        default='reward_to_go')
+    # the gae objective fits a value head of the model along
+    parse.add_argument('--gae_lambda', type=float, default=0.95)
+    parse.add_argument('--value_coeff', type=float, default=0.5)
     parse.add_argument('--reg_coeff', type=float, default=0.0001)
     parse.add_argument('--reward_gamma', type=float, default=1.)
     parse.add_argument('--dropout_rate', type=float, default=0.2)
@@ -289,12 +1016,67 @@ def build_argparser():
     parse.add_argument('--checkpoint_dir', required=True)
     parse.add_argument('--no_summary', action='store_true')
     parse.add_argument('--summary_prefix', default='')
+    parse.add_argument('--n_summary_interval', type=int, default=1)
+    parse.add_argument('--n_histogram_interval', type=int, default=100)
+    parse.add_argument('--n_timing_interval', type=int, default=0)
+    parse.add_argument('--n_trace_interval', type=int, default=0)
+    parse.add_argument('--n_memory_interval', type=int, default=0)
+    parse.add_argument('--memory_budget_mb', type=float, default=0.)
+    parse.add_argument('--memory_budget_action', choices=['warn', 'truncate'],
+                       default='warn')
+    parse.add_argument('--metrics_path')
+    parse.add_argument('--metrics_flush_secs', type=float, default=30.)
+    parse.add_argument('--graph_cache_dir')
+
+    # session threads, 0 leaves the choice to tensorflow
+    parse.add_argument('--intra_op_threads', type=int, default=0)
+    parse.add_argument('--inter_op_threads', type=int, default=0)
+    # cpu lists like 0-3,8 to pin the session threads, the main thread
+    # and the background evaluator to
+    parse.add_argument('--learner_cpus')
+    parse.add_argument('--actor_cpus')
+    parse.add_argument('--eval_cpus')
+    # defaults for any of these flags from e.g. autotune.py
+    parse.add_argument('--tuned_config')
     parse.add_argument('--render', action='store_true')
+    # frames a second shown or recorded, and how many may wait for the
+    # consumer thread before the oldest is dropped
+    parse.add_argument('--render_fps', type=float, default=30.)
+    parse.add_argument('--render_buffer_size', type=int, default=4)
+
+    # background evaluation of checkpoints
+    parse.add_argument('--background_eval', action='store_true')
+    parse.add_argument('--n_eval_samples', type=int, default=4)
+    parse.add_argument('--eval_poll_secs', type=float, default=30.)
+    parse.add_argument('--eval_threads', type=int, default=1)
+    parse.add_argument('--eval_nice', type=int, default=10)
 
     # how many episodes to rollout before update parameters
     parse.add_argument('--n_update_episodes', type=int, default=4)
     parse.add_argument('--n_batch_ticks', type=int, default=128)
+
+    # epochs of clipped importance ratio updates on shuffled minibatches
+    # of every batch of rollouts instead of one policy gradient step, with
+    # dropout off in both the rollouts and the updates
+    parse.add_argument('--n_epochs', type=int, default=0)
+    parse.add_argument('--n_minibatch_ticks', type=int, default=64)
+    parse.add_argument('--clip_epsilon', type=float, default=0.2)
+
+    # synchronous data-parallel workers sharing the episodes of an update
+    parse.add_argument('--n_workers', type=int, default=1)
+    parse.add_argument('--worker_threads', type=int, default=1)
+    # actor processes rolling out with the weights the learner publishes
+    # to shared memory every n_publish_interval updates
+    parse.add_argument('--n_actors', type=int, default=0)
+    parse.add_argument('--n_publish_interval', type=int, default=1)
+    parse.add_argument('--actor_queue_size', type=int, default=16)
+    # actor threads rolling out with the shared session into a queue of
+    # actor_queue_size episodes
+    parse.add_argument('--n_actor_threads', type=int, default=0)
+    # asynchronous actor-learner threads sharing the session
+    parse.add_argument('--n_learner_threads', type=int, default=1)
     parse.add_argument('--n_save_interval', type=int, default=1)
+    parse.add_argument('--save_secs', type=float, default=0.)
     parse.add_argument('--n_train_steps', type=int, default=10**5)
 
     # optimizer options
@@ -320,23 +1102,19 @@ def build_argparser():
 
 
 if __name__ == '__main__':
-    from functools import partial
-    from util import passthrough, use_render_state, scale_image
+    from util import env_from_args
+    from frames import frames_from_args
 
     # arguments
     parse = build_argparser()
-    args = parse.parse_args()
+    args = parse_args_with_config(parse)
 
-    gym_env = gym.make(args.env)
-    if args.use_render_state:
-        env_spec, env_step, env_reset, env_render = use_render_state(
-            gym_env, args.scale, args.interpolation)
-    else:
-        env_spec, env_step, env_reset, env_render = passthrough(gym_env)
+    # save a final checkpoint when the job gets killed
+    exit_on_sigterm()
 
-    env_spec['timestep_limit'] = min(gym_env.spec.timestep_limit,
-                                     args.timestep_limit)
-    env_render = env_render if args.render else None
+    # gym is only loaded past argument parsing
+    gym_env, (env_spec, env_step, env_reset, env_render) = env_from_args(
+        vars(args))
 
     print '* environment', args.env
     print 'observation shape', env_spec['observation_shape']
@@ -347,13 +1125,19 @@ if __name__ == '__main__':
     # model
     model = importlib.import_module('models.%s' % args.model)
 
-    # train
-    # gym monitor
+    # gym monitor, for the episode statistics only, the videos are
+    # recorded from the rendered frames
     if args.monitor:
-        env.monitor.start(args['monitor_dir'])
-
-    train(env_spec, env_step, env_reset, env_render, vars(args),
-          model.build_model)
+        gym_env.monitor.start(args.monitor_dir, video_callable=False)
+    # rendering and recording in a consumer thread
+    env_render, frames = frames_from_args(vars(args), env_render)
 
-    if args.monitor:
-        env.monitor.close()
+    # train
+    try:
+        train(env_spec, env_step, env_reset, env_render, vars(args),
+              model.build_model)
+    finally:
+        if frames is not None:
+            frames.close()
+        if args.monitor:
+            gym_env.monitor.close()
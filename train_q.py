@@ -1,14 +1,23 @@
 #!/usr/bin/env python
 
-import tensorflow as tf
 import numpy as np
 import os, sys, cPickle, time, glob, itertools, json
-import tqdm
 import argparse
 import importlib
-import gym
+import inspect
+from functools import partial
+from checkpoint import CheckpointManager, exit_on_sigterm
+from timing import PhaseTimer, print_stats, write_stats
+from tracing import RunTracer, NULL_TRACER
+from memory import MemoryMonitor
+from placement import pinned, set_affinity, parse_cpus, report_placement
+from metrics import MetricsSink, NULL_METRICS
+from hogwild import UpdateCounter, start_learners, supervise
+from actor_pool import ActorPool
 from util import vector_slice, rollout, pad_zeros, duplicate_obs,\
-    to_epsilon_greedy
+    n_step_returns, to_epsilon_greedy, launch_evaluator, stop_evaluator, \
+    graph_cache_key, load_or_build_graph, TrainingState, session_config, \
+    parse_args_with_config, env_from_args, rollouts
 
 def get_current_run_id(checkpoint_dir):
     paths = glob.glob('%s/hyperparameters.*.json' % checkpoint_dir)
@@ -19,6 +28,7 @@ def get_current_run_id(checkpoint_dir):
 def restore_vars(saver, sess, checkpoint_dir, restart=False):
     '''Restore saved net, global score and step, and epsilons OR
     create checkpoint directory for later storage.'''
+    import tensorflow as tf
     sess.run(tf.initialize_all_variables())
 
     if not restart:
@@ -36,7 +46,296 @@ def restore_vars(saver, sess, checkpoint_dir, restart=False):
 def load_rollout(data_dir):
     pass
 
+# hyperparameters that change the training graph
+GRAPH_ARGS = ['reward_gamma', 'optimizer', 'initial_learning_rate',
+              'n_lr_decay_steps', 'lr_decay_rate', 'no_lr_decay_staircase',
+              'momentum', 'adam_beta1', 'adam_beta2', 'adam_epsilon',
+              'rmsprop_decay', 'rmsprop_epsilon', 'no_summary', 'tf_seed',
+              'n_step']
+
+def build_graph(policy_input_shape, action_size, args, build_q_model):
+    '''build the training graph and return the handles to its tensors'''
+    import tensorflow as tf
+
+    # model
+    print '* building model %s' % args['model']
+
+    current_q_model_scope = 'current_q_model'
+    with tf.variable_scope(current_q_model_scope):
+        obs_ph, keep_prob_ph, action_values = build_q_model(
+            policy_input_shape,
+            action_size)
+
+    # with tf.variable_scope(current_q_model_scope, reuse=True):
+    #     next_obs_ph, _, next_action_values = build_q_model(
+    #         policy_input_shape,
+    #         action_size)
+
+    target_q_model_scope = 'target_q_model'
+    with tf.variable_scope(target_q_model_scope):
+        next_obs_ph, _, next_action_values = build_q_model(
+            policy_input_shape,
+            action_size,
+            trainable=False)
+
+    # ops to update the target Q model
+    update_target_q_op = []
+    for cv in tf.contrib.framework.get_variables(scope=current_q_model_scope):
+        tv_name = target_q_model_scope + cv.name[len(current_q_model_scope):]
+        # XXX bug of tf.contrib.framework? the handling of suffix
+        tv = tf.contrib.framework.get_unique_variable(tv_name[:-2])
+        update_target_q_op.append(tv.assign(cv))
+    update_target_q_op = tf.group(*update_target_q_op)
+
+    action_ph = tf.placeholder('int32')
+    reward_ph = tf.placeholder('float')
+    nonterminal_ph = tf.placeholder('float')
+
+    avg_len_episode_ph = tf.placeholder('float')
+    avg_episode_reward_ph = tf.placeholder('float')
+    max_episode_reward_ph = tf.placeholder('float')
+    min_episode_reward_ph = tf.placeholder('float')
+    avg_tick_reward_ph = tf.placeholder('float')
+    avg_objective_ph = tf.placeholder('float')
+    epsilon_ph = tf.placeholder('float')
+
+    # Q-learning
+    # r + gamma * max_a' Q(s', a'), where s' is the observed
+    # according to behavior policy
+    target = reward_ph + nonterminal_ph \
+        * args['reward_gamma'] ** args['n_step'] \
+        * tf.reduce_max(next_action_values, 1)
+
+    # action values over observed Q(s, a)
+    Q_sa = vector_slice(action_values, action_ph)
+
+    # violation of the consistency of Q as objective
+    objective = tf.reduce_sum(tf.square(tf.stop_gradient(target) - Q_sa))
+
+    # optimization
+    global_step = tf.Variable(0, trainable=False, name='global_step')
+    learning_rate = tf.train.exponential_decay(
+        args['initial_learning_rate'],
+        global_step, args['n_lr_decay_steps'],
+        args['lr_decay_rate'],
+        staircase=not args['no_lr_decay_staircase'])
+
+    if args['optimizer'] == 'adam':
+        optimizer = tf.train.AdamOptimizer(learning_rate,
+                                           args['adam_beta1'],
+                                           args['adam_beta2'],
+                                           args['adam_epsilon'])
+    elif args['optimizer'] == 'ag':
+        optimizer = tf.train.MomentumOptimizer(learning_rate,
+                                               args['momentum'],
+                                               use_nesterov=True)
+    elif args['optimizer'] == 'rmsprop':
+        optimizer = tf.train.RMSPropOptimizer(learning_rate,
+                                              args['rmsprop_decay'],
+                                              args['momentum'],
+                                              args['rmsprop_epsilon'])
+    else:
+        optimizer = tf.train.MomentumOptimizer(learning_rate,
+                                               args['momentum'])
+
+    # train ops
+    grad_vars = optimizer.compute_gradients(objective)
+    grads = [grad for grad, var in grad_vars]
+    update_q_op = optimizer.apply_gradients(
+        grad_vars,
+        global_step=global_step)
+
+    # summary
+    if not args['no_summary']:
+        # cheap scalar summaries
+        scalar_summary_op = tf.merge_summary([
+            tf.scalar_summary('learning_rate', learning_rate),
+            tf.scalar_summary('average_episode_reward', avg_episode_reward_ph),
+            tf.scalar_summary('max_episode_reward', max_episode_reward_ph),
+            tf.scalar_summary('min_episode_reward', min_episode_reward_ph),
+            tf.scalar_summary('average_tick_reward', avg_tick_reward_ph),
+            tf.scalar_summary('average_episode_length', avg_len_episode_ph),
+            tf.scalar_summary('average_objective', avg_objective_ph),
+            tf.scalar_summary('epsilon', epsilon_ph),
+        ])
+
+        # expensive histogram summaries
+        print '* extra summary'
+        histogram_summaries = []
+        for g, v in grad_vars:
+            histogram_summaries.append(
+                tf.histogram_summary('gradients/%s' % v.name, g))
+            print 'gradients/%s' % v.name
+        histogram_summary_op = tf.merge_summary(histogram_summaries)
+    else:
+        scalar_summary_op = None
+        histogram_summary_op = None
+
+    saver = tf.train.Saver(max_to_keep=2,
+                           keep_checkpoint_every_n_hours=1)
+
+    return {
+        'obs_ph': obs_ph,
+        'keep_prob_ph': keep_prob_ph,
+        'action_values': action_values,
+        'next_obs_ph': next_obs_ph,
+        'action_ph': action_ph,
+        'reward_ph': reward_ph,
+        'nonterminal_ph': nonterminal_ph,
+        'avg_len_episode_ph': avg_len_episode_ph,
+        'avg_episode_reward_ph': avg_episode_reward_ph,
+        'max_episode_reward_ph': max_episode_reward_ph,
+        'min_episode_reward_ph': min_episode_reward_ph,
+        'avg_tick_reward_ph': avg_tick_reward_ph,
+        'avg_objective_ph': avg_objective_ph,
+        'epsilon_ph': epsilon_ph,
+        'objective': objective,
+        'global_step': global_step,
+        'learning_rate': learning_rate,
+        'grads': grads,
+        'update_q_op': update_q_op,
+        'update_target_q_op': update_target_q_op,
+        'scalar_summary_op': scalar_summary_op,
+        'histogram_summary_op': histogram_summary_op,
+        'saver': saver,
+    }
+
+def preprocess(episodes, args, policy_input_shape):
+    '''transitions of the episodes, as a dict from the names of the
+    placeholders they feed to their per-tick values, with the rewards
+    summed over n_step ticks and the observations n_step ticks later'''
+    obs = []
+    action_inds = []
+    for observations, actions, rewards in episodes:
+        obs += list(duplicate_obs(pad_zeros(observations,
+                                            args['n_obs_ticks']),
+                                  args['n_obs_ticks']))
+        action_inds += actions
+
+    # for the whole batch at once
+    reward_sums, bootstrap, nonterminals = n_step_returns(
+        [rewards for _, _, rewards in episodes], args['n_step'],
+        args['reward_gamma'])
+    # pad zeros past the terminal tick
+    zeros = np.zeros(policy_input_shape)
+    next_obs = [obs[b] if nonterminal else zeros
+                for b, nonterminal in zip(bootstrap, nonterminals)]
+    return {
+        'obs_ph': obs,
+        'action_ph': action_inds,
+        'reward_ph': reward_sums,
+        'next_obs_ph': next_obs,
+        'nonterminal_ph': nonterminals,
+    }
+
+def accumulate_gradients(sess, handles, batch, args, feed=None,
+                         tracer=NULL_TRACER):
+    '''gradients of the objective averaged over the ticks of batch (see
+    preprocess) and the summed objective, in batches of n_batch_ticks'''
+    grads = handles['grads']
+    n_ticks = len(batch['obs_ph'])
+    acc_obj_val = 0.
+    acc_grads = [np.zeros(grad.get_shape()) for grad in grads]
+    n_batch = int(np.ceil(n_ticks * 1. / args['n_batch_ticks']))
+    for k in xrange(n_batch):
+        start = k * args['n_batch_ticks']
+        end = min(start + args['n_batch_ticks'], n_ticks)
+        grad_feed = {handles['keep_prob_ph']: 1. - args['dropout_rate']}
+        for name, values in batch.iteritems():
+            grad_feed[handles[name]] = values[start:end]
+        grad_feed.update(feed or {})
+
+        # sum up gradients
+        obj_val, grads_val = sess.run([
+            handles['objective'],
+            grads,
+            ], feed_dict=grad_feed,
+            **tracer.run_kwargs())
+        for j, g_val in enumerate(grads_val):
+            acc_grads[j] += g_val * (end - start) / n_ticks
+        acc_obj_val += obj_val
+    return acc_grads, acc_obj_val
+
+def decayed_epsilon(initial_epsilon, decay_rate):
+    '''the epsilon schedule of the trainer starting from initial_epsilon'''
+    return lambda step: initial_epsilon / (1. + decay_rate * step)
+
+def async_learner(thread_id, sess, handles, env, args, counter,
+                  epsilon_schedule, writer=None, metrics=NULL_METRICS):
+    '''a Hogwild actor-learner thread: roll out epsilon-greedily on the
+    shared weights with an epsilon schedule of its own and apply the
+    gradients without waiting for the other threads'''
+    env_spec, env_step, env_reset, env_render = env
+    policy_input_shape = list(env_spec['observation_shape'])
+    policy_input_shape[-1] *= args['n_obs_ticks']
+    # the session is not the default one outside of the main thread
+    q_values = lambda obs: sess.run(handles['action_values'], feed_dict={
+        handles['obs_ph']: [obs],
+        handles['keep_prob_ph']: 1. - args['dropout_rate'],
+    })[0]
+
+    while True:
+        claimed = counter.claim()
+        if claimed is None:
+            return
+        i, read_step = claimed
+        epsilon = epsilon_schedule(read_step)
+        # update the target Q model
+        if i % args['n_update_target_interval'] == 0:
+            sess.run(handles['update_target_q_op'])
+        episodes = [rollout(partial(to_epsilon_greedy, epsilon, q_values),
+                            env_spec, env_step, env_reset, env_render,
+                            n_obs_ticks=args['n_obs_ticks'])
+                    for _ in xrange(args['n_update_episodes'])]
+        n_ticks = sum(len(observations) for observations, _, _ in episodes)
+        episode_rewards = [np.sum(rewards) for _, _, rewards in episodes]
+        avg_len_episode = n_ticks * 1. / args['n_update_episodes']
+        avg_tick_reward = np.sum(episode_rewards) * 1. / n_ticks
+
+        batch = preprocess(episodes, args, policy_input_shape)
+        for j in xrange(args['n_value_updates']):
+            acc_grads_val, acc_obj_val = accumulate_gradients(
+                sess, handles, batch, args)
+            update_dict = {
+                handles['avg_len_episode_ph']: avg_len_episode,
+                handles['avg_episode_reward_ph']: np.mean(episode_rewards),
+                handles['max_episode_reward_ph']: np.max(episode_rewards),
+                handles['min_episode_reward_ph']: np.min(episode_rewards),
+                handles['avg_tick_reward_ph']: avg_tick_reward,
+                handles['avg_objective_ph']: acc_obj_val / n_ticks,
+                handles['epsilon_ph']: epsilon,
+            }
+            update_dict.update(zip(handles['grads'], acc_grads_val))
+            summary_ops = []
+            if writer is not None:
+                if i % args['n_summary_interval'] == 0:
+                    summary_ops.append(handles['scalar_summary_op'])
+                if i % args['n_histogram_interval'] == 0:
+                    summary_ops.append(handles['histogram_summary_op'])
+            results = sess.run([handles['update_q_op']] + summary_ops,
+                               feed_dict=update_dict)
+            step = counter.applied(read_step, n_ticks)
+            for summary_val in results[1:]:
+                writer.add_summary(summary_val, step)
+        metrics.write({
+            'iteration': i,
+            'thread': thread_id,
+            'global_step': step,
+            'staleness': step - 1 - read_step,
+            'epsilon': epsilon,
+            'avg_len_episode': avg_len_episode,
+            'avg_episode_reward': np.mean(episode_rewards),
+            'max_episode_reward': np.max(episode_rewards),
+            'min_episode_reward': np.min(episode_rewards),
+            'avg_tick_reward': avg_tick_reward,
+            'avg_objective': acc_obj_val / n_ticks,
+            'env_ticks': n_ticks,
+        })
+
 def train_q(env_spec, env_step, env_reset, env_render, args, build_q_model):
+    import tensorflow as tf
+    import tqdm
+
     summary_dir = 'tf-log/%s%d-%s' % (args['summary_prefix'], time.time(),
                                       os.path.basename(args['checkpoint_dir']))
 
@@ -59,116 +358,56 @@ def train_q(env_spec, env_step, env_reset, env_render, args, build_q_model):
               'wb') as hpf:
         json.dump(args, hpf)
 
+    if sum([args['n_learner_threads'] > 1, args['n_actor_threads'] > 0,
+            args['n_lockstep_envs'] > 1]) > 1:
+        raise ValueError('--n_learner_threads, --n_actor_threads and '
+                         '--n_lockstep_envs are exclusive')
+
     with tf.Graph().as_default() as g:
-        # model
-        print '* building model %s' % args['model']
         policy_input_shape = list(env_spec['observation_shape'])
         policy_input_shape[-1] *= args['n_obs_ticks']
-
-        current_q_model_scope = 'current_q_model'
-        with tf.variable_scope(current_q_model_scope):
-            obs_ph, keep_prob_ph, action_values = build_q_model(
-                policy_input_shape,
-                env_spec['action_size'])
-
-        # with tf.variable_scope(current_q_model_scope, reuse=True):
-        #     next_obs_ph, _, next_action_values = build_q_model(
-        #         policy_input_shape,
-        #         env_spec['action_size'])
-
-        target_q_model_scope = 'target_q_model'
-        with tf.variable_scope(target_q_model_scope):
-            next_obs_ph, _, next_action_values = build_q_model(
-                policy_input_shape,
-                env_spec['action_size'],
-                trainable=False)
-
-        # ops to update the target Q model
-        update_target_q_op = []
-        for cv in tf.contrib.framework.get_variables(scope=current_q_model_scope):
-            tv_name = target_q_model_scope + cv.name[len(current_q_model_scope):]
-            # XXX bug of tf.contrib.framework? the handling of suffix
-            tv = tf.contrib.framework.get_unique_variable(tv_name[:-2])
-            update_target_q_op.append(tv.assign(cv))
-
-        action_ph = tf.placeholder('int32')
-        reward_ph = tf.placeholder('float')
-        nonterminal_ph = tf.placeholder('float')
-
-        avg_len_episode_ph = tf.placeholder('float')
-        avg_episode_reward_ph = tf.placeholder('float')
-        max_episode_reward_ph = tf.placeholder('float')
-        min_episode_reward_ph = tf.placeholder('float')
-        avg_tick_reward_ph = tf.placeholder('float')
-        avg_objective_ph = tf.placeholder('float')
-        epsilon_ph = tf.placeholder('float')
-
-        # Q-learning
-        # r + gamma * max_a' Q(s', a'), where s' is the observed
-        # according to behavior policy
-        target = reward_ph + nonterminal_ph * args['reward_gamma'] \
-            * tf.reduce_max(next_action_values, 1)
-
-        # action values over observed Q(s, a)
-        Q_sa = vector_slice(action_values, action_ph)
-
-        # violation of the consistency of Q as objective
-        objective = tf.reduce_sum(tf.square(tf.stop_gradient(target) - Q_sa))
-
-        # optimization
-        global_step = tf.Variable(0, trainable=False, name='global_step')
-        learning_rate = tf.train.exponential_decay(
-            args['initial_learning_rate'],
-            global_step, args['n_lr_decay_steps'],
-            args['lr_decay_rate'],
-            staircase=not args['no_lr_decay_staircase'])
-
-        if args['optimizer'] == 'adam':
-            optimizer = tf.train.AdamOptimizer(learning_rate,
-                                               args['adam_beta1'],
-                                               args['adam_beta2'],
-                                               args['adam_epsilon'])
-        elif args['optimizer'] == 'ag':
-            optimizer = tf.train.MomentumOptimizer(learning_rate,
-                                                   args['momentum'],
-                                                   use_nesterov=True)
-        elif args['optimizer'] == 'rmsprop':
-            optimizer = tf.train.RMSPropOptimizer(learning_rate,
-                                                  args['rmsprop_decay'],
-                                                  args['momentum'],
-                                                  args['rmsprop_epsilon'])
-        else:
-            optimizer = tf.train.MomentumOptimizer(learning_rate,
-                                                   args['momentum'])
-
-        # train ops
-        grad_vars = optimizer.compute_gradients(objective)
-        update_q_op = optimizer.apply_gradients(
-            grad_vars,
-            global_step=global_step)
-
-        # summary
-        if not args['no_summary']:
-            tf.scalar_summary('learning_rate', learning_rate)
-            tf.scalar_summary('average_episode_reward',
-                              avg_episode_reward_ph)
-            tf.scalar_summary('max_episode_reward', max_episode_reward_ph)
-            tf.scalar_summary('min_episode_reward', min_episode_reward_ph)
-            tf.scalar_summary('average_tick_reward', avg_tick_reward_ph)
-            tf.scalar_summary('average_episode_length', avg_len_episode_ph)
-            tf.scalar_summary('average_objective', avg_objective_ph)
-            tf.scalar_summary('epsilon', epsilon_ph)
-
-            print '* extra summary'
-            for g, v in grad_vars:
-                tf.histogram_summary('gradients/%s' % v.name, g)
-                print 'gradients/%s' % v.name
-
-            summary_op = tf.merge_all_summaries()
-
-        saver = tf.train.Saver(max_to_keep=2,
-                               keep_checkpoint_every_n_hours=1)
-        with tf.Session() as sess:
+        graph_key = graph_cache_key(
+            args['model'], policy_input_shape, env_spec['action_size'],
+            dict((k, args[k]) for k in GRAPH_ARGS),
+            [inspect.getsourcefile(build_graph),
+             inspect.getsourcefile(build_q_model)])
+        handles = load_or_build_graph(
+            args['graph_cache_dir'], graph_key,
+            partial(build_graph, policy_input_shape, env_spec['action_size'],
+                    args, build_q_model))
+
+        obs_ph = handles['obs_ph']
+        keep_prob_ph = handles['keep_prob_ph']
+        action_values = handles['action_values']
+        next_obs_ph = handles['next_obs_ph']
+        action_ph = handles['action_ph']
+        reward_ph = handles['reward_ph']
+        nonterminal_ph = handles['nonterminal_ph']
+        avg_len_episode_ph = handles['avg_len_episode_ph']
+        avg_episode_reward_ph = handles['avg_episode_reward_ph']
+        max_episode_reward_ph = handles['max_episode_reward_ph']
+        min_episode_reward_ph = handles['min_episode_reward_ph']
+        avg_tick_reward_ph = handles['avg_tick_reward_ph']
+        avg_objective_ph = handles['avg_objective_ph']
+        epsilon_ph = handles['epsilon_ph']
+        objective = handles['objective']
+        global_step = handles['global_step']
+        learning_rate = handles['learning_rate']
+        grads = handles['grads']
+        update_q_op = handles['update_q_op']
+        update_target_q_op = handles['update_target_q_op']
+        scalar_summary_op = handles.get('scalar_summary_op')
+        histogram_summary_op = handles.get('histogram_summary_op')
+        saver = handles['saver']
+
+        if args['actor_cpus'] is not None:
+            # the main thread steps the env and runs the policy
+            set_affinity(parse_cpus(args['actor_cpus']))
+        with pinned(args['learner_cpus']):
+            # tensorflow starts its thread pools with the session
+            sess = tf.Session(config=session_config(args))
+        with sess:
+            report_placement(args)
             if not args['no_summary']:
                 writer = tf.train.SummaryWriter(summary_dir, sess.graph,
                                                 flush_secs=30)
@@ -189,118 +428,268 @@ def train_q(env_spec, env_step, env_reset, env_render, args, build_q_model):
                 obs)
 
             n_update = 1
-            for i in tqdm.tqdm(xrange(args['n_train_steps'])):
-                if i % n_update == 0:
-                    # on-policy rollout for some episodes
-                    episodes = []
-                    n_ticks = 0
-                    episode_rewards = []
-                    epsilon = args['initial_epsilon'] / \
-                        (1. + args['epsilon_decay_rate'] * global_step.eval())
-
-                    # update the target Q model
-                    if i % args['n_update_target_interval'] == 0:
-                        sess.run(update_target_q_op)
-
-                    # sample rollouts
-                    for j in xrange(args['n_update_episodes']):
-                        observations, actions, rewards = rollout(
-                            partial(policy, epsilon),
-                            env_spec,
-                            env_step,
-                            env_reset,
-                            env_render,
-                            n_obs_ticks=args['n_obs_ticks'],
-                        )
-                        episodes.append((observations, actions, rewards))
-                        n_ticks += len(observations)
-                        episode_rewards.append(np.sum(rewards))
-
-                    avg_len_episode = n_ticks * 1. / args['n_update_episodes']
-                    avg_tick_reward = np.sum(episode_rewards) * 1. / n_ticks
-
-                    # transform and preprocess the rollouts
-                    obs = []
-                    action_inds = []
-                    all_rewards = []
-                    nonterminals = []
-                    next_obs = []
-
-                    # process rollouts
-                    for observations, actions, rewards in episodes:
-                        len_episode = len(observations)
-                        dup_obs = list(
-                            duplicate_obs(pad_zeros(observations,
-                                                    args['n_obs_ticks']),
-                                          args['n_obs_ticks']))
-                        obs += dup_obs
-                        action_inds += actions
-                        all_rewards += rewards
-
-                        nonterminals += [1.] * (len_episode - 1) + [0.]
-                        # pad zeros at the terminal tick
-                        next_obs += dup_obs[1:] + [np.zeros(policy_input_shape)]
-
-                # sample a fixed size subset for training
-                # n_ticks = 64
-                # sample_ind = np.random.choice(range(len(obs)), n_ticks, False)
-                # _obs = np.asarray(obs)[sample_ind]
-                # _action_inds = np.asarray(action_inds)[sample_ind]
-                # _all_rewards = np.asarray(all_rewards)[sample_ind]
-                # _targets = np.asarray(targets)[sample_ind]
-
-                # improve estimated Q_hat
-                n_batch = int(np.ceil(n_ticks * 1. / args['n_batch_ticks']))
-                for j in xrange(args['n_value_updates']):
-                    # estimate and accumulate gradients by batches
-                    acc_obj_val = 0.
-                    acc_grads = dict([(grad, np.zeros(grad.get_shape()))
-                                          for grad, var in grad_vars])
-                    for k in xrange(n_batch):
-                        start = k * args['n_batch_ticks']
-                        end = min(start + args['n_batch_ticks'], n_ticks)
-                        grad_feed = {
+            # host-side mirror of the global step and the schedules
+            state = TrainingState(decayed_epsilon(args['initial_epsilon'],
+                                                  args['epsilon_decay_rate']))
+            state.sync(sess, global_step, learning_rate)
+
+            # per-phase timing and throughput
+            timer = PhaseTimer(args['n_timing_interval'] > 0
+                               or args['n_trace_interval'] > 0)
+            # memory accounting and the soft memory budget
+            memory = MemoryMonitor(args['n_memory_interval'] > 0,
+                                   args['memory_budget_mb'],
+                                   args['memory_budget_action'])
+            # op-level timelines of sampled iterations
+            tracer = RunTracer(summary_dir, args['n_trace_interval'])
+            # per-iteration records outside of the tf summaries
+            metrics = MetricsSink(args['metrics_path'],
+                                  args['metrics_flush_secs'])
+
+            checkpoints = CheckpointManager(
+                sess, saver, global_step, args['checkpoint_dir'] + '/model',
+                args['n_save_interval'], args['save_secs'])
+            n_sync_steps = args['n_train_steps']
+            actor_pool = None
+            # env instances for the rollouts in lockstep of the learner
+            lockstep_envs = None
+            if args['n_lockstep_envs'] > 1:
+                lockstep_envs = [(env_step, env_reset)] + [
+                    env_from_args(args, k)[1][1:3]
+                    for k in xrange(1, args['n_lockstep_envs'])]
+            # evaluate new checkpoints in a side process, stopped in the
+            # finally below
+            evaluator = None
+            if args['background_eval']:
+                evaluator = launch_evaluator(
+                    args, 'q', None if args['no_summary'] else summary_dir)
+            try:
+                if args['n_actor_threads'] > 0:
+                    # actor threads roll out epsilon-greedily with the
+                    # shared session, each with an env of its own and
+                    # without rendering
+                    actor_envs = [(env_spec, env_step, env_reset)] + [
+                        env_from_args(args, k)[1][:3]
+                        for k in xrange(1, args['n_actor_threads'])]
+                    # the session is not the default one outside of the
+                    # main thread
+                    actor_q_values = lambda obs: sess.run(
+                        action_values, feed_dict={
+                            obs_ph: [obs],
                             keep_prob_ph: 1. - args['dropout_rate'],
-                            obs_ph: obs[start:end],
-                            action_ph: action_inds[start:end],
-                            reward_ph: all_rewards[start:end],
-                            next_obs_ph: next_obs[start:end],
-                            nonterminal_ph: nonterminals[start:end],
+                        })[0]
+                    actor_pool = ActorPool(
+                        args['n_actor_threads'],
+                        lambda k: rollout(
+                            partial(to_epsilon_greedy, state.epsilon,
+                                    actor_q_values),
+                            *actor_envs[k], n_obs_ticks=args['n_obs_ticks']),
+                        lambda: state.global_step,
+                        args['actor_queue_size'])
+
+                if args['n_learner_threads'] > 1:
+                    # asynchronous actor-learner threads do all iterations,
+                    # each with an env of its own and without rendering,
+                    # which only works from the main thread
+                    envs = [(env_spec, env_step, env_reset, None)] + [
+                        env_from_args(args, k)[1][:3] + (None,)
+                        for k in xrange(1, args['n_learner_threads'])]
+                    epsilons = args['thread_initial_epsilons'] \
+                        or [args['initial_epsilon']]
+                    counter = UpdateCounter(args['n_train_steps'],
+                                            state.global_step)
+                    threads = start_learners(
+                        args['n_learner_threads'],
+                        lambda k: async_learner(
+                            k, sess, handles, envs[k], args, counter,
+                            decayed_epsilon(epsilons[k % len(epsilons)],
+                                            args['epsilon_decay_rate']),
+                            None if args['no_summary'] else writer, metrics),
+                        counter)
+
+                    def report(step, stats):
+                        print_stats(stats, 'asynchronous learners')
+                        metrics.write(dict(stats, global_step=step))
+                        if not args['no_summary']:
+                            write_stats(writer, step, stats)
+
+                    supervise(threads, counter, checkpoints,
+                              args['n_timing_interval'], report)
+                    n_sync_steps = 0
+
+                for i in tqdm.tqdm(xrange(n_sync_steps)):
+                    tracer.start(i, timer)
+                    if i % n_update == 0:
+                        # on-policy rollout for some episodes
+                        episodes = []
+                        n_ticks = 0
+                        episode_rewards = []
+                        epsilon = state.epsilon
+
+                        # update the target Q model
+                        if i % args['n_update_target_interval'] == 0:
+                            timer.start('target_sync')
+                            sess.run(update_target_q_op,
+                                     **tracer.run_kwargs())
+                            timer.stop('target_sync')
+
+                        # sample rollouts
+                        timer.start('rollout')
+                        if actor_pool is not None:
+                            # episodes of the actor threads, with the policy of
+                            # a few updates ago
+                            versions, episodes = actor_pool.get(
+                                args['n_update_episodes'])
+                            n_ticks = sum(len(observations)
+                                          for observations, _, _ in episodes)
+                            episode_rewards = [np.sum(rewards)
+                                               for _, _, rewards in episodes]
+                        elif lockstep_envs is not None:
+                            # in lockstep over several env instances
+                            episodes = rollouts(
+                                partial(policy, epsilon), env_spec,
+                                lockstep_envs, args['n_update_episodes'],
+                                env_render,
+                                n_obs_ticks=args['n_obs_ticks'], timer=timer,
+                                memory=memory)
+                            n_ticks = sum(len(observations)
+                                          for observations, _, _ in episodes)
+                            episode_rewards = [np.sum(rewards)
+                                               for _, _, rewards in episodes]
+                        else:
+                            for j in xrange(args['n_update_episodes']):
+                                observations, actions, rewards = rollout(
+                                    partial(policy, epsilon),
+                                    env_spec,
+                                    env_step,
+                                    env_reset,
+                                    env_render,
+                                    n_obs_ticks=args['n_obs_ticks'],
+                                    timer=timer,
+                                    memory=memory,
+                                )
+                                episodes.append((observations, actions, rewards))
+                                n_ticks += len(observations)
+                                episode_rewards.append(np.sum(rewards))
+                        timer.stop('rollout')
+                        memory.sample('rollout')
+
+                        avg_len_episode = n_ticks * 1. / args['n_update_episodes']
+                        avg_tick_reward = np.sum(episode_rewards) * 1. / n_ticks
+
+                        # transform and preprocess the rollouts
+                        timer.start('preprocess')
+                        batch = preprocess(episodes, args, policy_input_shape)
+                        timer.stop('preprocess')
+                        memory.sample('preprocess')
+                        memory.record('episodes', episodes)
+                        memory.record('obs', batch['obs_ph'])
+                        memory.record('next_obs', batch['next_obs_ph'])
+
+                    # sample a fixed size subset for training
+                    # n_ticks = 64
+                    # sample_ind = np.random.choice(range(len(obs)), n_ticks, False)
+                    # _obs = np.asarray(obs)[sample_ind]
+                    # _action_inds = np.asarray(action_inds)[sample_ind]
+                    # _all_rewards = np.asarray(all_rewards)[sample_ind]
+                    # _targets = np.asarray(targets)[sample_ind]
+
+                    # improve estimated Q_hat
+                    for j in xrange(args['n_value_updates']):
+                        # estimate and accumulate gradients by batches
+                        timer.start('gradients')
+                        acc_grads_val, acc_obj_val = accumulate_gradients(
+                            sess, handles, batch, args, tracer=tracer)
+                        acc_grads = dict(zip(grads, acc_grads_val))
+                        timer.stop('gradients')
+                        memory.sample('gradients')
+                        timer.count('learner_samples', n_ticks)
+
+                        # update current Q model
+                        update_dict = {
+                            avg_len_episode_ph: avg_len_episode,
+                            avg_episode_reward_ph: np.mean(episode_rewards),
+                            max_episode_reward_ph: np.max(episode_rewards),
+                            min_episode_reward_ph: np.min(episode_rewards),
+                            avg_tick_reward_ph: avg_tick_reward,
+                            avg_objective_ph: acc_obj_val / n_ticks,
+                            epsilon_ph: epsilon,
                         }
-
-                        # sum up gradients
-                        obj_val, grad_vars_val = sess.run([
-                            objective,
-                            grad_vars,
-                            ], feed_dict=grad_feed)
-                        for (g, _), (g_val, _) in zip(grad_vars, grad_vars_val):
-                            acc_grads[g] += g_val * (end - start) / n_ticks
-                        acc_obj_val += obj_val
-
-                    # update current Q model
-                    update_dict = {
-                        avg_len_episode_ph: avg_len_episode,
-                        avg_episode_reward_ph: np.mean(episode_rewards),
-                        max_episode_reward_ph: np.max(episode_rewards),
-                        min_episode_reward_ph: np.min(episode_rewards),
-                        avg_tick_reward_ph: avg_tick_reward,
-                        avg_objective_ph: acc_obj_val / n_ticks,
-                        epsilon_ph: epsilon,
+                        update_dict.update(acc_grads)
+                        # summaries are only computed on the sampled iterations
+                        summary_ops = []
+                        if not args['no_summary']:
+                            if i % args['n_summary_interval'] == 0:
+                                summary_ops.append(scalar_summary_op)
+                            if i % args['n_histogram_interval'] == 0:
+                                summary_ops.append(histogram_summary_op)
+                        timer.start('apply_gradients')
+                        results = sess.run(
+                            [update_q_op, learning_rate] + summary_ops,
+                            feed_dict=update_dict,
+                            **tracer.run_kwargs())
+                        timer.stop('apply_gradients')
+                        state.update(results[1])
+                        summary_vals = results[2:]
+
+                        timer.start('summary')
+                        for summary_val in summary_vals:
+                            writer.add_summary(summary_val, state.global_step)
+                        timer.stop('summary')
+
+                    timer.start('checkpoint')
+                    checkpoints.maybe_save(i)
+                    timer.stop('checkpoint')
+                    tracer.finish('train', state.global_step)
+
+                    record = {
+                        'iteration': i,
+                        'global_step': state.global_step,
+                        'learning_rate': state.learning_rate,
+                        'epsilon': epsilon,
+                        'avg_len_episode': avg_len_episode,
+                        'avg_episode_reward': np.mean(episode_rewards),
+                        'max_episode_reward': np.max(episode_rewards),
+                        'min_episode_reward': np.min(episode_rewards),
+                        'avg_tick_reward': avg_tick_reward,
+                        'avg_objective': acc_obj_val / n_ticks,
+                        'env_ticks': n_ticks,
                     }
-                    update_dict.update(acc_grads)
-                    summary_val, _ = sess.run([summary_op, update_q_op],
-                                              feed_dict=update_dict)
-
-                    if not args['no_summary']:
-                        writer.add_summary(summary_val, global_step.eval())
-
-                if i % args['n_save_interval'] == 0:
-                    saver.save(sess, args['checkpoint_dir'] + '/model',
-                               global_step=global_step.eval())
-
-            # save again at the end
-            saver.save(sess, args['checkpoint_dir'] + '/model',
-                       global_step=global_step.eval())
+                    if actor_pool is not None:
+                        # how many updates behind the episodes were
+                        lags = [state.global_step - v for v in versions]
+                        record.update({
+                            'avg_policy_lag': np.mean(lags),
+                            'max_policy_lag': np.max(lags),
+                        })
+
+                    if args['n_timing_interval'] > 0 \
+                        and (i + 1) % args['n_timing_interval'] == 0:
+                        stats = timer.report()
+                        print_stats(stats)
+                        record.update(stats)
+                        if not args['no_summary']:
+                            write_stats(writer, state.global_step, stats)
+
+                    if args['n_memory_interval'] > 0 \
+                        and (i + 1) % args['n_memory_interval'] == 0:
+                        stats = memory.report()
+                        print_stats(stats, 'memory')
+                        record.update(stats)
+                        if not args['no_summary']:
+                            write_stats(writer, state.global_step, stats)
+
+                    metrics.write(record)
+            finally:
+                # the actors use the session
+                if actor_pool is not None:
+                    actor_pool.close()
+                # save again at the end
+                checkpoints.close()
+                if evaluator is not None:
+                    # after the last checkpoint, which it still evaluates
+                    stop_evaluator(evaluator)
+                metrics.close()
 
 def build_argparser():
     parse = argparse.ArgumentParser()
@@ -315,6 +704,11 @@ def build_argparser():
     parse.add_argument('--n_obs_ticks', type=int, default=1)
     parse.add_argument('--timestep_limit', type=int, default=10**9)
     parse.add_argument('--use_render_state', action='store_true')
+    # env instances kept reset in the background for the next episodes
+    parse.add_argument('--n_spare_envs', type=int, default=0)
+    # env instances the learner rolls out the episodes of an update on in
+    # lockstep, with the steps of remote envs all in flight at once
+    parse.add_argument('--n_lockstep_envs', type=int, default=1)
     parse.add_argument('--scale', type=float, default=1.)
     parse.add_argument('--interpolation', choices=['nearest', 'bilinear',
                                                    'bicubic', 'cubic'],
@@ -323,18 +717,62 @@ def build_argparser():
     # objective options
     parse.add_argument('--reg_coeff', type=float, default=0.0001)
     parse.add_argument('--reward_gamma', type=float, default=1.)
+    # ticks of rewards in the targets before bootstrapping
+    parse.add_argument('--n_step', type=int, default=1)
     parse.add_argument('--dropout_rate', type=float, default=0.2)
 
     parse.add_argument('--restart', action='store_true')
     parse.add_argument('--checkpoint_dir', required=True)
     parse.add_argument('--no_summary', action='store_true')
     parse.add_argument('--summary_prefix', default='')
+    parse.add_argument('--n_summary_interval', type=int, default=1)
+    parse.add_argument('--n_histogram_interval', type=int, default=100)
+    parse.add_argument('--n_timing_interval', type=int, default=0)
+    parse.add_argument('--n_trace_interval', type=int, default=0)
+    parse.add_argument('--n_memory_interval', type=int, default=0)
+    parse.add_argument('--memory_budget_mb', type=float, default=0.)
+    parse.add_argument('--memory_budget_action', choices=['warn', 'truncate'],
+                       default='warn')
+    parse.add_argument('--metrics_path')
+    parse.add_argument('--metrics_flush_secs', type=float, default=30.)
+    # asynchronous actor-learner threads sharing the session, thread k
+    # starts from the k-th initial epsilon (cycled)
+    parse.add_argument('--n_learner_threads', type=int, default=1)
+    parse.add_argument('--thread_initial_epsilons', type=float, nargs='+')
+    # actor threads rolling out with the shared session into a queue of
+    # actor_queue_size episodes
+    parse.add_argument('--n_actor_threads', type=int, default=0)
+    parse.add_argument('--actor_queue_size', type=int, default=16)
+    parse.add_argument('--graph_cache_dir')
+
+    # session threads, 0 leaves the choice to tensorflow
+    parse.add_argument('--intra_op_threads', type=int, default=0)
+    parse.add_argument('--inter_op_threads', type=int, default=0)
+    # cpu lists like 0-3,8 to pin the session threads, the main thread
+    # and the background evaluator to
+    parse.add_argument('--learner_cpus')
+    parse.add_argument('--actor_cpus')
+    parse.add_argument('--eval_cpus')
+    # defaults for any of these flags from e.g. autotune.py
+    parse.add_argument('--tuned_config')
     parse.add_argument('--render', action='store_true')
+    # frames a second shown or recorded, and how many may wait for the
+    # consumer thread before the oldest is dropped
+    parse.add_argument('--render_fps', type=float, default=30.)
+    parse.add_argument('--render_buffer_size', type=int, default=4)
+
+    # background evaluation of checkpoints
+    parse.add_argument('--background_eval', action='store_true')
+    parse.add_argument('--n_eval_samples', type=int, default=4)
+    parse.add_argument('--eval_poll_secs', type=float, default=30.)
+    parse.add_argument('--eval_threads', type=int, default=1)
+    parse.add_argument('--eval_nice', type=int, default=10)
 
     # how many episodes to rollout before update parameters
     parse.add_argument('--n_update_episodes', type=int, default=4)
     parse.add_argument('--n_batch_ticks', type=int, default=128)
     parse.add_argument('--n_save_interval', type=int, default=1)
+    parse.add_argument('--save_secs', type=float, default=0.)
     parse.add_argument('--n_train_steps', type=int, default=10**5)
     parse.add_argument('--n_update_target_interval', type=int, default=4)
     parse.add_argument('--n_value_updates', type=int, default=1)
@@ -364,36 +802,19 @@ def build_argparser():
 
 
 if __name__ == '__main__':
-    from functools import partial
-    from util import passthrough, use_render_state, scale_image
+    from util import env_from_args
+    from frames import frames_from_args
 
     # arguments
     parse = build_argparser()
-    args = parse.parse_args()
+    args = parse_args_with_config(parse)
 
-    gym_env = gym.make(args.env)
-    if args.use_render_state:
-        env_spec, env_step, env_reset, env_render = use_render_state(
-            gym_env, args.scale, args.interpolation)
-    else:
-        env_spec, env_step, env_reset, env_render = passthrough(gym_env)
-        if len(env_spec['observation_shape']) == 3 \
-            and args.scale != 1.:
-            # the observation space is an image
-            # apply scaling
-            _env_reset = env_reset
-            _env_step = env_step
-            env_reset = lambda : scale_image(args.scale, args.interpolation,
-                                             _env_reset())
-            def env_step(action):
-                im, reward, done = _env_step(action)
-                return scale_image(args.scale,
-                                   args.interpolation,
-                                   im), reward, done
-
-    env_spec['timestep_limit'] = min(gym_env.spec.timestep_limit,
-                                     args.timestep_limit)
-    env_render = env_render if args.render else None
+    # save a final checkpoint when the job gets killed
+    exit_on_sigterm()
+
+    # gym is only loaded past argument parsing
+    gym_env, (env_spec, env_step, env_reset, env_render) = env_from_args(
+        vars(args))
 
     print '* environment', args.env
     print 'observation shape', env_spec['observation_shape']
@@ -404,13 +825,19 @@ if __name__ == '__main__':
     # model
     model = importlib.import_module('models.%s' % args.model)
 
-    # train
-    # gym monitor
+    # gym monitor, for the episode statistics only, the videos are
+    # recorded from the rendered frames
     if args.monitor:
-        env.monitor.start(args['monitor_dir'])
-
-    train_q(env_spec, env_step, env_reset, env_render, vars(args),
-          model.build_q_model)
+        gym_env.monitor.start(args.monitor_dir, video_callable=False)
+    # rendering and recording in a consumer thread
+    env_render, frames = frames_from_args(vars(args), env_render)
 
-    if args.monitor:
-        env.monitor.close()
+    # train
+    try:
+        train_q(env_spec, env_step, env_reset, env_render, vars(args),
+                model.build_q_model)
+    finally:
+        if frames is not None:
+            frames.close()
+        if args.monitor:
+            gym_env.monitor.close()
@@ -1,8 +1,13 @@
-from scipy.misc import imresize
 from functools import partial
 from Queue import deque
+import os, sys, time, subprocess, json, hashlib, ast
 import numpy as np
-import tensorflow as tf
+from timing import NULL_TIMER
+from memory import NULL_MEMORY
+from metrics import eval_metrics_path
+
+# tensorflow and scipy are imported lazily inside the functions that need
+# them so that entry points can parse arguments and spawn workers quickly
 
 def vector_slice(A, B):
     """ Returns values of rows i of A at column B[i]
@@ -15,6 +20,7 @@ def vector_slice(A, B):
       A =[[1,2], B = [0,1], vector_slice(A,B) -> [1,4]
           [3,4]]
     """
+    import tensorflow as tf
     linear_index = (tf.shape(A)[1] * tf.range(0, tf.shape(A)[0]))
     linear_A = tf.reshape(A, [-1])
     return tf.gather(linear_A, B + linear_index)
@@ -39,9 +45,87 @@ def passthrough(gym_env):
         'observation_shape': gym_env.observation_space.shape,
     }
     step = lambda action: gym_env.step(action)[:3]
+    if hasattr(gym_env, 'send_step'):
+        # a remote env, whose steps step_all can keep in flight together
+        step.send = gym_env.send_step
+        step.recv = lambda: gym_env.recv_step()[:3]
     return spec, step, gym_env.reset, gym_env.render
 
+def make_env(name, seed=None):
+    '''gym.make(name), or a synthetic.SyntheticEnv for names like
+    synthetic-84x84x3-6[-200[-geometric[-0.001]]] that give the observation
+    shape, the number of actions and optionally the mean episode length,
+    its distribution and the seconds every step costs, or a
+    remote_env.RemoteEnv for names like remote:/tmp/env.sock. A seed other
+    than None seeds the episodes of the env; remote envs are seeded by
+    their server.'''
+    if name.startswith('remote:'):
+        from remote_env import RemoteEnv
+        return RemoteEnv(name[len('remote:'):])
+    if name.startswith('synthetic-'):
+        from synthetic import SyntheticEnv
+        # the step cost may be written like 1e-3
+        fields = name.split('-', 5)[1:]
+        kwargs = {'episode_seed': seed}
+        if len(fields) > 2:
+            kwargs['episode_length'] = int(fields[2])
+        if len(fields) > 3:
+            kwargs['length_distribution'] = fields[3]
+        if len(fields) > 4:
+            kwargs['step_secs'] = float(fields[4])
+        return SyntheticEnv([int(d) for d in fields[0].split('x')],
+                            int(fields[1]), **kwargs)
+    import gym
+    gym_env = gym.make(name)
+    if seed is not None:
+        gym_env.seed(seed)
+    return gym_env
+
+def env_from_args(args, instance=0):
+    '''the gym env named by the env flags of the scripts and its
+    environment 4-tuple, over n_spare_envs more instances with background
+    resets if there are any. Instances of one run, numbered by instance,
+    and their spares are seeded apart from np_seed, so that they do not
+    all roll out the same episodes.'''
+    n_envs = 1 + args['n_spare_envs']
+    seeds = [args['np_seed'] + instance * n_envs + k for k in xrange(n_envs)]
+    gym_env, env = make_env_tuple(args, seeds[0])
+    if args['n_spare_envs'] > 0:
+        from reset_pool import ResetPool
+        env = ResetPool([env] + [make_env_tuple(args, seed)[1]
+                                 for seed in seeds[1:]]).env()
+    return gym_env, env
+
+def make_env_tuple(args, seed=None):
+    gym_env = make_env(args['env'], seed)
+    if args['use_render_state']:
+        env_spec, env_step, env_reset, env_render = use_render_state(
+            gym_env, args['scale'], args['interpolation'])
+    else:
+        env_spec, env_step, env_reset, env_render = passthrough(gym_env)
+        if len(env_spec['observation_shape']) == 3 and args['scale'] != 1.:
+            # the observation space is an image, scale it
+            si = partial(scale_image, args['scale'], args['interpolation'])
+            _env_reset = env_reset
+            _env_step = env_step
+            env_reset = lambda: si(_env_reset())
+            def env_step(action):
+                im, reward, done = _env_step(action)
+                return si(im), reward, done
+            if hasattr(_env_step, 'send'):
+                env_step.send = _env_step.send
+                def recv():
+                    im, reward, done = _env_step.recv()
+                    return si(im), reward, done
+                env_step.recv = recv
+            env_spec['observation_shape'] = si(
+                np.zeros(env_spec['observation_shape'], np.uint8)).shape
+    env_spec['timestep_limit'] = min(gym_env.spec.timestep_limit,
+                                     args['timestep_limit'])
+    return gym_env, (env_spec, env_step, env_reset, env_render)
+
 def scale_image(scale, interpolation, im):
+    from scipy.misc import imresize
     return imresize(im, scale, interp=interpolation)
 
 def use_render_state(gym_env, scale, interpolation='nearest'):
@@ -74,31 +158,171 @@ def duplicate_obs(observations, n_obs_ticks):
         obs_q.append(observations[i:l-n_obs_ticks+i+1])
     return np.concatenate(obs_q, axis=-1)
 
+def generalized_advantages(rewards, values, gamma, lam):
+    """ Generalized advantage estimates and lambda-returns of every tick
+
+    rewards and values are lists of the per-episode rewards and state
+    values; the last tick of every episode is taken as terminal. The
+    episodes are padded into one matrix and discounted together.
+    """
+    from scipy.signal import lfilter
+    lengths = np.array([len(r) for r in rewards])
+    mask = np.arange(lengths.max()) < lengths[:, None]
+    r = np.zeros(mask.shape)
+    r[mask] = np.concatenate(rewards)
+    # the value past the end of an episode stays 0
+    v = np.zeros((mask.shape[0], mask.shape[1] + 1))
+    v[:, :-1][mask] = np.concatenate(values)
+    deltas = (r + gamma * v[:, 1:] - v[:, :-1]) * mask
+    # reverse discounted sums along every row, the padding adds nothing
+    advantages = lfilter([1.], [1., -gamma * lam], deltas[:, ::-1],
+                         axis=1)[:, ::-1][mask]
+    return advantages, advantages + v[:, :-1][mask]
+
+def n_step_returns(rewards, n_step, gamma):
+    """ n-step discounted reward sums and the ticks to bootstrap from
+
+    rewards is a list of the per-episode rewards. For every tick t of the
+    concatenated episodes it returns the sum of gamma**k * r[t+k] over the
+    next n_step ticks within its episode, the index t + n_step of the tick
+    to bootstrap from and whether that tick is still in the episode (1.)
+    or past its end (0.), which makes t + n_step terminal.
+    """
+    lengths = np.array([len(r) for r in rewards])
+    ends = np.repeat(np.cumsum(lengths), lengths)
+    r = np.concatenate(rewards)
+    ticks = np.arange(len(r))
+    inds = ticks[:, None] + np.arange(n_step)
+    in_episode = inds < ends[:, None]
+    sums = np.sum(np.where(in_episode, r[np.minimum(inds, len(r) - 1)], 0.)
+                  * gamma ** np.arange(n_step), axis=1)
+    bootstrap = ticks + n_step
+    return sums, bootstrap, (bootstrap < ends).astype(float)
+
 def rollout(behavior_policy, env_spec, env_step, env_reset,
-            env_render=None, n_obs_ticks=1):
-    '''rollout based on behavior policy from an environment'''
+            env_render=None, n_obs_ticks=1, timer=NULL_TIMER,
+            memory=NULL_MEMORY, log_probs=None):
+    '''rollout based on behavior policy from an environment, appending the
+    log-probabilities of the actions taken to log_probs if it is a list'''
     # pad the first observation with zeros
+    timer.start('env_reset')
     obs = env_reset()
+    timer.stop('env_reset')
     obs_q = deque(pad_zeros([obs], n_obs_ticks), n_obs_ticks)
 
     observations, actions, rewards = [], [], []
     done = False
     t = 0
+    memory.start_rollout()
     while not done and t < env_spec['timestep_limit']:
+        if memory.over_budget(t):
+            break
+        timer.start('policy')
         policy_input = np.concatenate(obs_q, axis=-1)
         action_probs = behavior_policy(policy_input)
         action = np.random.choice(env_spec['action_size'], p=action_probs)
+        if log_probs is not None:
+            log_probs.append(np.log(action_probs[action]))
+        timer.stop('policy')
         obs_q.popleft()
         observations.append(obs)
         actions.append(action)
+        timer.start('env_step')
         obs, reward, done = env_step(action)
+        timer.stop('env_step')
         rewards.append(reward)
         obs_q.append(obs)
         if env_render != None:
+            timer.start('render')
             env_render()
+            timer.stop('render')
         t += 1
+    timer.count('env_ticks', t)
+    timer.count('policy_calls', t)
     return observations, actions, rewards
 
+def step_all(env_steps, actions):
+    '''step every env with its action and return the results of the steps
+    in order; the steps of remote envs, see passthrough, are all sent
+    before the first reply is awaited, so that their servers step in
+    parallel while the local envs step in turn'''
+    for env_step, action in zip(env_steps, actions):
+        if hasattr(env_step, 'send'):
+            env_step.send(action)
+    return [env_step.recv() if hasattr(env_step, 'send')
+            else env_step(action)
+            for env_step, action in zip(env_steps, actions)]
+
+def rollouts(behavior_policy, env_spec, envs, n_episodes, env_render=None,
+             n_obs_ticks=1, timer=NULL_TIMER, memory=NULL_MEMORY,
+             log_probs=None):
+    '''n_episodes rollouts like rollout() but in lockstep over envs, pairs
+    of env_step and env_reset of instances of the same env: every tick the
+    running episodes all take their step at once through step_all, and an
+    instance whose episode ends starts the next one. env_render renders
+    the first instance. The episodes come in the order they started, with
+    the log-probabilities of their actions appended to log_probs in that
+    order if it is a list.'''
+    # the observations, actions, rewards and log-probs of every episode
+    episodes = []
+    # per instance its episode, last observation, observation queue and
+    # tick, or None once no more episodes are to be started
+    slots = [None] * len(envs)
+
+    def start(k):
+        if len(episodes) == n_episodes:
+            slots[k] = None
+            return
+        timer.start('env_reset')
+        obs = envs[k][1]()
+        timer.stop('env_reset')
+        episodes.append(([], [], [], []))
+        slots[k] = [len(episodes) - 1, obs,
+                    deque(pad_zeros([obs], n_obs_ticks), n_obs_ticks), 0]
+
+    memory.start_rollout()
+    for k in xrange(len(envs)):
+        start(k)
+    n_ticks = 0
+    while any(slot is not None for slot in slots):
+        running = [k for k, slot in enumerate(slots) if slot is not None]
+        actions = []
+        timer.start('policy')
+        for k in running:
+            i, obs, obs_q, t = slots[k]
+            action_probs = behavior_policy(np.concatenate(obs_q, axis=-1))
+            action = np.random.choice(env_spec['action_size'],
+                                      p=action_probs)
+            episodes[i][0].append(obs)
+            episodes[i][1].append(action)
+            episodes[i][3].append(np.log(action_probs[action]))
+            obs_q.popleft()
+            actions.append(action)
+        timer.stop('policy')
+        timer.start('env_step')
+        results = step_all([envs[k][0] for k in running], actions)
+        timer.stop('env_step')
+        if env_render != None and running[0] == 0:
+            timer.start('render')
+            env_render()
+            timer.stop('render')
+        for k, (obs, reward, done) in zip(running, results):
+            slot = slots[k]
+            episodes[slot[0]][2].append(reward)
+            slot[1] = obs
+            slot[2].append(obs)
+            slot[3] += 1
+            n_ticks += 1
+            if done or slot[3] >= env_spec['timestep_limit'] \
+                or memory.over_budget(slot[3]):
+                start(k)
+    timer.count('env_ticks', n_ticks)
+    timer.count('policy_calls', n_ticks)
+    if log_probs is not None:
+        for episode in episodes:
+            log_probs.extend(episode[3])
+    return [episode[:3] for episode in episodes]
+
 # policy modifiers
 def to_greedy(policy_prob_func, obs):
     ps = policy_prob_func(obs)
@@ -112,10 +336,48 @@ def to_epsilon_greedy(epsilon, policy_prob_func, obs):
     z[np.argmax(ps)] += 1. - epsilon
     return z
 
+# training state
+class TrainingState(object):
+    '''Host-side mirror of the global step and the schedules derived from it.
+
+    It is read from the graph once with sync() and afterwards advanced with
+    update() from values the update sess.run fetches anyway, so schedules
+    and logging need no extra session round trips.'''
+
+    def __init__(self, epsilon_schedule=None):
+        self.global_step = 0
+        # learning rate used by the latest update
+        self.learning_rate = None
+        self.epsilon_schedule = epsilon_schedule
+
+    def sync(self, sess, global_step, learning_rate):
+        global_step_val, learning_rate_val = sess.run([global_step,
+                                                       learning_rate])
+        self.global_step = int(global_step_val)
+        self.learning_rate = float(learning_rate_val)
+
+    def update(self, learning_rate_val):
+        '''account for one apply_gradients that used learning_rate_val'''
+        self.global_step += 1
+        self.learning_rate = float(learning_rate_val)
+
+    @property
+    def epsilon(self):
+        return self.epsilon_schedule(self.global_step)
+
 # tensorflow utility
+def find_meta_path(checkpoint_path):
+    '''metagraph of a checkpoint, either written along with it or once for
+    the whole run by checkpoint.CheckpointManager'''
+    meta_path = checkpoint_path + '.meta'
+    if os.path.exists(meta_path):
+        return meta_path
+    return os.path.join(os.path.dirname(checkpoint_path), 'model.meta')
+
 def test_restore_vars(sess, checkpoint_path, meta_path):
     """ Restore saved net, global score and step, and epsilons OR
     create checkpoint directory for later storage. """
+    import tensorflow as tf
     saver = tf.train.import_meta_graph(meta_path)
     saver.restore(sess, checkpoint_path)
 
@@ -123,3 +385,190 @@ def test_restore_vars(sess, checkpoint_path, meta_path):
     print '* using metagraph from %s' % meta_path
     saver.restore(sess, checkpoint_path)
     return True
+
+# background evaluation
+def launch_evaluator(args, model_type, summary_dir=None):
+    '''spawn eval.py as a niced side process that evaluates every new
+    checkpoint in args['checkpoint_dir'] with the greedy policy'''
+    eval_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'eval.py')
+    cmd = [sys.executable, eval_path,
+           '--watch',
+           '--checkpoint_path', args['checkpoint_dir'],
+           '--model', model_type,
+           '--policy', 'greedy',
+           '--no_render',
+           '--env', args['env'],
+           '--n_samples', str(args['n_eval_samples']),
+           '--n_obs_ticks', str(args['n_obs_ticks']),
+           '--timestep_limit', str(args['timestep_limit']),
+           '--scale', str(args['scale']),
+           '--interpolation', args['interpolation'],
+           '--poll_secs', str(args['eval_poll_secs']),
+           '--n_threads', str(args['eval_threads']),
+           '--nice', str(args['eval_nice']),
+           '--parent_pid', str(os.getpid()),
+           ]
+    if args['use_render_state']:
+        cmd.append('--use_render_state')
+    if summary_dir is not None:
+        # beside the trainer's own event files, not among them
+        cmd += ['--summary_dir', os.path.join(summary_dir, 'eval')]
+    if args.get('eval_cpus') is not None:
+        cmd += ['--cpus', args['eval_cpus']]
+    if args.get('metrics_path') is not None:
+        cmd += ['--metrics_path', eval_metrics_path(args['metrics_path'])]
+
+    log_path = os.path.join(args['checkpoint_dir'], 'eval.log')
+    print '* launching background evaluator, logging to', log_path
+    with open(log_path, 'ab') as log:
+        # the child keeps a descriptor of its own
+        return subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+
+def stop_evaluator(evaluator, timeout=60.):
+    '''ask a background evaluator to stop once it has evaluated the latest
+    checkpoint, and kill it if it has not exited after timeout seconds'''
+    if evaluator.poll() is None:
+        # eval.py takes SIGTERM as the request to finish up
+        evaluator.terminate()
+    deadline = time.time() + timeout
+    while evaluator.poll() is None and time.time() < deadline:
+        time.sleep(0.1)
+    if evaluator.poll() is None:
+        print '* background evaluator did not stop in %gs, killing it' \
+            % timeout
+        evaluator.kill()
+        evaluator.wait()
+
+def parse_args_with_config(parse, argv=None):
+    '''parse argv, taking the defaults of the flags set in the JSON file
+    given by --tuned_config; flags on the command line still win'''
+    args, _ = parse.parse_known_args(argv)
+    if args.tuned_config is not None:
+        with open(args.tuned_config) as f:
+            config = json.load(f)
+        print '* loaded tuned flags from', args.tuned_config
+        for k in sorted(config.keys()):
+            print k, config[k]
+        parse.set_defaults(**config)
+    return parse.parse_args(argv)
+
+def session_config(args):
+    '''ConfigProto with the session thread counts of args, 0 leaves the
+    choice to tensorflow'''
+    import tensorflow as tf
+    return tf.ConfigProto(
+        intra_op_parallelism_threads=args['intra_op_threads'],
+        inter_op_parallelism_threads=args['inter_op_threads'])
+
+# graph cache
+def graph_cache_key(model_name, observation_shape, action_size,
+                    hyperparameters, source_paths=()):
+    '''digest of everything that determines a training graph: the model,
+    the input and output sizes, the graph-affecting hyperparameters and the
+    source of the code that builds it, source_paths along with this module
+    and the modules of the repository they import'''
+    h = hashlib.sha1(json.dumps({
+        'model': model_name,
+        'observation_shape': list(observation_shape),
+        'action_size': action_size,
+        'hyperparameters': hyperparameters,
+    }, sort_keys=True))
+    # vector_slice and the rest of the graph helpers live here
+    this_path = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    for path in local_sources(list(source_paths) + [this_path]):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def local_sources(paths):
+    '''paths and the source paths of the modules of the repository that
+    they import, transitively, in a stable order'''
+    root = os.path.dirname(os.path.abspath(__file__))
+    seen = set()
+    todo = [os.path.abspath(path) for path in paths]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+        names = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module \
+                and node.level == 0:
+                # the imported names may be submodules
+                names += [node.module] + ['%s.%s' % (node.module, alias.name)
+                                          for alias in node.names]
+        for name in names:
+            # absolute, or implicitly relative to the importing module
+            for base in [root, os.path.dirname(path)]:
+                module_path = os.path.join(base, *name.split('.'))
+                for candidate in [module_path + '.py',
+                                  os.path.join(module_path, '__init__.py')]:
+                    if os.path.exists(candidate):
+                        todo.append(candidate)
+    return sorted(seen)
+
+def export_graph_handles(handles):
+    '''register the tensors and ops of handles in named collections so that
+    they survive a metagraph export'''
+    import tensorflow as tf
+    for name, handle in handles.iteritems():
+        if handle is None or isinstance(handle, tf.train.Saver):
+            continue
+        if isinstance(handle, list):
+            tf.add_to_collection('graph_handle_lists', name)
+        else:
+            handle = [handle]
+        tf.add_to_collection('graph_handles', name)
+        for x in handle:
+            if isinstance(x, tf.Variable):
+                x = x.value()
+            tf.add_to_collection('graph_handles/%s' % name, x)
+
+def import_graph_handles():
+    '''inverse of export_graph_handles on an imported metagraph'''
+    import tensorflow as tf
+    list_names = tf.get_collection('graph_handle_lists')
+    handles = {}
+    for name in tf.get_collection('graph_handles'):
+        handle = tf.get_collection('graph_handles/%s' % name)
+        handles[name] = handle if name in list_names else handle[0]
+    return handles
+
+def load_or_build_graph(cache_dir, key, build_graph):
+    '''import the training metagraph cached under key into the default graph
+    or call build_graph and cache its result.
+
+    build_graph returns a dict of handles holding tensors, ops, lists of
+    them and the saver under 'saver'. Handles that are None are dropped.'''
+    import tensorflow as tf
+    if cache_dir is None:
+        return build_graph()
+
+    meta_path = os.path.join(cache_dir, '%s.meta' % key)
+    if os.path.exists(meta_path):
+        print '* importing cached graph from %s' % meta_path
+        saver = tf.train.import_meta_graph(meta_path)
+        handles = import_graph_handles()
+        handles['saver'] = saver
+        return handles
+
+    handles = build_graph()
+    export_graph_handles(handles)
+    if not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass
+    # write to a temporary file first so that concurrent runs never import
+    # a partially written metagraph
+    tmp_path = '%s.%i.tmp' % (meta_path, os.getpid())
+    handles['saver'].export_meta_graph(tmp_path)
+    os.rename(tmp_path, meta_path)
+    print '* cached graph at %s' % meta_path
+    return handles